@@ -0,0 +1,248 @@
+# benchmarks/suite.py
+
+# Reproducible benchmarks of the preprocessing, training and inference hot paths
+# on synthetic SMILES sets (benchmarks/synthetic.py):
+#   featurisation   one_hot_encoding, get_atom_features (reference), get_atom_feature_matrix
+#   graphs          molecule_to_graph, batch_from_csv (cold cache)
+#   collation       PyG DataLoader and PackedGraphLoader batching
+#   train           forward + backward + optimizer step for each of the four models
+#   inference       batched forward passes under torch.inference_mode for each model
+# Each model is timed as build_model constructs it by default (what train_model and
+# the CLI train), plus the variants in MODEL_VARIANTS under names of their own.
+# Every benchmark reports the best of several repeats as items per second. Results
+# are written as JSON and can be compared against a saved baseline, flagging every
+# benchmark whose throughput dropped by more than a tolerance.
+#
+# Usage (from GNN_code):
+#   python -m benchmarks.suite -n 10000 --output data/benchmarks/latest.json --baseline data/benchmarks/baseline.json
+#   python -m benchmarks.suite -n 10000 --save-baseline data/benchmarks/baseline.json
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import torch
+from torch_geometric.loader import DataLoader
+from rdkit import Chem, rdBase
+from benchmarks.synthetic import SIZE_DISTRIBUTIONS, synthetic_dataset
+from models.artifacts import ARCHITECTURES, build_model
+from models.engine import feature_dims, model_forward
+from preprocessing.featurisation import PERMITTED_ATOMS, get_atom_feature_matrix, get_atom_features, one_hot_encoding
+from preprocessing.graph_cache import featuriser_version
+from preprocessing.packed_store import PackedGraphDataset, PackedGraphLoader, pack_graphs
+from preprocessing.smiles_to_graph import batch_from_csv, molecule_to_graph
+
+STAGES = ('featurisation', 'graphs', 'collation', 'train', 'inference')
+
+# Additional constructions per architecture, benchmarked as e.g. train_step[MPNNModel/dedup]
+MODEL_VARIANTS = {'MPNNModel': {'dedup': {'edge_mode': 'dedup'}, 'lowrank': {'edge_mode': 'lowrank'}}}
+
+# Graph counts for slow models, below max_model_graphs: the default (dense) MPNN edge
+# network runs at a few dozen graphs/s, and throughput does not depend on the count
+MODEL_GRAPH_CAPS = {'MPNNModel': 128}
+
+def model_variants(architectures) -> list:
+    """(benchmark name, architecture, constructor arguments) of every model to time."""
+    variants = []
+    for name in architectures:
+        variants.append((name, name, {}))
+        variants += [(f"{name}/{variant}", name, kwargs) for variant, kwargs in MODEL_VARIANTS.get(name, {}).items()]
+    return variants
+
+def _best_time(fn, repeats: int) -> float:
+    """Fastest of repeats calls of fn, in seconds."""
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def _record(results, name, stage, seconds, items, unit):
+    results[name] = {'stage': stage, 'seconds': seconds, 'items': items, 'unit': unit,
+                     'per_sec': items / seconds if seconds > 0 else float('inf')}
+    print(f"{name:>32}: {results[name]['per_sec']:>12,.0f} {unit}/s ({seconds:.3f} s for {items:,})")
+
+def _bench_featurisation(results, smiles, repeats):
+    mols = [Chem.MolFromSmiles(s) for s in smiles]
+    atoms = [atom for mol in mols for atom in mol.GetAtoms()]
+    symbols = [atom.GetSymbol() for atom in atoms]
+
+    _record(results, 'one_hot_encoding', 'featurisation',
+            _best_time(lambda: [one_hot_encoding(s, PERMITTED_ATOMS) for s in symbols], repeats), len(symbols), 'calls')
+    _record(results, 'get_atom_features', 'featurisation',
+            _best_time(lambda: [get_atom_features(a) for a in atoms], repeats), len(atoms), 'atoms')
+    _record(results, 'get_atom_feature_matrix', 'featurisation',
+            _best_time(lambda: [get_atom_feature_matrix(m) for m in mols], repeats), len(atoms), 'atoms')
+
+def _bench_graphs(results, df, repeats, n_jobs, work_dir):
+    smiles, labels = df['SMILES'].tolist(), df['Inh Power'].tolist()
+    _record(results, 'molecule_to_graph', 'graphs',
+            _best_time(lambda: [molecule_to_graph(s, y) for s, y in zip(smiles, labels)], repeats),
+            len(smiles), 'molecules')
+
+    csv_path = os.path.join(work_dir, "synthetic.csv")
+    df.to_csv(csv_path, index=False)
+    _record(results, f'batch_from_csv[n_jobs={n_jobs}]', 'graphs',
+            _best_time(lambda: batch_from_csv(csv_path, n_jobs=n_jobs), repeats), len(smiles), 'molecules')
+
+def _bench_collation(results, graphs, repeats, batch_size, work_dir):
+    drain = lambda loader: sum(batch.num_graphs for batch in loader)
+    _record(results, f'collate_dataloader[bs={batch_size}]', 'collation',
+            _best_time(lambda: drain(DataLoader(graphs, batch_size=batch_size, shuffle=True)), repeats),
+            len(graphs), 'graphs')
+
+    store_path = os.path.join(work_dir, "packed")
+    pack_graphs(graphs, store_path)
+    dataset = PackedGraphDataset(store_path)
+    _record(results, f'collate_packed[bs={batch_size}]', 'collation',
+            _best_time(lambda: drain(PackedGraphLoader(dataset, batch_size=batch_size, shuffle=True)), repeats),
+            len(graphs), 'graphs')
+
+def _bench_models(results, graphs, repeats, batch_size, inference_batch_size, architectures, stages):
+    in_channels, edge_dim = feature_dims(graphs)
+
+    for name, architecture, kwargs in model_variants(architectures):
+        model_graphs = graphs[:MODEL_GRAPH_CAPS.get(name, len(graphs))]
+        train_batches = list(DataLoader(model_graphs, batch_size=batch_size))
+        infer_batches = list(DataLoader(model_graphs, batch_size=inference_batch_size))
+        torch.manual_seed(0)
+        model = build_model(architecture, in_channels, edge_dim, **kwargs)
+
+        if 'train' in stages:
+            optimizer = torch.optim.Adam(model.parameters(), lr=1e-3)
+            def train_pass():
+                model.train()
+                for batch in train_batches:
+                    loss = torch.nn.functional.mse_loss(model_forward(model, batch).view(-1), batch.y.view(-1))
+                    optimizer.zero_grad()
+                    loss.backward()
+                    optimizer.step()
+            train_pass() # warm-up (allocator, lazy initialisation)
+            _record(results, f'train_step[{name}]', 'train', _best_time(train_pass, repeats), len(model_graphs),
+                    'graphs')
+
+        if 'inference' in stages:
+            def inference_pass():
+                model.eval()
+                with torch.inference_mode():
+                    for batch in infer_batches:
+                        model_forward(model, batch)
+            inference_pass()
+            _record(results, f'inference[{name}]', 'inference', _best_time(inference_pass, repeats), len(model_graphs),
+                    'graphs')
+
+def run_benchmarks(n_molecules=1000, distribution='lognormal', mean_atoms=20, seed=0, repeats=3, stages=STAGES,
+                   architectures=tuple(ARCHITECTURES), n_jobs=1, batch_size=64, inference_batch_size=1024,
+                   max_model_graphs=2000, output_path=None) -> dict:
+    """
+    Runs the selected benchmark stages on n_molecules synthetic SMILES and returns
+    {'config': ..., 'environment': ..., 'results': {name: {per_sec, seconds, items, unit, stage}}}.
+    Training and inference are timed on the first max_model_graphs graphs (fewer
+    for the models in MODEL_GRAPH_CAPS), since their throughput does not depend on
+    the dataset size.
+    """
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        raise ValueError(f"Unknown benchmark stages: {', '.join(sorted(unknown))} (expected {', '.join(STAGES)})")
+    config = dict(n_molecules=n_molecules, distribution=distribution, mean_atoms=mean_atoms, seed=seed,
+                  repeats=repeats, stages=list(stages), architectures=list(architectures), n_jobs=n_jobs,
+                  batch_size=batch_size, inference_batch_size=inference_batch_size,
+                  max_model_graphs=max_model_graphs, model_variants=MODEL_VARIANTS,
+                  model_graph_caps=MODEL_GRAPH_CAPS)
+    environment = dict(python=platform.python_version(), torch=torch.__version__, rdkit=rdBase.rdkitVersion,
+                       platform=platform.platform(), cpu_count=os.cpu_count(), torch_threads=torch.get_num_threads(),
+                       featuriser_version=featuriser_version())
+
+    print(f"Benchmarking on {n_molecules:,} synthetic molecules ({distribution}, mean {mean_atoms} atoms)")
+    df = synthetic_dataset(n_molecules, seed=seed, distribution=distribution, mean_atoms=mean_atoms)
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="gnn_bench_") as work_dir:
+        if 'featurisation' in stages:
+            _bench_featurisation(results, df['SMILES'].tolist(), repeats)
+        if 'graphs' in stages:
+            _bench_graphs(results, df, repeats, n_jobs, work_dir)
+
+        if {'collation', 'train', 'inference'} & set(stages):
+            graphs = [molecule_to_graph(s, y) for s, y in zip(df['SMILES'], df['Inh Power'])]
+            if 'collation' in stages:
+                _bench_collation(results, graphs, repeats, batch_size, work_dir)
+            if {'train', 'inference'} & set(stages):
+                _bench_models(results, graphs[:max_model_graphs], repeats, batch_size, inference_batch_size,
+                              architectures, stages)
+
+    report = {'config': config, 'environment': environment, 'results': results,
+              'created_at': time.strftime("%Y-%m-%d %H:%M:%S")}
+    if output_path:
+        save_results(report, output_path)
+    return report
+
+def save_results(report: dict, path: str) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f" Benchmark results saved to: {path}")
+
+def load_results(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+def compare_to_baseline(report: dict, baseline: dict, tolerance=0.15) -> list:
+    """
+    Compares the throughput of every benchmark in report with baseline (both as
+    returned by run_benchmarks). Returns the names of benchmarks that got more
+    than tolerance (fractional) slower; benchmarks missing from either side are
+    skipped.
+    """
+    if report['config'] != baseline['config']:
+        print(" Warning: benchmark configuration differs from the baseline, results may not be comparable")
+    if report['environment'] != baseline['environment']:
+        changed = [k for k in report['environment'] if report['environment'][k] != baseline['environment'].get(k)]
+        print(f" Warning: environment differs from the baseline ({', '.join(changed)})")
+
+    regressions = []
+    for name, result in report['results'].items():
+        if name not in baseline['results']:
+            continue
+        base = baseline['results'][name]['per_sec']
+        change = result['per_sec'] / base - 1
+        regressed = change < -tolerance
+        if regressed:
+            regressions.append(name)
+        print(f"{name:>32}: {base:>12,.0f} -> {result['per_sec']:>12,.0f} {result['unit']}/s "
+              f"({change:+.1%}){'  REGRESSION' if regressed else ''}")
+    print(f" {len(regressions)} regression(s) beyond {tolerance:.0%}")
+    return regressions
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark preprocessing, training and inference hot paths")
+    parser.add_argument("-n", "--n-molecules", type=int, default=1000)
+    parser.add_argument("--distribution", choices=SIZE_DISTRIBUTIONS, default="lognormal")
+    parser.add_argument("--mean-atoms", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--architectures", nargs="+", choices=list(ARCHITECTURES), default=list(ARCHITECTURES))
+    parser.add_argument("--n-jobs", type=int, default=1, help="batch_from_csv worker processes")
+    parser.add_argument("--max-model-graphs", type=int, default=2000)
+    parser.add_argument("--output", default="data/benchmarks/latest.json")
+    parser.add_argument("--baseline", help="baseline JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed fractional slowdown")
+    parser.add_argument("--save-baseline", help="also write the results to this baseline path")
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks(args.n_molecules, args.distribution, args.mean_atoms, args.seed, args.repeats,
+                            args.stages, args.architectures, args.n_jobs, max_model_graphs=args.max_model_graphs,
+                            output_path=args.output)
+    if args.save_baseline:
+        save_results(report, args.save_baseline)
+    if args.baseline:
+        regressions = compare_to_baseline(report, load_results(args.baseline), args.tolerance)
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,68 @@
+# benchmarks/synthetic.py
+
+# Synthetic SMILES sets for benchmarking. Molecules are built as linear chains of
+# fragments (chain atoms, heteroatoms, carbonyls, saturated and aromatic rings,
+# halogenated carbons) until a sampled heavy-atom count is reached, so every
+# string is valid and the size distribution is under control:
+#   'lognormal' - right-skewed like real inhibitor sets (mean_atoms, sigma)
+#   'uniform'   - flat between min_atoms and max_atoms
+#   'fixed'     - every molecule has mean_atoms heavy atoms
+# Generation is deterministic for a given seed.
+
+import numpy as np
+import pandas as pd
+
+# (SMILES fragment with one attachment point on each side, heavy atoms)
+CHAIN_FRAGMENTS = [
+    ('C', 1), ('CC', 2), ('N', 1), ('O', 1), ('S', 1), ('C(=O)', 2), ('C(C)', 2), ('C(F)(F)', 3),
+    ('C(Cl)', 2), ('C(=O)N', 3), ('c1ccc(cc1)', 6), ('c1ccc(nc1)', 6), ('C1CCC(CC1)', 6),
+    ('C1CCN(CC1)', 6), ('c1cc(sc1)', 5), ('c1nc2ccccc2n1C', 10),
+]
+# Relative frequency of each fragment (chain atoms dominate, as in drug-like molecules)
+FRAGMENT_WEIGHTS = np.array([8, 4, 3, 3, 1, 2, 2, 1, 1, 2, 3, 1, 1, 1, 1, 0.5])
+END_GROUPS = ['', 'C', 'O', 'N', 'C(=O)O', 'F', 'Cl', 'C#N']
+
+SIZE_DISTRIBUTIONS = ('lognormal', 'uniform', 'fixed')
+
+def sample_sizes(n: int, distribution='lognormal', mean_atoms=20, sigma=0.4, min_atoms=3, max_atoms=80,
+                 seed=0) -> np.ndarray:
+    """Heavy-atom counts for n molecules, clipped to [min_atoms, max_atoms]."""
+    rng = np.random.default_rng(seed)
+    if distribution == 'lognormal':
+        sizes = rng.lognormal(np.log(mean_atoms) - sigma ** 2 / 2, sigma, n)
+    elif distribution == 'uniform':
+        sizes = rng.uniform(min_atoms, max_atoms + 1, n)
+    elif distribution == 'fixed':
+        sizes = np.full(n, mean_atoms)
+    else:
+        raise ValueError(f"Unknown size distribution: {distribution} (expected one of {', '.join(SIZE_DISTRIBUTIONS)})")
+    return np.clip(sizes.astype(np.int64), min_atoms, max_atoms)
+
+def synthetic_smiles(n: int, distribution='lognormal', mean_atoms=20, sigma=0.4, min_atoms=3, max_atoms=80,
+                     seed=0) -> list:
+    """n valid SMILES strings whose heavy-atom counts follow the given distribution (approximately)."""
+    rng = np.random.default_rng(seed)
+    sizes = sample_sizes(n, distribution, mean_atoms, sigma, min_atoms, max_atoms, seed)
+    probs = FRAGMENT_WEIGHTS / FRAGMENT_WEIGHTS.sum()
+    # Draw fragments in bulk; each molecule consumes them until it reaches its size
+    pool = rng.choice(len(CHAIN_FRAGMENTS), size=int(sizes.sum()) + n, p=probs)
+    ends = rng.integers(len(END_GROUPS), size=n)
+
+    smiles = []
+    pos = 0
+    for size, end in zip(sizes, ends):
+        parts, atoms = ['C'], 1
+        while atoms < size:
+            fragment, n_atoms = CHAIN_FRAGMENTS[pool[pos % len(pool)]]
+            pos += 1
+            parts.append(fragment)
+            atoms += n_atoms
+        parts.append(END_GROUPS[end])
+        smiles.append(''.join(parts))
+    return smiles
+
+def synthetic_dataset(n: int, seed=0, **size_kwargs) -> pd.DataFrame:
+    """DataFrame with SMILES and a random Inh Power label, in the layout of data/processed/input.csv."""
+    smiles = synthetic_smiles(n, seed=seed, **size_kwargs)
+    labels = np.random.default_rng(seed + 1).uniform(0, 20, n).round(2)
+    return pd.DataFrame({'SMILES': smiles, 'Inh Power': labels})
@@ -0,0 +1,238 @@
+# cli.py
+
+# Command-line entry point for the whole pipeline, one subcommand per stage:
+#   resolve     CAS numbers in the raw Ozkan spreadsheet -> SMILES (data/processed/input.csv)
+#   featurise   input.csv -> packed graph store (only new or changed molecules are featurised)
+#   train       train one architecture (mpnn, gcn, gat, attentivefp) on the store, save an artifact
+#   evaluate    score an artifact on the store; ranked per-molecule errors and an optional figure
+#   predict     score SMILES (arguments or a CSV column) with an artifact
+#   benchmark   run benchmarks/suite.py (arguments are passed through)
+#
+# Parsing arguments imports nothing heavy: torch, torch_geometric, rdkit,
+# pubchempy and sklearn are imported inside the subcommand that needs them, so
+# e.g. `resolve` never loads torch and `predict` never loads sklearn or pubchempy.
+#
+# Usage (from GNN_code):
+#   python cli.py resolve
+#   python cli.py featurise --n-jobs -1
+#   python cli.py train mpnn --edge-mode dedup --epochs 300 --normalise
+#   python cli.py evaluate data/models/mpnn.pt --val-fraction 0.1 --plot data/processed/mpnn_model_accuracy.png
+#   python cli.py predict data/models/mpnn.pt "CN1C2=CC=CC=C2NC1=S" "C1=CN=C(N1)C(=O)O"
+#   python cli.py benchmark -n 10000 --baseline data/benchmarks/baseline.json
+
+import argparse
+import os
+import sys
+import telemetry
+
+# Command-line architecture names -> registered model classes (models/artifacts.py)
+ARCHITECTURES = {'mpnn': 'MPNNModel', 'gcn': 'GCNModel', 'gat': 'GATModel', 'attentivefp': 'AttentiveFPModel'}
+
+DEFAULT_CSV = "data/processed/input.csv"
+DEFAULT_STORE = "data/processed/graph_store"
+
+def _resolve(args) -> int:
+    from preprocessing.fetch_smiles import resolve_smiles_by_cas_interactive
+
+    resolve_smiles_by_cas_interactive(args.input, args.output, max_workers=args.workers,
+                                      interactive=not args.non_interactive, incremental=not args.full)
+    return 0
+
+def _featurise(args) -> int:
+    from preprocessing.smiles_to_graph import batch_from_csv
+
+    store = batch_from_csv(args.csv, cache_dir=None if args.no_cache else args.cache_dir, n_jobs=args.n_jobs,
+                           store_path=args.store)
+    print(f"{len(store)} graphs in {args.store}")
+    return 0
+
+def _load_store(path):
+    from preprocessing.packed_store import PackedGraphDataset
+
+    if not os.path.exists(os.path.join(path, "meta.json")):
+        raise SystemExit(f"No graph store at {path}; run `python cli.py featurise` first")
+    return PackedGraphDataset(path)
+
+def _train(args) -> int:
+    import torch
+    from models.artifacts import TargetScaler, build_model, save_artifact
+    from models.engine import fit, make_loader, train_val_split
+    from models.evaluation import evaluate_predictions
+
+    graphs = _load_store(args.store)
+    if graphs.y is None:
+        raise SystemExit(f"The graph store at {args.store} has no labels")
+    train_idx, val_idx = train_val_split(len(graphs), args.val_fraction, args.seed)
+    scaler = None
+    if args.normalise:
+        # Fitted on the training split; the store is mapped copy-on-write, so the files stay unscaled
+        scaler = TargetScaler.fit(graphs.y[train_idx])
+        graphs.y[:] = scaler.transform(graphs.y.reshape(-1, 1)).ravel()
+
+    architecture = ARCHITECTURES[args.architecture]
+    params = {}
+    if architecture == 'MPNNModel':
+        params = dict(edge_mode=args.edge_mode, num_layers=args.num_layers)
+    elif architecture == 'AttentiveFPModel':
+        params = dict(num_layers=args.num_layers)
+    torch.manual_seed(args.seed)
+    model = build_model(architecture, graphs.num_node_features, graphs.num_edge_features,
+                        hidden_dim=args.hidden_dim, dropout_rate=args.dropout_rate, **params)
+
+    loader = make_loader(graphs, batch_size=args.batch_size, shuffle=True, num_workers=args.num_workers,
+                         max_nodes=args.max_nodes, bucket_size=8 * args.batch_size, seed=args.seed,
+                         indices=train_idx)
+    val_loader = make_loader(graphs, batch_size=256, shuffle=False, indices=val_idx)
+    history = fit(model, loader, lr=args.lr, epochs=args.epochs, val_loader=val_loader, patience=args.patience,
+                  scheduler=None if args.scheduler == 'none' else args.scheduler, autocast=args.autocast,
+                  log_every=args.log_every, checkpoint_path=args.checkpoint, resume=args.resume)
+
+    artifact_path = args.artifact or f"data/models/{args.architecture}.pt"
+    save_artifact(artifact_path, model, scaler=scaler,
+                  metadata={'trainer': 'cli', 'epochs': len(history), 'store': args.store,
+                            'val_fraction': args.val_fraction, 'seed': args.seed})
+    evaluate_predictions(model, val_loader, scaler, output_path=args.predictions, plot_path=args.plot,
+                         title=f"Predicted vs. Actual - {architecture} (validation)")
+    return 0
+
+def _evaluate(args) -> int:
+    from models.artifacts import load_artifact
+    from models.engine import make_loader, train_val_split
+    from models.evaluation import evaluate_predictions
+
+    model, scaler, info = load_artifact(args.artifact, device=args.device)
+    graphs = _load_store(args.store)
+    if graphs.y is None:
+        raise SystemExit(f"The graph store at {args.store} has no labels")
+    if scaler is not None:
+        # The model predicts scaled targets; evaluate_predictions maps both sides back
+        graphs.y[:] = scaler.transform(graphs.y.reshape(-1, 1)).ravel()
+    # With the training split settings, only the held-out graphs are scored
+    indices = train_val_split(len(graphs), args.val_fraction, args.seed)[1] if args.val_fraction else None
+    loader = make_loader(graphs, batch_size=args.batch_size, shuffle=False, indices=indices)
+    evaluate_predictions(model, loader, scaler, output_path=args.output, plot_path=args.plot, top_n=args.top_n,
+                         autocast=args.autocast, title=f"Predicted vs. Actual - {info['architecture']}")
+    return 0
+
+def _predict(args) -> int:
+    from models.artifacts import load_artifact
+    from models.predict import iter_predictions, predict_to_file, read_smiles
+
+    if bool(args.smiles) == bool(args.input):
+        raise SystemExit("Give either SMILES arguments or --input, not both")
+    model, scaler, _ = load_artifact(args.artifact, device=args.device)
+    if args.precision == 'int8':
+        from models.precision import quantize_model
+        model = quantize_model(model)
+    autocast = args.precision == 'bf16'
+    smiles = read_smiles(args.input, args.smiles_col) if args.input else args.smiles
+
+    batching = dict(chunk_size=args.chunk_size, batch_size=args.batch_size,
+                    max_edges=args.max_edges if args.max_edges is not None else 'auto')
+    if args.output:
+        predict_to_file(model, smiles, args.output, scaler, n_jobs=args.n_jobs, device=args.device,
+                        autocast=autocast, **batching)
+        return 0
+    for df in iter_predictions(model, smiles, scaler, n_jobs=args.n_jobs, device=args.device, autocast=autocast,
+                               **batching):
+        for s, pred in zip(df['SMILES'], df['Predicted']):
+            print(f"{s}\t{pred:.4f}")
+    return 0
+
+def _benchmark(args) -> int:
+    from benchmarks.suite import main as benchmark_main
+
+    return benchmark_main(args.args)
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Corrosion inhibitor GNN pipeline")
+    parser.add_argument("--telemetry", metavar="LOG", help="record stage timings to this JSON lines log")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    p = subparsers.add_parser("resolve", help="resolve SMILES from CAS numbers via PubChem")
+    p.add_argument("--input", default="data/raw/Ozkan_data_2024.xlsx")
+    p.add_argument("--output", default=DEFAULT_CSV)
+    p.add_argument("--workers", type=int, default=8, help="concurrent PubChem lookups")
+    p.add_argument("--full", action="store_true", help="re-resolve every row instead of only new or edited ones")
+    p.add_argument("--non-interactive", action="store_true", help="skip the manual entry pass")
+    p.set_defaults(handler=_resolve)
+
+    p = subparsers.add_parser("featurise", help="featurise input.csv into the packed graph store")
+    p.add_argument("--csv", default=DEFAULT_CSV)
+    p.add_argument("--store", default=DEFAULT_STORE)
+    p.add_argument("--cache-dir", default="data/cache/graphs")
+    p.add_argument("--no-cache", action="store_true")
+    p.add_argument("--n-jobs", type=int, default=1, help="featurisation processes (-1 for all cores)")
+    p.set_defaults(handler=_featurise)
+
+    p = subparsers.add_parser("train", help="train one architecture on the graph store")
+    p.add_argument("architecture", choices=list(ARCHITECTURES))
+    p.add_argument("--store", default=DEFAULT_STORE)
+    p.add_argument("--artifact", help="output model artifact (default data/models/<architecture>.pt)")
+    p.add_argument("--epochs", type=int, default=300)
+    p.add_argument("--lr", type=float, default=1e-3)
+    p.add_argument("--batch-size", type=int, default=16)
+    p.add_argument("--max-nodes", type=int, help="size-budgeted batches of at most this many atoms")
+    p.add_argument("--num-workers", type=int, default=0, help="background DataLoader workers")
+    p.add_argument("--hidden-dim", type=int, default=64)
+    p.add_argument("--dropout-rate", type=float, default=0.2)
+    p.add_argument("--num-layers", type=int, default=1, help="message passing layers (mpnn, attentivefp)")
+    p.add_argument("--edge-mode", choices=('dense', 'dedup', 'lowrank'), default='dense', help="mpnn edge network")
+    p.add_argument("--normalise", action="store_true", help="min-max scale the targets (as train_normalised.py)")
+    p.add_argument("--val-fraction", type=float, default=0.1)
+    p.add_argument("--patience", type=int, default=30, help="validation checks without improvement before stopping")
+    p.add_argument("--scheduler", choices=('plateau', 'onecycle', 'none'), default='plateau')
+    p.add_argument("--autocast", action="store_true", help="bfloat16 autocast")
+    p.add_argument("--checkpoint", help="mid-training checkpoint path")
+    p.add_argument("--resume", action="store_true", help="resume from --checkpoint")
+    p.add_argument("--log-every", type=int, default=10)
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--predictions", help="save ranked validation predictions to this CSV")
+    p.add_argument("--plot", help="save the validation predicted-vs-actual figure to this file")
+    p.set_defaults(handler=_train)
+
+    p = subparsers.add_parser("evaluate", help="score a model artifact on the graph store")
+    p.add_argument("artifact")
+    p.add_argument("--store", default=DEFAULT_STORE)
+    p.add_argument("--val-fraction", type=float, help="only score the held-out split of `train` (same --seed)")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--batch-size", type=int, default=1024)
+    p.add_argument("--output", default="data/processed/predictions.csv", help="ranked per-molecule predictions")
+    p.add_argument("--plot", help="save the predicted-vs-actual figure to this file")
+    p.add_argument("--top-n", type=int, default=5, help="worst predictions to print")
+    p.add_argument("--autocast", action="store_true")
+    p.add_argument("--device", default="cpu")
+    p.set_defaults(handler=_evaluate)
+
+    p = subparsers.add_parser("predict", help="score SMILES with a model artifact")
+    p.add_argument("artifact")
+    p.add_argument("smiles", nargs="*", help="SMILES to score (or use --input)")
+    p.add_argument("--input", help="CSV of SMILES to score")
+    p.add_argument("--smiles-col", default="SMILES")
+    p.add_argument("--output", help="write predictions to this CSV / .parquet instead of printing them")
+    p.add_argument("--chunk-size", type=int, default=1024, help="molecules featurised and written at a time")
+    p.add_argument("--batch-size", type=int, help="molecules per forward pass (default: the whole chunk)")
+    p.add_argument("--max-edges", type=int,
+                   help="edges per forward pass (default: 4096 for a dense MPNN, else no limit)")
+    p.add_argument("--n-jobs", type=int, default=1, help="featurisation processes (-1 for all cores)")
+    p.add_argument("--precision", choices=('float32', 'bf16', 'int8'), default='float32')
+    p.add_argument("--device", default="cpu")
+    p.set_defaults(handler=_predict)
+
+    p = subparsers.add_parser("benchmark", help="run the benchmark suite (see benchmarks/suite.py)")
+    p.add_argument("args", nargs=argparse.REMAINDER, help="arguments for benchmarks.suite")
+    p.set_defaults(handler=_benchmark)
+    return parser
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.telemetry:
+        telemetry.enable(args.telemetry)
+    try:
+        return args.handler(args)
+    finally:
+        if telemetry.is_enabled():
+            telemetry.report()
+
+if __name__ == "__main__":
+    sys.exit(main())
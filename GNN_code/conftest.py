@@ -0,0 +1,4 @@
+# conftest.py
+
+# Lets pytest import the models/ and preprocessing/ packages when run from GNN_code:
+#   python -m pytest -q tests
@@ -0,0 +1,159 @@
+# models/artifacts.py
+
+# Saving and loading trained models. An artifact is a single torch file with
+# everything needed to score new molecules without retraining:
+#   - architecture name and constructor hyperparameters (model.hparams)
+#   - weights (state_dict)
+#   - target scaler state (MinMax min_/scale_), if targets were normalised
+#   - featuriser fingerprint, to catch graphs built by a different featuriser
+#   - free-form metadata (epochs, dataset path, ...)
+# Only torch and numpy are imported at module level: the model class is imported
+# on demand and the scaler is rebuilt without sklearn, so loading stays cheap.
+
+import importlib
+import os
+import time
+import numpy as np
+import torch
+
+ARTIFACT_FORMAT = 1
+
+# Architecture name -> module defining it (imported lazily)
+ARCHITECTURES = {
+    'MPNNModel': 'models.mpnn_model',
+    'GCNModel': 'models.gcn_model',
+    'GATModel': 'models.gat_model',
+    'AttentiveFPModel': 'models.attentiveFP_model',
+}
+
+def model_class(name: str):
+    """Imports and returns the model class registered under name."""
+    if name not in ARCHITECTURES:
+        raise ValueError(f"Unknown architecture: {name} (expected one of {', '.join(ARCHITECTURES)})")
+    return getattr(importlib.import_module(ARCHITECTURES[name]), name)
+
+def build_model(name: str, in_channels: int, edge_dim: int, hidden_dim=64, **params):
+    """
+    Builds any registered architecture from the graph feature sizes, hiding the
+    differences in constructor signatures (GCN/GAT take no edge features,
+    AttentiveFP calls its node size node_dim).
+    """
+    cls = model_class(name)
+    if name == 'MPNNModel':
+        return cls(in_channels, edge_dim, hidden_dim, **params)
+    if name == 'AttentiveFPModel':
+        params.setdefault('out_dim', 1)
+        return cls(in_channels, edge_dim, hidden_dim, **params)
+    return cls(in_channels, hidden_dim, **params)
+
+class TargetScaler:
+    """
+    Minimal stand-in for a fitted sklearn MinMaxScaler (transform / inverse_transform
+    on [n, 1] arrays), rebuilt from the stored min_ and scale_.
+    """
+    def __init__(self, min_, scale_):
+        self.min_ = np.asarray(min_, dtype=np.float64)
+        self.scale_ = np.asarray(scale_, dtype=np.float64)
+
+    @classmethod
+    def from_sklearn(cls, scaler):
+        return cls(scaler.min_.tolist(), scaler.scale_.tolist())
+
+    @classmethod
+    def fit(cls, values):
+        """Fits a [0, 1] min-max scaling to a 1-D array of targets, like MinMaxScaler().fit."""
+        values = np.asarray(values, dtype=np.float64).reshape(-1)
+        low, high = values.min(), values.max()
+        scale = 1.0 / (high - low) if high > low else 1.0
+        return cls([-low * scale], [scale])
+
+    def state(self) -> dict:
+        return {'kind': 'minmax', 'min_': self.min_.tolist(), 'scale_': self.scale_.tolist()}
+
+    def transform(self, X):
+        return X * self.scale_ + self.min_
+
+    def inverse_transform(self, X):
+        return (X - self.min_) / self.scale_
+
+def _atomic_save(obj, path: str) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    torch.save(obj, tmp_path)
+    os.replace(tmp_path, path)
+
+def save_artifact(path: str, model, scaler=None, metadata=None) -> None:
+    """Saves a trained model (and its fitted target scaler, if any) to path."""
+    # Imported lazily as it pulls in RDKit
+    from preprocessing.graph_cache import featuriser_version
+
+    if scaler is not None and not isinstance(scaler, TargetScaler):
+        scaler = TargetScaler.from_sklearn(scaler)
+    artifact = {
+        'format': ARTIFACT_FORMAT,
+        'architecture': type(model).__name__,
+        'hparams': dict(model.hparams),
+        'state_dict': {k: v.detach().cpu() for k, v in model.state_dict().items()},
+        'scaler': scaler.state() if scaler is not None else None,
+        'featuriser_version': featuriser_version(),
+        'metadata': dict(metadata or {}, saved_at=time.strftime("%Y-%m-%d %H:%M:%S")),
+    }
+    _atomic_save(artifact, path)
+    print(f" Model artifact saved to: {path}")
+
+def load_artifact(path: str, device="cpu", check_featuriser=True):
+    """
+    Loads an artifact written by save_artifact.
+    Returns (model in eval mode, TargetScaler or None, artifact info dict).
+    """
+    # mmap avoids reading the whole file up front; weights_only keeps loading safe
+    artifact = torch.load(path, map_location=device, mmap=True, weights_only=True)
+    if artifact.get('format') != ARTIFACT_FORMAT:
+        raise ValueError(f"Unsupported artifact format in {path}: {artifact.get('format')}")
+
+    model_cls = model_class(artifact['architecture'])
+    # Build on the meta device (no random init) and adopt the mapped weights directly
+    with torch.device("meta"):
+        model = model_cls(**artifact['hparams'])
+    model.load_state_dict(artifact['state_dict'], assign=True)
+    model.to(device).eval()
+
+    scaler_state = artifact['scaler']
+    scaler = TargetScaler(scaler_state['min_'], scaler_state['scale_']) if scaler_state else None
+
+    if check_featuriser:
+        from preprocessing.graph_cache import featuriser_version
+        if artifact['featuriser_version'] != featuriser_version():
+            print(f" Warning: {path} was trained with featuriser {artifact['featuriser_version']}, "
+                  f"current featuriser is {featuriser_version()}")
+
+    info = {k: artifact[k] for k in ('architecture', 'hparams', 'featuriser_version', 'metadata')}
+    return model, scaler, info
+
+def save_checkpoint(path: str, model, optimizer, epoch: int, history=None, scheduler=None, stopper=None,
+                    rng_state=None) -> None:
+    """
+    Mid-training checkpoint used to resume models.engine.fit: weights, optimizer,
+    LR scheduler and early-stopping state (best weights, patience count) plus
+    the RNG state, so a resumed run continues exactly like an uninterrupted one.
+    """
+    _atomic_save({
+        'model': model.state_dict(),
+        'optimizer': optimizer.state_dict(),
+        'scheduler': scheduler.state_dict() if scheduler is not None else None,
+        'stopper': stopper.state_dict() if stopper is not None else None,
+        'rng': rng_state,
+        'epoch': epoch,
+        'history': history or [],
+    }, path)
+
+def load_checkpoint(path: str, model, optimizer, scheduler=None, stopper=None):
+    """Restores a checkpoint in place; returns (epochs completed, history, RNG state or None)."""
+    checkpoint = torch.load(path, map_location=next(model.parameters()).device, weights_only=True)
+    model.load_state_dict(checkpoint['model'])
+    optimizer.load_state_dict(checkpoint['optimizer'])
+    if scheduler is not None and checkpoint.get('scheduler') is not None:
+        scheduler.load_state_dict(checkpoint['scheduler'])
+    if stopper is not None and checkpoint.get('stopper') is not None:
+        stopper.load_state_dict(checkpoint['stopper'])
+    return checkpoint['epoch'], checkpoint['history'], checkpoint.get('rng')
@@ -0,0 +1,158 @@
+# models/embeddings.py
+
+# Graph-embedding export for downstream analysis (t-SNE, clustering,
+# nearest-neighbour search) without re-running the network. Every model class
+# has an embed() method returning the pooled readout that feeds its ffnn head;
+# export_embeddings runs it over a graph list or packed store in batches and
+# writes an embedding store directory:
+#
+#   embeddings.npy  [num_molecules, hidden_dim]  float32, one row per molecule
+#   keys.txt        one molecule key per line (store keys, else SMILES)
+#   meta.json       architecture, hparams, checkpoint tag and source artifact
+#
+# The checkpoint tag is a hash of the model's architecture, hyperparameters and
+# weights, so a store can be checked against the model it claims to come from;
+# exporting again with the same model and keys is a no-op.
+#
+#   export_artifact_embeddings("data/models/mpnn.pt", graphs, "data/processed/embeddings/mpnn")
+#   store = EmbeddingStore("data/processed/embeddings/mpnn")
+#   X = store.embeddings          # memory-mapped [n, hidden_dim]
+
+import hashlib
+import json
+import os
+import shutil
+import time
+import numpy as np
+import torch
+from torch.utils.data import IterableDataset
+from models.artifacts import load_artifact
+from models.engine import make_loader, model_embed
+from preprocessing.packed_store import PackedGraphDataset
+
+def checkpoint_tag(model) -> str:
+    """Short hash identifying the architecture, hyperparameters and weights of model."""
+    digest = hashlib.sha256()
+    digest.update(type(model).__name__.encode())
+    digest.update(json.dumps(getattr(model, 'hparams', {}), sort_keys=True, default=str).encode())
+    for name, tensor in sorted(model.state_dict().items()):
+        digest.update(name.encode())
+        digest.update(tensor.detach().cpu().contiguous().numpy().tobytes())
+    return digest.hexdigest()[:16]
+
+def _graph_keys(graphs) -> list:
+    """Store keys, else SMILES, else positions of the graphs."""
+    if isinstance(graphs, PackedGraphDataset):
+        keys = graphs.keys or graphs.smiles
+    else:
+        keys = [getattr(g, 'smiles', None) for g in graphs]
+        keys = keys if all(key is not None for key in keys) else None
+    return list(keys) if keys is not None else [str(i) for i in range(len(graphs))]
+
+def export_embeddings(model, graphs, path: str, keys=None, batch_size=1024, device=None, checkpoint=None,
+                      autocast=False, overwrite=False) -> str:
+    """
+    Writes the embeddings of graphs (list or PackedGraphDataset) under model to
+    the store directory at path and returns the checkpoint tag. keys default to
+    the store keys or SMILES of the graphs. checkpoint (e.g. an artifact path) is
+    recorded in the metadata. An existing store with the same tag and keys is
+    kept unless overwrite is set.
+    """
+    if isinstance(graphs, IterableDataset):
+        raise ValueError("Embedding export needs a graph list or PackedGraphDataset, not a streaming dataset")
+    if len(graphs) == 0:
+        raise ValueError("Cannot export embeddings for an empty graph list")
+    keys = _graph_keys(graphs) if keys is None else [str(key) for key in keys]
+    if len(keys) != len(graphs):
+        raise ValueError(f"Got {len(keys)} keys for {len(graphs)} graphs")
+    if any('\n' in key for key in keys):
+        raise ValueError("Embedding keys cannot contain newlines")
+
+    tag = checkpoint_tag(model)
+    if not overwrite and os.path.exists(os.path.join(path, "meta.json")):
+        existing = EmbeddingStore(path)
+        if existing.tag == tag and existing.keys == keys:
+            print(f" Embeddings at {path} are up to date (checkpoint {tag})")
+            return tag
+
+    device = torch.device(device or next(model.parameters()).device)
+    model.to(device).eval()
+    loader = make_loader(graphs, batch_size=batch_size, shuffle=False)
+
+    tmp_path = f"{path.rstrip(os.sep)}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    embeddings = None
+    start = time.perf_counter()
+    row = 0
+    with torch.inference_mode(), torch.autocast(device.type, dtype=torch.bfloat16, enabled=autocast):
+        for batch in loader:
+            out = model_embed(model, batch.to(device)).float().cpu().numpy()
+            if embeddings is None:
+                embeddings = np.lib.format.open_memmap(os.path.join(tmp_path, "embeddings.npy"), mode="w+",
+                                                       dtype=np.float32, shape=(len(graphs), out.shape[1]))
+            embeddings[row:row + len(out)] = out
+            row += len(out)
+    embeddings.flush()
+    with open(os.path.join(tmp_path, "keys.txt"), "w") as f:
+        f.writelines(f"{key}\n" for key in keys)
+
+    meta = {
+        'num_molecules': len(graphs),
+        'dim': int(embeddings.shape[1]),
+        'architecture': type(model).__name__,
+        'hparams': dict(getattr(model, 'hparams', {})),
+        'checkpoint_tag': tag,
+        'checkpoint': checkpoint,
+        'created_at': time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+    del embeddings
+
+    # Swap the finished store in, so an interrupted export never leaves a partial one
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.rename(tmp_path, path)
+    seconds = time.perf_counter() - start
+    print(f" {len(graphs)} embeddings ({meta['dim']}-d, checkpoint {tag}) saved to: {path} "
+          f"({len(graphs) / seconds:.0f} graphs/s)")
+    return tag
+
+def export_artifact_embeddings(artifact_path: str, graphs, path: str, device="cpu", **export_kwargs) -> str:
+    """export_embeddings for a model saved with models.artifacts.save_artifact."""
+    model, _, _ = load_artifact(artifact_path, device=device)
+    return export_embeddings(model, graphs, path, device=device, checkpoint=artifact_path, **export_kwargs)
+
+class EmbeddingStore:
+    """Memory-mapped view of a store written by export_embeddings."""
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.embeddings = np.load(os.path.join(path, "embeddings.npy"), mmap_mode="r")
+        with open(os.path.join(path, "keys.txt")) as f:
+            self.keys = f.read().splitlines()
+        self._rows = None
+
+    @property
+    def tag(self) -> str:
+        return self.meta['checkpoint_tag']
+
+    def __len__(self) -> int:
+        return self.meta['num_molecules']
+
+    def get(self, keys) -> np.ndarray:
+        """Embeddings [len(keys), dim] of the molecules with the given keys."""
+        if self._rows is None:
+            self._rows = {key: i for i, key in enumerate(self.keys)}
+        missing = [key for key in keys if key not in self._rows]
+        if missing:
+            raise KeyError(f"Not in the embedding store: {', '.join(map(str, missing[:5]))}")
+        return self.embeddings[[self._rows[key] for key in keys]]
+
+    def check(self, model) -> None:
+        """Raises ValueError unless the store was exported from model (same architecture and weights)."""
+        tag = checkpoint_tag(model)
+        if tag != self.tag:
+            raise ValueError(f"Embeddings at {self.path} come from checkpoint {self.tag}, not {tag}")
@@ -0,0 +1,379 @@
+# models/engine.py
+
+# Shared training engine for MPNNModel, GCNModel, GATModel and AttentiveFPModel.
+# The per-model trainers (train.py, train_normalised.py, gcn_model.py, ...) are
+# thin wrappers around fit(), so loop-level optimisations live in one place:
+#   - losses are accumulated on-device and only synchronised when logging
+#   - batches can be prefetched by background DataLoader workers
+#   - optional gradient accumulation and torch.compile
+#   - optional bfloat16 autocast (CPU or GPU), see also models/precision.py
+#   - validation-driven epoch control: early stopping with best-weight restore,
+#     ReduceLROnPlateau / OneCycle learning rate schedules
+#   - opt-in telemetry (telemetry.py): batch loading, forward, backward and
+#     optimizer step timers, per-epoch log records and a profiler trace of the
+#     first epoch
+#   - throughput (graphs per second) is reported next to the loss
+
+import math
+import os
+import time
+import numpy as np
+import torch
+from torch.nn import MSELoss
+from torch.utils.data import DataLoader as TorchDataLoader
+from torch.utils.data import IterableDataset
+from torch_geometric.loader import DataLoader
+import telemetry
+from models.artifacts import load_checkpoint, save_checkpoint
+from models.sampler import SizeBucketedBatchSampler, graph_sizes
+from preprocessing.packed_store import PackedGraphDataset, PackedGraphLoader
+
+def model_forward(model, batch):
+    """
+    Calls a model with the inputs its forward() expects. Model classes list them in
+    an input_keys attribute (e.g. ('x', 'edge_index', 'batch')); models without it
+    (AttentiveFPModel) take the whole batch.
+    """
+    keys = getattr(model, 'input_keys', None)
+    if keys is None:
+        return model(batch)
+    return model(*[batch[key] for key in keys])
+
+def model_embed(model, batch):
+    """Like model_forward, but returns the graph embeddings (model.embed) instead of predictions."""
+    keys = getattr(model, 'input_keys', None)
+    if keys is None:
+        return model.embed(batch)
+    return model.embed(*[batch[key] for key in keys])
+
+def feature_dims(graphs):
+    """(node feature size, edge feature size) of a graph list or dataset."""
+    if isinstance(graphs, (IterableDataset, PackedGraphDataset)):
+        return graphs.num_node_features, graphs.num_edge_features
+    return graphs[0].x.size(1), graphs[0].edge_attr.size(1)
+
+def train_val_split(n: int, val_fraction=0.1, seed=0):
+    """Random (train indices, validation indices) for n graphs; both sides get at least one graph."""
+    order = np.random.default_rng(seed).permutation(n)
+    n_val = min(max(1, int(round(val_fraction * n))), n - 1)
+    return np.sort(order[n_val:]), np.sort(order[:n_val])
+
+def make_loader(graphs, batch_size=16, shuffle=True, num_workers=0, max_nodes=None, max_edges=None,
+                bucket_size=None, seed=None, indices=None):
+    """
+    Batches a graph list, PackedGraphDataset or streaming IterableDataset.
+    With num_workers > 0 batches are collated by background worker processes
+    and prefetched while the model trains on the current one.
+    With max_nodes / max_edges, batches are packed to a total size budget instead
+    of batch_size graphs (see models/sampler.py), optionally size-bucketed.
+    indices restricts the loader to a subset of the graphs (e.g. a train_val_split side).
+    """
+    worker_kwargs = {'num_workers': num_workers}
+    if num_workers > 0:
+        worker_kwargs.update(persistent_workers=True, prefetch_factor=4)
+
+    if isinstance(graphs, IterableDataset):
+        if max_nodes is not None or max_edges is not None or indices is not None:
+            raise ValueError("Size-budgeted batching and subsets need a graph list or PackedGraphDataset")
+        # Streaming datasets shuffle themselves (shuffle_buffer)
+        return DataLoader(graphs, batch_size=batch_size, **worker_kwargs)
+
+    packed = isinstance(graphs, PackedGraphDataset)
+    if indices is not None:
+        indices = np.asarray(indices, dtype=np.int64)
+        if not packed:
+            graphs = [graphs[int(i)] for i in indices]
+    # Packed stores are batched by global graph index, gathered straight from the arrays
+    positions = indices if packed and indices is not None else np.arange(len(graphs))
+
+    if max_nodes is not None or max_edges is not None:
+        node_counts, edge_counts = graph_sizes(graphs)
+        if packed:
+            node_counts, edge_counts = node_counts[positions], edge_counts[positions]
+        sampler = SizeBucketedBatchSampler(node_counts, edge_counts, max_nodes=max_nodes, max_edges=max_edges,
+                                           shuffle=shuffle, bucket_size=bucket_size, seed=seed)
+        if packed:
+            return TorchDataLoader(positions, batch_sampler=sampler, collate_fn=graphs.collate, **worker_kwargs)
+        return DataLoader(graphs, batch_sampler=sampler, **worker_kwargs)
+
+    if packed:
+        if num_workers == 0:
+            return PackedGraphLoader(graphs, batch_size=batch_size, shuffle=shuffle, indices=positions)
+        # Sample indices and let the workers gather whole batches from the packed arrays
+        return TorchDataLoader(positions, batch_size=batch_size, shuffle=shuffle,
+                               collate_fn=graphs.collate, **worker_kwargs)
+    return DataLoader(graphs, batch_size=batch_size, shuffle=shuffle, **worker_kwargs)
+
+def _resolve_losses(history):
+    """Replaces on-device loss tensors in the history with Python floats (one sync)."""
+    for record in history:
+        if torch.is_tensor(record['loss']):
+            record['loss'] = record['loss'].item()
+
+def fit(model, loader, lr=1e-3, epochs=300, optimizer=None, loss_fn=None, accumulation_steps=1,
+        compile=False, device=None, log_every=10, checkpoint_path=None, checkpoint_every=10, resume=False,
+        on_epoch_end=None, autocast=False, val_loader=None, patience=None, eval_every=1, restore_best=True,
+        eval_initial=False, scheduler=None, scheduler_kwargs=None):
+    """
+    Trains model on loader and returns the per-epoch history
+    (list of dicts with epoch, loss, lr, seconds and samples_per_sec, plus
+    val_rmse / val_r2 on validation epochs).
+
+    accumulation_steps > 1 sums gradients over several batches per optimizer step.
+    compile=True runs the forward pass through torch.compile.
+    autocast=True runs forward and loss in bfloat16 autocast (weights and
+    optimizer state stay float32).
+    The summed epoch loss is printed every log_every epochs (and on the last one).
+    With checkpoint_path, weights, optimizer, scheduler, early-stopping and RNG
+    state are saved every checkpoint_every epochs; resume=True continues from that
+    checkpoint if it exists, as if training had not been interrupted.
+    on_epoch_end(epoch, record) is called after every epoch (it may add entries to
+    record); returning True stops training early.
+
+    With val_loader, validation RMSE / R² are computed every eval_every epochs;
+    training stops after patience validation checks without improvement (never,
+    if patience is None) and, with restore_best, the best weights are loaded back
+    at the end (see EarlyStopping). eval_initial also scores the starting weights,
+    so a warm-started model is never replaced by worse weights.
+    scheduler: 'plateau' halves the learning rate when validation RMSE (training
+    loss without val_loader) stops improving; 'onecycle' runs a one-cycle schedule
+    peaking at lr over all epochs. scheduler_kwargs override the torch defaults
+    (e.g. {'patience': 5, 'factor': 0.5} or {'pct_start': 0.3}).
+    """
+    if device is not None:
+        model.to(device)
+    device = torch.device(device or next(model.parameters()).device)
+    optimizer = optimizer or torch.optim.Adam(model.parameters(), lr=lr)
+    loss_fn = loss_fn or MSELoss()
+    forward_model = torch.compile(model, dynamic=True) if compile else model
+    lr_scheduler = _make_scheduler(scheduler, scheduler_kwargs, optimizer, loader, epochs, accumulation_steps)
+    per_step_schedule = isinstance(lr_scheduler, torch.optim.lr_scheduler.OneCycleLR)
+    stopper = EarlyStopping(model, val_loader, patience, eval_every) if val_loader is not None else None
+
+    history = []
+    start_epoch = 0
+    if resume and checkpoint_path and os.path.exists(checkpoint_path):
+        start_epoch, history, rng_state = load_checkpoint(checkpoint_path, model, optimizer, lr_scheduler, stopper)
+        if rng_state is not None:
+            _set_rng_state(rng_state, loader)
+        print(f"Resuming from {checkpoint_path} after epoch {start_epoch}")
+    elif stopper is not None and eval_initial:
+        stopper(0, {})
+
+    for epoch in range(start_epoch, epochs):
+        model.train()
+        total_loss = torch.zeros((), device=device)
+        n_samples = 0
+        start = time.perf_counter()
+
+        optimizer.zero_grad()
+        step = 0
+        with telemetry.profile(f"fit_epoch_{epoch + 1}", when=(epoch == start_epoch)):
+            for step, batch in enumerate(telemetry.iter_stage('dataloader', loader), start=1):
+                batch = batch.to(device, non_blocking=True)
+                with telemetry.stage('forward'), torch.autocast(device.type, dtype=torch.bfloat16, enabled=autocast):
+                    out = model_forward(forward_model, batch).view(-1)
+                    loss = loss_fn(out.float(), batch.y.view(-1))
+                with telemetry.stage('backward'):
+                    (loss / accumulation_steps).backward()
+                if step % accumulation_steps == 0:
+                    with telemetry.stage('optimizer_step'):
+                        optimizer.step()
+                        optimizer.zero_grad()
+                    if per_step_schedule:
+                        _one_cycle_step(lr_scheduler)
+
+                # Accumulate on-device: no host sync per step
+                total_loss += loss.detach()
+                n_samples += batch.num_graphs
+        telemetry.count('train.graphs', n_samples)
+
+        # Flush gradients left over from an incomplete accumulation window
+        if step % accumulation_steps != 0:
+            optimizer.step()
+            optimizer.zero_grad()
+            if per_step_schedule:
+                _one_cycle_step(lr_scheduler)
+
+        seconds = time.perf_counter() - start
+        record = {'epoch': epoch + 1, 'seconds': seconds, 'samples_per_sec': n_samples / seconds,
+                  'lr': optimizer.param_groups[0]['lr'], 'loss': total_loss}
+        stop = stopper is not None and stopper(epoch + 1, record)
+        if isinstance(lr_scheduler, torch.optim.lr_scheduler.ReduceLROnPlateau):
+            if stopper is None:
+                lr_scheduler.step(total_loss.item())
+            elif 'val_rmse' in record:
+                lr_scheduler.step(record['val_rmse'])
+
+        if log_every and ((epoch + 1) % log_every == 0 or epoch + 1 == epochs or stop):
+            record['loss'] = total_loss.item()
+            val = f", Val RMSE: {record['val_rmse']:.4f}" if 'val_rmse' in record else ""
+            print(f"Epoch {epoch+1}, Loss: {record['loss']:.4f}{val}, {record['samples_per_sec']:.0f} samples/s")
+        history.append(record)
+        telemetry.log_event('epoch', **record)
+
+        if checkpoint_path and ((epoch + 1) % checkpoint_every == 0 or epoch + 1 == epochs):
+            _resolve_losses(history)
+            save_checkpoint(checkpoint_path, model, optimizer, epoch + 1, history, lr_scheduler, stopper,
+                            _rng_state(loader))
+
+        if on_epoch_end is not None and on_epoch_end(epoch + 1, record):
+            break
+        if stop:
+            if log_every:
+                print(f"Early stopping after epoch {epoch+1} (no validation improvement in {patience} checks)")
+            break
+
+    if stopper is not None and restore_best and stopper.best_state is not None:
+        stopper.restore()
+        if log_every:
+            print(f"Restored best weights from epoch {stopper.best_epoch} (val RMSE {stopper.best:.4f})")
+    _resolve_losses(history)
+    return history
+
+def _rng_state(loader) -> dict:
+    """Global torch (and CUDA) and numpy RNG state, plus that of a size-budgeted batch sampler, for checkpoints."""
+    _, key, pos, has_gauss, gauss = np.random.get_state()
+    state = {'torch': torch.get_rng_state(),
+             'numpy': {'key': torch.from_numpy(key.astype(np.int64)), 'pos': pos, 'has_gauss': has_gauss,
+                       'gauss': gauss}}
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    sampler = getattr(loader, 'batch_sampler', None)
+    if isinstance(sampler, SizeBucketedBatchSampler):
+        state['sampler'] = sampler.state_dict()
+    return state
+
+def _set_rng_state(state, loader) -> None:
+    torch.set_rng_state(state['torch'].cpu())
+    numpy_state = state['numpy']
+    np.random.set_state(('MT19937', numpy_state['key'].cpu().numpy().astype(np.uint32), numpy_state['pos'],
+                         numpy_state['has_gauss'], numpy_state['gauss']))
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all([s.cpu() for s in state['cuda']])
+    sampler = getattr(loader, 'batch_sampler', None)
+    if 'sampler' in state and isinstance(sampler, SizeBucketedBatchSampler):
+        sampler.load_state_dict(state['sampler'])
+
+def _make_scheduler(name, kwargs, optimizer, loader, epochs, accumulation_steps):
+    """Learning rate scheduler for fit(scheduler=...), or None."""
+    kwargs = dict(kwargs or {})
+    if name is None:
+        return None
+    if name == 'plateau':
+        kwargs.setdefault('factor', 0.5)
+        kwargs.setdefault('patience', 5)
+        return torch.optim.lr_scheduler.ReduceLROnPlateau(optimizer, mode='min', **kwargs)
+    if name == 'onecycle':
+        try:
+            steps_per_epoch = math.ceil(len(loader) / accumulation_steps)
+        except TypeError:
+            raise ValueError("The onecycle schedule needs a loader with a known length (not a streaming dataset)")
+        kwargs.setdefault('max_lr', optimizer.param_groups[0]['lr'])
+        return torch.optim.lr_scheduler.OneCycleLR(optimizer, epochs=epochs, steps_per_epoch=steps_per_epoch, **kwargs)
+    raise ValueError(f"Unknown scheduler: {name} (expected 'plateau' or 'onecycle')")
+
+def _one_cycle_step(lr_scheduler) -> None:
+    """
+    Advances a OneCycleLR schedule unless it is already complete. Size-budgeted
+    batching (make_loader(max_nodes=..., max_edges=...)) varies the number of
+    batches per epoch, so the schedule, sized from the first epoch, can run out a
+    few steps early; the remaining steps stay at the final learning rate.
+    """
+    if lr_scheduler.last_epoch < lr_scheduler.total_steps:
+        lr_scheduler.step()
+
+class StreamingMetrics:
+    """
+    Regression metrics accumulated batch by batch: running sums are kept on the
+    device in float64 (no per-batch host sync, constant memory) and turned into
+    MSE, RMSE, MAE, max error and R² by result().
+    """
+    def __init__(self, device="cpu"):
+        self.stats = torch.zeros(5, dtype=torch.float64, device=device) # n, sum y, sum y², sum squared error, sum abs error
+        self.max_error = torch.zeros((), dtype=torch.float64, device=device)
+
+    def update(self, pred, y) -> None:
+        pred, y = pred.reshape(-1).double(), y.reshape(-1).double()
+        error = (pred - y).abs()
+        self.stats[0] += y.numel()
+        self.stats[1] += y.sum()
+        self.stats[2] += (y * y).sum()
+        self.stats[3] += (error * error).sum()
+        self.stats[4] += error.sum()
+        if error.numel():
+            self.max_error = torch.maximum(self.max_error, error.max())
+
+    def result(self) -> dict:
+        n, sum_y, sum_y2, sse, sae = self.stats.tolist()
+        if n == 0:
+            raise ValueError("No predictions were accumulated")
+        mse = sse / n
+        total_ss = sum_y2 - sum_y * sum_y / n
+        return {'n': int(n), 'mse': mse, 'rmse': mse ** 0.5, 'mae': sae / n, 'max_error': self.max_error.item(),
+                'r2': 1 - sse / total_ss if total_ss > 0 else float('nan')}
+
+def evaluate(model, loader, device=None, autocast=False) -> dict:
+    """
+    MSE, RMSE, MAE, max error and R² of model on loader (in the units of batch.y).
+    Sums are accumulated on-device, so only one host sync happens at the end.
+    autocast=True runs the model in bfloat16 autocast.
+    """
+    device = torch.device(device or next(model.parameters()).device)
+    metrics = StreamingMetrics(device)
+    model.eval()
+    with torch.inference_mode():
+        for batch in loader:
+            batch = batch.to(device, non_blocking=True)
+            with torch.autocast(device.type, dtype=torch.bfloat16, enabled=autocast):
+                pred = model_forward(model, batch)
+            metrics.update(pred, batch.y)
+    return metrics.result()
+
+class EarlyStopping:
+    """
+    on_epoch_end callback for fit(): computes validation metrics every eval_every
+    epochs (added to the epoch record as val_rmse / val_r2) and stops training
+    after patience checks without an RMSE improvement of at least min_delta.
+    The best weights are kept (on the CPU) and restore() loads them back.
+    """
+    def __init__(self, model, val_loader, patience=10, eval_every=1, min_delta=0.0):
+        # patience=None only tracks the best weights and never stops training
+        self.model = model
+        self.val_loader = val_loader
+        self.patience = patience
+        self.eval_every = eval_every
+        self.min_delta = min_delta
+        self.best = float('inf')
+        self.best_epoch = None
+        self.best_metrics = None
+        self.best_state = None
+        self.bad_checks = 0
+
+    def __call__(self, epoch, record):
+        if epoch % self.eval_every:
+            return False
+        metrics = evaluate(self.model, self.val_loader)
+        record['val_rmse'], record['val_r2'] = metrics['rmse'], metrics['r2']
+        if metrics['rmse'] < self.best - self.min_delta:
+            self.best, self.best_epoch, self.best_metrics, self.bad_checks = metrics['rmse'], epoch, metrics, 0
+            self.best_state = {k: v.detach().to("cpu", copy=True) for k, v in self.model.state_dict().items()}
+        else:
+            self.bad_checks += 1
+        return self.patience is not None and self.bad_checks >= self.patience
+
+    def state_dict(self) -> dict:
+        """Best score, epoch and weights and the patience count, for checkpoints."""
+        return {'best': self.best, 'best_epoch': self.best_epoch, 'best_metrics': self.best_metrics,
+                'best_state': self.best_state, 'bad_checks': self.bad_checks}
+
+    def load_state_dict(self, state) -> None:
+        self.best, self.best_epoch, self.best_metrics = state['best'], state['best_epoch'], state['best_metrics']
+        self.bad_checks = state['bad_checks']
+        self.best_state = ({k: v.to("cpu") for k, v in state['best_state'].items()}
+                           if state['best_state'] is not None else None)
+
+    def restore(self) -> None:
+        """Loads the best weights seen so far back into the model."""
+        if self.best_state is not None:
+            self.model.load_state_dict(self.best_state)
@@ -0,0 +1,135 @@
+# models/ensemble.py
+
+# Train several model replicas (different seeds, or different architectures) on
+# the same collated batches in a single loop, and predict with ensemble mean and
+# variance for uncertainty estimates.
+#
+# When all replicas share one architecture and hyperparameters, their
+# parameters are stacked (torch.func.stack_module_state) and the forward pass is
+# vmapped over the replica dimension, so N models cost one batched pass. Mixed
+# ensembles fall back to looping over the models for each shared batch.
+
+import copy
+import time
+import torch
+from torch.func import functional_call, stack_module_state, vmap
+from torch.nn import MSELoss
+from models.artifacts import build_model
+from models.engine import model_forward
+
+def make_replicas(architecture: str, n_models: int, in_channels: int, edge_dim: int, seed=0, **params) -> list:
+    """n_models copies of one architecture, each initialised from its own seed."""
+    models = []
+    for i in range(n_models):
+        torch.manual_seed(seed + i)
+        models.append(build_model(architecture, in_channels, edge_dim, **params))
+    return models
+
+def _can_vectorise(models) -> bool:
+    first = models[0]
+    return all(type(m) is type(first) and getattr(m, 'hparams', None) == getattr(first, 'hparams', None)
+               for m in models)
+
+def _model_inputs(model, batch):
+    keys = getattr(model, 'input_keys', None)
+    return [batch] if keys is None else [batch[key] for key in keys]
+
+def _stacked_forward(base, params, buffers, batch):
+    """Output of every replica on one batch: [n_models, num_graphs, out_dim]."""
+    inputs = _model_inputs(base, batch)
+    call = lambda p, b, *args: functional_call(base, (p, b), args)
+    return vmap(call, in_dims=(0, 0) + (None,) * len(inputs), randomness='different')(params, buffers, *inputs)
+
+def train_ensemble(models, loader, lr=1e-3, epochs=300, vectorise=True, log_every=10) -> list:
+    """
+    Trains every model in models on the same batches from loader (each batch is
+    collated once). Models are updated in place; returns the per-epoch history
+    with the summed loss of each replica.
+    """
+    loss_fn = MSELoss()
+    vectorised = vectorise and _can_vectorise(models)
+    if vectorised:
+        # One set of stacked leaf tensors; Adam is elementwise, so this equals N separate optimizers
+        params, buffers = stack_module_state(models)
+        base = copy.deepcopy(models[0]).to("meta")
+        optimizer = torch.optim.Adam(params.values(), lr=lr)
+    else:
+        optimizers = [torch.optim.Adam(m.parameters(), lr=lr) for m in models]
+
+    history = []
+    n = len(models)
+    for epoch in range(epochs):
+        total_loss = torch.zeros(n)
+        n_samples = 0
+        start = time.perf_counter()
+        for batch in loader:
+            target = batch.y.view(-1)
+            if vectorised:
+                base.train()
+                out = _stacked_forward(base, params, buffers, batch).view(n, -1)
+                losses = ((out - target) ** 2).mean(dim=1)
+                optimizer.zero_grad()
+                losses.sum().backward()
+                optimizer.step()
+            else:
+                losses = []
+                for model, opt in zip(models, optimizers):
+                    model.train()
+                    opt.zero_grad()
+                    loss = loss_fn(model_forward(model, batch).view(-1), target)
+                    loss.backward()
+                    opt.step()
+                    losses.append(loss)
+                losses = torch.stack(losses)
+            total_loss += losses.detach()
+            n_samples += batch.num_graphs
+
+        seconds = time.perf_counter() - start
+        record = {'epoch': epoch + 1, 'loss': total_loss.tolist(), 'seconds': seconds,
+                  'samples_per_sec': n * n_samples / seconds}
+        history.append(record)
+        if log_every and ((epoch + 1) % log_every == 0 or epoch + 1 == epochs):
+            print(f"Epoch {epoch+1}, Loss: {total_loss.mean():.4f} (mean of {n}), "
+                  f"{record['samples_per_sec']:.0f} samples/s")
+
+    if vectorised:
+        # Copy the trained stacked weights back into the individual models
+        with torch.no_grad():
+            for i, model in enumerate(models):
+                for name, tensor in model.named_parameters():
+                    tensor.copy_(params[name][i])
+                for name, tensor in model.named_buffers():
+                    tensor.copy_(buffers[name][i])
+    return history
+
+def predict_ensemble(models, loader, scaler=None):
+    """
+    Ensemble predictions over loader. Returns (mean, variance, targets) as numpy
+    arrays, each [num_graphs]; targets is None if the batches carry no labels.
+    With scaler, predictions and targets are mapped back to the original scale.
+    """
+    vectorised = _can_vectorise(models)
+    if vectorised:
+        params, buffers = stack_module_state(models)
+        base = copy.deepcopy(models[0]).to("meta").eval()
+    for model in models:
+        model.eval()
+
+    preds, targets = [], []
+    with torch.no_grad():
+        for batch in loader:
+            if vectorised:
+                out = _stacked_forward(base, params, buffers, batch)
+            else:
+                out = torch.stack([model_forward(m, batch) for m in models])
+            preds.append(out.view(len(models), -1).cpu())
+            if batch.y is not None:
+                targets.append(batch.y.view(-1).cpu())
+
+    preds = torch.cat(preds, dim=1).numpy()
+    targets = torch.cat(targets).numpy() if targets else None
+    if scaler is not None:
+        preds = scaler.inverse_transform(preds.reshape(-1, 1)).reshape(preds.shape)
+        if targets is not None:
+            targets = scaler.inverse_transform(targets.reshape(-1, 1)).ravel()
+    return preds.mean(axis=0), preds.var(axis=0), targets
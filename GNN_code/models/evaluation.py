@@ -0,0 +1,175 @@
+# models/evaluation.py
+
+# Streaming evaluation for MPNNModel, GCNModel, GATModel and AttentiveFPModel.
+# Predictions are scored batch by batch: metrics are accumulated incrementally
+# (models.engine.StreamingMetrics), per-molecule rows are written to disk as they
+# are produced and ranked by absolute error with an external merge sort, and the
+# predicted-vs-actual figure is drawn from a fixed-size random sample of points.
+# Memory use therefore does not grow with the size of the held-out set.
+#
+# Nothing is displayed: figures are only rendered to a file, and only when a
+# plot_path is given, so evaluation can run in headless batch jobs.
+#
+#   metrics = evaluate_predictions(model, loader, scaler, output_path="data/processed/mpnn_predictions.csv",
+#                                  plot_path="data/processed/mpnn_model_accuracy.png")
+
+import csv
+import heapq
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+import torch
+from models.engine import StreamingMetrics, model_forward
+
+COLUMNS = ['Rank', 'SMILES', 'Actual', 'Predicted', 'Absolute Error']
+
+class _Reservoir:
+    """Uniform random sample of at most size (actual, predicted) pairs from a stream."""
+    def __init__(self, size, seed=0):
+        self.size = size
+        self.rng = np.random.default_rng(seed)
+        self.points = np.empty((size, 2), dtype=np.float64)
+        self.seen = 0
+
+    def add(self, actual, predicted):
+        points = np.column_stack([actual, predicted])
+        n_fill = min(max(self.size - self.seen, 0), len(points))
+        self.points[self.seen:self.seen + n_fill] = points[:n_fill]
+        rest = points[n_fill:]
+        if len(rest):
+            # Item number i (0-based) of the stream replaces a random slot with probability size / (i + 1)
+            positions = self.seen + n_fill + np.arange(len(rest))
+            keep = self.rng.random(len(rest)) < self.size / (positions + 1)
+            self.points[self.rng.integers(self.size, size=int(keep.sum()))] = rest[keep]
+        self.seen += len(points)
+
+    def sample(self):
+        return self.points[:min(self.seen, self.size)]
+
+def _write_run(rows, run_dir, n_runs):
+    """Sorts buffered rows by decreasing absolute error and writes them as one run file."""
+    df = pd.concat(rows, ignore_index=True).sort_values('Absolute Error', ascending=False, kind='stable')
+    path = os.path.join(run_dir, f"run_{n_runs:05d}.csv")
+    df.to_csv(path, index=False, header=False)
+    return path
+
+def _merge_runs(run_paths, output_path):
+    """k-way merge of sorted run files into output_path, adding the rank column."""
+    files = [open(path, newline="") for path in run_paths]
+    try:
+        readers = [csv.reader(f) for f in files]
+        merged = heapq.merge(*readers, key=lambda row: -float(row[3]))
+        with open(output_path, "w", newline="") as out:
+            writer = csv.writer(out)
+            writer.writerow(COLUMNS)
+            for rank, row in enumerate(merged, start=1):
+                writer.writerow([rank] + row)
+    finally:
+        for f in files:
+            f.close()
+
+def save_prediction_plot(actual, predicted, plot_path, title="Predicted vs. Actual", metrics=None) -> None:
+    """Renders a predicted-vs-actual scatter straight to plot_path (no window, no pyplot state)."""
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(6, 6))
+    ax = fig.subplots()
+    ax.scatter(actual, predicted, alpha=0.7)
+    if len(actual):
+        low, high = min(actual.min(), predicted.min()), max(actual.max(), predicted.max())
+        ax.plot([low, high], [low, high], 'r--')
+    if metrics is not None:
+        ax.text(0.05, 0.95, f"R² = {metrics['r2']:.3f}\nRMSE = {metrics['rmse']:.3f}", transform=ax.transAxes,
+                va="top")
+    ax.set_xlabel("Actual")
+    ax.set_ylabel("Predicted")
+    ax.set_title(title)
+    ax.grid(True)
+    fig.tight_layout()
+    os.makedirs(os.path.dirname(plot_path) or ".", exist_ok=True)
+    fig.savefig(plot_path, dpi=150)
+    print(f" Plot saved to: {plot_path}")
+
+def evaluate_predictions(model, loader, scaler=None, output_path=None, plot_path=None, title="Predicted vs. Actual",
+                         top_n=5, device=None, autocast=False, run_size=100_000, max_plot_points=20_000,
+                         seed=0) -> dict:
+    """
+    Scores model on loader and returns MSE, RMSE, MAE, max error and R² (in the
+    original units if scaler, e.g. the MinMaxScaler from train_normalised, is given).
+
+    output_path: per-molecule CSV (Rank, SMILES, Actual, Predicted, Absolute
+        Error) sorted by decreasing absolute error; if the graphs carry no SMILES,
+        that column holds each molecule's position in the loader instead.
+    plot_path: also save a predicted-vs-actual figure there (drawn from a random
+        sample of at most max_plot_points molecules).
+    The top_n worst predictions are printed. Rows are sorted in runs of run_size
+    and merged from disk, so memory use is bounded for any loader size.
+    """
+    device = torch.device(device or next(model.parameters()).device)
+    metrics = StreamingMetrics(device)
+    reservoir = _Reservoir(max_plot_points, seed) if plot_path else None
+    worst = [] # min-heap of the top_n largest (error, position, name, actual, predicted)
+
+    run_dir = None
+    if output_path:
+        os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+        run_dir = tempfile.TemporaryDirectory(prefix="eval_runs_", dir=os.path.dirname(output_path) or ".")
+    run_paths, buffered, n_buffered = [], [], 0
+    position = 0
+
+    model.eval()
+    try:
+        with torch.inference_mode():
+            for batch in loader:
+                batch = batch.to(device, non_blocking=True)
+                with torch.autocast(device.type, dtype=torch.bfloat16, enabled=autocast):
+                    pred = model_forward(model, batch)
+                pred = pred.reshape(-1).float().cpu().numpy().astype(np.float64)
+                actual = batch.y.reshape(-1).cpu().numpy().astype(np.float64)
+                if scaler is not None:
+                    pred = scaler.inverse_transform(pred.reshape(-1, 1)).ravel()
+                    actual = scaler.inverse_transform(actual.reshape(-1, 1)).ravel()
+                metrics.update(torch.from_numpy(pred), torch.from_numpy(actual))
+
+                error = np.abs(actual - pred)
+                smiles = getattr(batch, 'smiles', None)
+                names = list(smiles) if smiles is not None else [str(i) for i in range(position, position + len(pred))]
+                for i in np.argsort(-error)[:top_n]:
+                    item = (error[i], -(position + i), names[i], actual[i], pred[i])
+                    if len(worst) < top_n:
+                        heapq.heappush(worst, item)
+                    elif item > worst[0]:
+                        heapq.heapreplace(worst, item)
+                if reservoir is not None:
+                    reservoir.add(actual, pred)
+                if run_dir is not None:
+                    buffered.append(pd.DataFrame({'SMILES': names, 'Actual': actual, 'Predicted': pred,
+                                                  'Absolute Error': error}))
+                    n_buffered += len(pred)
+                    if n_buffered >= run_size:
+                        run_paths.append(_write_run(buffered, run_dir.name, len(run_paths)))
+                        buffered, n_buffered = [], 0
+                position += len(pred)
+
+        if run_dir is not None:
+            if buffered:
+                run_paths.append(_write_run(buffered, run_dir.name, len(run_paths)))
+            _merge_runs(run_paths, output_path)
+            print(f" Saved {position} predictions (ranked by absolute error) to: {output_path}")
+    finally:
+        if run_dir is not None:
+            run_dir.cleanup()
+
+    result = metrics.result()
+    print(f"R² score: {result['r2']:.3f}")
+    print(f"RMSE: {result['rmse']:.3f}")
+    if worst:
+        print(f"Worst {len(worst)} predictions:")
+        for error, _, name, actual, pred in sorted(worst, reverse=True):
+            print(f"  {name}: actual {actual:.3f}, predicted {pred:.3f} (error {error:.3f})")
+
+    if reservoir is not None:
+        sample = reservoir.sample()
+        save_prediction_plot(sample[:, 0], sample[:, 1], plot_path, title, result)
+    return result
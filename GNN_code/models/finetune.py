@@ -0,0 +1,83 @@
+# models/finetune.py
+
+# Warm-start fine-tuning of a saved model artifact (models/artifacts.py) on newly
+# added molecules, instead of retraining from random weights on the whole set.
+# Each fine-tune trains on the new graphs plus a replayed random sample of the
+# old ones (so the model does not drift away from the data it already fits),
+# holds out a validation split, stops early once validation RMSE stops improving
+# and keeps the best weights. Its cost therefore scales with the size of the
+# update rather than with the size of the whole dataset.
+
+import copy
+import numpy as np
+import torch
+from models.artifacts import load_artifact, save_artifact
+from models.engine import evaluate, fit, make_loader
+
+def _with_scaled_target(graph, scaler):
+    """Shallow copy of graph whose label is mapped through scaler (the input graph is left untouched)."""
+    graph = copy.copy(graph)
+    if scaler is not None:
+        y = scaler.transform(graph.y.view(-1, 1).double().numpy())
+        graph.y = torch.tensor(y, dtype=torch.float).view(-1)
+    return graph
+
+def replay_sample(old_graphs, n: int, seed=0) -> list:
+    """n graphs drawn at random (without replacement) from a graph list or PackedGraphDataset."""
+    n = min(n, len(old_graphs))
+    idx = np.random.default_rng(seed).choice(len(old_graphs), size=n, replace=False)
+    return [old_graphs[int(i)] for i in np.sort(idx)]
+
+def fine_tune(artifact_path: str, new_graphs, old_graphs=None, replay_ratio=1.0, val_fraction=0.2,
+              lr=1e-4, max_epochs=100, patience=10, batch_size=16, seed=0, output_path=None, device=None,
+              **engine_kwargs):
+    """
+    Fine-tunes the model saved at artifact_path on new_graphs (labels in original
+    units; the artifact's target scaler is applied if it has one).
+
+    old_graphs: the data the model was trained on (list or PackedGraphDataset);
+        replay_ratio * len(new_graphs) of them are replayed alongside the new graphs.
+    val_fraction of the combined set is held out for early stopping (patience
+    epochs without a validation RMSE improvement); the best weights are restored.
+    output_path saves the fine-tuned model as a new artifact (same scaler).
+    Extra keyword arguments go to models.engine.fit.
+
+    Returns (model, history, validation metrics of the restored weights, in
+    scaled target units if the artifact has a scaler).
+    """
+    model, scaler, info = load_artifact(artifact_path, device=device or "cpu")
+    # The loaded weights are memory-mapped from the artifact; train on private copies
+    model = copy.deepcopy(model)
+
+    replay = replay_sample(old_graphs, int(round(replay_ratio * len(new_graphs))), seed) if old_graphs is not None else []
+    graphs = [_with_scaled_target(g, scaler) for g in list(new_graphs) + replay]
+    if len(graphs) < 2:
+        raise ValueError("Fine-tuning needs at least two graphs (one for validation)")
+
+    order = np.random.default_rng(seed).permutation(len(graphs))
+    n_val = min(max(1, int(round(val_fraction * len(graphs)))), len(graphs) - 1)
+    val_graphs = [graphs[i] for i in order[:n_val]]
+    train_graphs = [graphs[i] for i in order[n_val:]]
+    print(f"Fine-tuning {info['architecture']} from {artifact_path} on {len(new_graphs)} new + "
+          f"{len(replay)} replayed graphs ({len(train_graphs)} train / {len(val_graphs)} validation)")
+
+    train_loader = make_loader(train_graphs, batch_size=batch_size, shuffle=True, seed=seed)
+    val_loader = make_loader(val_graphs, batch_size=256, shuffle=False)
+    # The starting weights are scored too, so fine-tuning never ends up worse than them
+    history = fit(model, train_loader, lr=lr, epochs=max_epochs, device=device, val_loader=val_loader,
+                  patience=patience, eval_initial=True, **engine_kwargs)
+    metrics = evaluate(model, val_loader)
+    # Epoch of the restored weights (0: no epoch beat the starting weights)
+    scored = [record for record in history if 'val_rmse' in record]
+    best = min(scored, key=lambda record: record['val_rmse']) if scored else None
+    best_epoch = best['epoch'] if best is not None and best['val_rmse'] <= metrics['rmse'] else 0
+    print(f"Best validation RMSE {metrics['rmse']:.4f} (R² {metrics['r2']:.3f}) at epoch {best_epoch} "
+          f"of {len(history)}")
+
+    if output_path:
+        metadata = dict(info['metadata'], trainer='fine_tune', base_artifact=artifact_path,
+                        epochs=len(history), best_epoch=best_epoch, n_new=len(new_graphs),
+                        n_replay=len(replay), val_rmse=metrics['rmse'], val_r2=metrics['r2'])
+        metadata.pop('saved_at', None)
+        save_artifact(output_path, model, scaler=scaler, metadata=metadata)
+    return model, history, metrics
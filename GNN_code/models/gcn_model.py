@@ -1,16 +1,18 @@
 import torch
 from torch.nn import Linear, ReLU, Dropout, Sequential
 from torch_geometric.nn import GCNConv, global_mean_pool
-from torch.nn import MSELoss
-from torch_geometric.loader import DataLoader
-from sklearn.metrics import r2_score, mean_squared_error
-import matplotlib.pyplot as plt
-import numpy as np
+import telemetry
+from models.engine import fit
+from models.evaluation import evaluate_predictions
 
 # GCNModel class for Graph Convolutional Network
 class GCNModel(torch.nn.Module):
+    input_keys = ('x', 'edge_index', 'batch')
+
     def __init__(self, in_channels, hidden_dim, out_dim=1, dropout_rate=0.2):
         super().__init__()
+        self.hparams = dict(in_channels=in_channels, hidden_dim=hidden_dim, out_dim=out_dim,
+                            dropout_rate=dropout_rate)
 
         # GCN layers
         self.conv1 = GCNConv(in_channels, hidden_dim)
@@ -25,80 +27,28 @@ class GCNModel(torch.nn.Module):
         )
 
     def forward(self, x, edge_index, batch):
+        return self.ffnn(self.embed(x, edge_index, batch))
+
+    def embed(self, x, edge_index, batch):
+        """Graph embeddings [num_graphs, hidden_dim]: the pooled readout fed to the ffnn head."""
         x = self.conv1(x, edge_index)
         x = torch.relu(x)
 
         # batch = torch.zeros(x.size(0), dtype=torch.long)
-        x = global_mean_pool(x, batch)
-        out = self.ffnn(x)
-        return out
+        return global_mean_pool(x, batch)
 
 
 # Training function for the GCN model (using batching)
-def train_gcn_model_batched(dataloader, model, lr=1e-3, epochs=300):
-    optimizer = torch.optim.Adam(model.parameters(), lr=lr)
-    loss_fn = MSELoss()
-
-    model.train()
-    for epoch in range(epochs):
-        total_loss = 0
-        for batch in dataloader:
-            optimizer.zero_grad()
-            out = model(batch.x, batch.edge_index, batch.batch).squeeze()
-            target = batch.y.squeeze()
-
-            assert out.shape == target.shape, f"{out.shape=} vs {target.shape=}"
-            loss = loss_fn(out, target)
-            loss.backward()
-            optimizer.step()
-            total_loss += loss.item()
-
-        print(f"Epoch {epoch+1}, Loss: {total_loss:.4f}")
-    
+def train_gcn_model_batched(dataloader, model, lr=1e-3, epochs=300, **engine_kwargs):
+    fit(model, dataloader, lr=lr, epochs=epochs, **engine_kwargs)
     return model
 
 # Function to plot predictions vs actual values for the GCN model
-def plot_predictions(dataloader, model):
+@telemetry.timed('plot_predictions')
+def plot_predictions(dataloader, model, output_path=None, plot_path=None):
     """
-    Function to plot predictions vs actual values.
+    Reports R² / RMSE of predictions vs actual values; output_path and plot_path
+    save the ranked per-molecule predictions and the figure (see models/evaluation.py).
     """
-    all_preds = [] 
-    all_targets = []
-
-    # Put model in evaluation mode
-    model.eval()
-    with torch.no_grad():
-        for batch in dataloader:
-            preds = model(batch.x, batch.edge_index, batch.batch).squeeze()
-            targets = batch.y.squeeze()
-
-            # Handle possible shape mismatches
-            if preds.dim() == 0:
-                preds = preds.unsqueeze(0)
-            if targets.dim() == 0:
-                targets = targets.unsqueeze(0)
-
-            all_preds.append(preds.cpu())
-            all_targets.append(targets.cpu())
-
-    all_preds = torch.cat(all_preds, dim=0).numpy()
-    all_targets = torch.cat(all_targets, dim=0).numpy()
-
-    # Compute metrics
-    r2 = r2_score(all_targets, all_preds)
-    rmse = np.sqrt(mean_squared_error(all_targets, all_preds))
-
-    print(f"R² score: {r2:.3f}")
-    print(f"RMSE: {rmse:.3f}")
-
-    # Plot
-    plt.figure(figsize=(6, 6))
-    plt.scatter(all_targets, all_preds, alpha=0.7)
-    plt.plot([all_targets.min(), all_targets.max()],
-             [all_targets.min(), all_targets.max()], 'r--')
-    plt.xlabel("Actual")
-    plt.ylabel("Predicted")
-    plt.title("Predicted vs. Actual - GCN Model (Batched)")
-    plt.grid(True)
-    plt.tight_layout()
-    plt.show()
\ No newline at end of file
+    return evaluate_predictions(model, dataloader, output_path=output_path, plot_path=plot_path,
+                                title="Predicted vs. Actual - GCN Model (Batched)")
\ No newline at end of file
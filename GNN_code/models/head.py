@@ -0,0 +1,214 @@
+# models/head.py
+
+# Head-only training on a frozen encoder. The message passing part of a model
+# (conv1 and further MPNN layers, or the AttentiveFP encoder) is frozen, the
+# pooled readouts (model.embed) are computed once for the whole dataset, and
+# only the ffnn Sequential head is trained on that cached [num_graphs, hidden_dim]
+# tensor in large dense batches. An epoch then costs a few small matrix
+# multiplications instead of a full pass of message passing, which makes
+# tuning the head (hidden size, dropout_rate, learning rate, loss) cheap:
+#
+#   X, y = cache_readouts(model, graphs)
+#   results = tune_head(model, {'hidden_dim': [32, 64, 128], 'dropout_rate': [0.0, 0.2],
+#                               'loss': ['mse', 'huber']}, readouts=(X, y))
+
+import copy
+import os
+import time
+import pandas as pd
+import torch
+from torch.nn import Dropout, HuberLoss, L1Loss, Linear, MSELoss, ReLU, Sequential
+from models.engine import make_loader, model_embed, train_val_split
+from models.sweep import expand_grid
+
+LOSSES = {'mse': MSELoss, 'l1': L1Loss, 'huber': HuberLoss}
+
+# tune_head parameters that shape the head or its training; anything else is rejected
+HEAD_PARAMS = ('hidden_dim', 'dropout_rate', 'lr', 'batch_size', 'epochs', 'loss')
+
+# Constructor arguments (model.hparams) that also size or configure the encoder, so
+# a replacement head has to keep them; by default only hidden_dim
+ENCODER_HPARAMS = {'AttentiveFPModel': ('hidden_dim', 'dropout_rate')}
+
+def make_head(in_dim: int, hidden_dim=64, out_dim=1, dropout_rate=0.2) -> Sequential:
+    """Regression head with the layout of the model classes' ffnn."""
+    return Sequential(
+        Linear(in_dim, hidden_dim),
+        ReLU(),
+        Dropout(dropout_rate),
+        Linear(hidden_dim, out_dim)
+    )
+
+def freeze_encoder(model):
+    """Stops gradients to every parameter outside model.ffnn; returns model."""
+    for name, param in model.named_parameters():
+        param.requires_grad = name.startswith('ffnn.')
+    return model
+
+def unfreeze(model):
+    for param in model.parameters():
+        param.requires_grad = True
+    return model
+
+def _head_hparams(model, head) -> dict:
+    """
+    model.hparams with the head's dropout_rate, after checking that the model
+    class can rebuild head from them (so saved artifacts still load); raises
+    ValueError otherwise.
+    """
+    layers = list(head) if isinstance(head, Sequential) else []
+    dropout = [layer.p for layer in layers if isinstance(layer, Dropout)]
+    if len(layers) != 4 or not isinstance(layers[0], Linear) or not isinstance(layers[-1], Linear) or not dropout:
+        raise ValueError("head must have the layout of make_head (Linear, ReLU, Dropout, Linear)")
+    hparams = dict(getattr(model, 'hparams', {}))
+    implied = {'hidden_dim': layers[0].out_features, 'out_dim': layers[-1].out_features, 'dropout_rate': dropout[0]}
+    fixed = ENCODER_HPARAMS.get(type(model).__name__, ('hidden_dim',)) + ('out_dim',)
+    mismatched = [f"{key}={implied[key]} (model has {hparams[key]})" for key in fixed
+                  if key in hparams and implied[key] != hparams[key]]
+    if layers[0].in_features != model.ffnn[0].in_features or mismatched:
+        raise ValueError(f"head does not fit {type(model).__name__}: "
+                         f"{', '.join(mismatched) or f'input size {layers[0].in_features}'}")
+    if 'dropout_rate' in hparams:
+        hparams['dropout_rate'] = implied['dropout_rate']
+    return hparams
+
+def cache_readouts(model, graphs, batch_size=1024, device=None):
+    """
+    Pooled readouts of graphs (list or PackedGraphDataset) under the model's
+    encoder, in eval mode: returns (X [num_graphs, hidden_dim], y [num_graphs]).
+    """
+    device = torch.device(device or next(model.parameters()).device)
+    model.eval()
+    readouts, targets = [], []
+    with torch.inference_mode():
+        for batch in make_loader(graphs, batch_size=batch_size, shuffle=False):
+            batch = batch.to(device)
+            readouts.append(model_embed(model, batch).float())
+            targets.append(batch.y.view(-1).float())
+    return torch.cat(readouts), torch.cat(targets)
+
+def _head_metrics(head, X, y) -> dict:
+    head.eval()
+    with torch.inference_mode():
+        pred = head(X).view(-1).double()
+    y = y.double()
+    mse = ((pred - y) ** 2).mean().item()
+    total_ss = ((y - y.mean()) ** 2).sum().item()
+    return {'mse': mse, 'rmse': mse ** 0.5,
+            'r2': 1 - mse * len(y) / total_ss if total_ss > 0 else float('nan')}
+
+def _train_head(head, X, y, lr, epochs, batch_size, loss_fn, X_val=None, y_val=None, patience=None,
+                log_every=0, seed=0):
+    """Dense minibatch training of head on cached readouts; returns the per-epoch history."""
+    optimizer = torch.optim.Adam(head.parameters(), lr=lr)
+    generator = torch.Generator(device="cpu").manual_seed(seed)
+    history = []
+    best, best_state, bad_epochs = float('inf'), None, 0
+    for epoch in range(epochs):
+        start = time.perf_counter()
+        head.train()
+        total_loss = torch.zeros((), device=X.device)
+        for idx in torch.randperm(len(X), generator=generator).to(X.device).split(batch_size):
+            loss = loss_fn(head(X[idx]).view(-1), y[idx])
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            total_loss += loss.detach() * len(idx)
+        seconds = time.perf_counter() - start
+        record = {'epoch': epoch + 1, 'loss': total_loss.item() / len(X), 'seconds': seconds,
+                  'samples_per_sec': len(X) / seconds}
+
+        if X_val is not None:
+            metrics = _head_metrics(head, X_val, y_val)
+            record['val_rmse'], record['val_r2'] = metrics['rmse'], metrics['r2']
+            if metrics['rmse'] < best:
+                best, bad_epochs = metrics['rmse'], 0
+                best_state = copy.deepcopy(head.state_dict())
+            else:
+                bad_epochs += 1
+        history.append(record)
+        if log_every and ((epoch + 1) % log_every == 0 or epoch + 1 == epochs):
+            val = f", Val RMSE: {record['val_rmse']:.4f}" if 'val_rmse' in record else ""
+            print(f"Epoch {epoch+1}, Loss: {record['loss']:.4f}{val}, {record['samples_per_sec']:.0f} samples/s")
+        if patience is not None and bad_epochs >= patience:
+            break
+
+    # Keep the head that scored best on the validation readouts
+    if best_state is not None:
+        head.load_state_dict(best_state)
+    return history
+
+def train_head(model, graphs=None, readouts=None, lr=1e-3, epochs=300, batch_size=4096, loss='mse', head=None,
+               val_fraction=0.0, patience=None, seed=0, device=None, log_every=50) -> list:
+    """
+    Trains only model.ffnn on frozen-encoder readouts and returns the per-epoch
+    history. readouts=(X, y) from cache_readouts skips the encoder pass entirely;
+    otherwise they are computed from graphs. head (e.g. from make_head) replaces
+    model.ffnn before training; its sizes must match model.hparams (hidden_dim,
+    out_dim) and its dropout_rate is recorded there. With val_fraction, that share of the readouts is
+    held out, patience epochs without a validation RMSE improvement stop training
+    and the best head is kept. loss is 'mse', 'l1', 'huber' or a loss module.
+    """
+    device = torch.device(device or next(model.parameters()).device)
+    X, y = readouts if readouts is not None else cache_readouts(model, graphs, device=device)
+    X, y = X.to(device), y.to(device)
+    if head is not None:
+        hparams = _head_hparams(model, head)
+        model.ffnn = head
+        if hasattr(model, 'hparams'):
+            model.hparams = hparams
+    model.to(device)
+    loss_fn = LOSSES[loss]() if isinstance(loss, str) else loss
+
+    X_val = y_val = None
+    if val_fraction:
+        train_idx, val_idx = (torch.as_tensor(i, device=device) for i in train_val_split(len(X), val_fraction, seed))
+        X, y, X_val, y_val = X[train_idx], y[train_idx], X[val_idx], y[val_idx]
+
+    # Freeze the encoder for this run only; the caller's requires_grad flags are restored afterwards
+    requires_grad = {name: param.requires_grad for name, param in model.named_parameters()}
+    freeze_encoder(model)
+    try:
+        return _train_head(model.ffnn, X, y, lr, epochs, batch_size, loss_fn, X_val, y_val, patience, log_every, seed)
+    finally:
+        for name, param in model.named_parameters():
+            param.requires_grad = requires_grad.get(name, True)
+
+def tune_head(model, param_grid: dict, graphs=None, readouts=None, val_fraction=0.2, patience=30, seed=0,
+              device=None, results_path=None) -> pd.DataFrame:
+    """
+    Trains a fresh head for every combination in param_grid (dict of lists over
+    hidden_dim, dropout_rate, lr, batch_size, epochs and loss) on the same cached
+    readouts and validation split. Returns a results table sorted by validation
+    RMSE (also written to results_path if given). model itself is left unchanged.
+    """
+    unknown = {k for k in param_grid if k not in HEAD_PARAMS}
+    if unknown:
+        raise ValueError(f"Unknown head parameters: {', '.join(sorted(unknown))} (expected {', '.join(HEAD_PARAMS)})")
+    device = torch.device(device or next(model.parameters()).device)
+    X, y = readouts if readouts is not None else cache_readouts(model, graphs, device=device)
+    X, y = X.to(device), y.to(device)
+    train_idx, val_idx = (torch.as_tensor(i, device=device) for i in train_val_split(len(X), val_fraction, seed))
+    out_dim = model.ffnn[-1].out_features
+
+    rows = []
+    trials = expand_grid(param_grid)
+    print(f"Head sweep: {len(trials)} trials on {len(train_idx)} cached readouts ({X.shape[1]}-d)")
+    for i, params in enumerate(trials):
+        torch.manual_seed(seed)
+        head = make_head(X.shape[1], params.get('hidden_dim', 64), out_dim, params.get('dropout_rate', 0.2)).to(device)
+        start = time.perf_counter()
+        history = _train_head(head, X[train_idx], y[train_idx], params.get('lr', 1e-3), params.get('epochs', 300),
+                              params.get('batch_size', 4096), LOSSES[params.get('loss', 'mse')](),
+                              X[val_idx], y[val_idx], patience, seed=seed)
+        metrics = _head_metrics(head, X[val_idx], y[val_idx])
+        rows.append(dict(trial=i, **params, val_rmse=metrics['rmse'], val_r2=metrics['r2'],
+                         epochs_run=len(history), seconds=time.perf_counter() - start))
+        print(f"Trial {i}: val RMSE {metrics['rmse']:.3f} (R² {metrics['r2']:.3f})")
+
+    results = pd.DataFrame(rows).sort_values('val_rmse').reset_index(drop=True)
+    if results_path:
+        os.makedirs(os.path.dirname(results_path) or ".", exist_ok=True)
+        results.to_csv(results_path, index=False)
+        print(f" Head sweep results saved to: {results_path}")
+    return results
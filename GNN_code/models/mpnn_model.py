@@ -13,33 +13,102 @@ Created on Wed May 14 15:01:45 2025
 # into a final MLP regression layer (wrt inhibition efficiency).
 
 import torch
-from torch.nn import Linear, ReLU, Dropout, Sequential
-from torch_geometric.nn import NNConv, global_mean_pool
+from torch.nn import Linear, ReLU, Dropout, Sequential, ModuleList, Parameter
+from torch_geometric.nn import MessagePassing, NNConv, global_mean_pool
+
+# Edge network modes (MPNNModel edge_mode):
+#   'dense'   - stock NNConv: the edge network produces an in x out weight matrix
+#               for every edge and every message is a separate small matmul
+#   'dedup'   - same parameters as 'dense' (weights are interchangeable), but the
+#               edge network only runs on the distinct edge-feature rows of the
+#               batch. Bond features take a handful of discrete values, so a
+#               batch with thousands of edges typically needs a few dozen weight
+#               matrices, which are computed once and gathered per edge
+#   'lowrank' - factorised edge network W_e = A diag(g(e_ij)) B with a shared
+#               in->rank projection A, rank->out projection B and a small gate
+#               network g, so messages cost O(rank) per edge
+EDGE_MODES = ('dense', 'dedup', 'lowrank')
+
+class DedupNNConv(NNConv):
+    """NNConv (aggr='add') that computes one weight matrix per distinct edge-feature row."""
+    def forward(self, x, edge_index, edge_attr, size=None):
+        src, dst = edge_index
+        unique_attr, edge_type = torch.unique(edge_attr, dim=0, return_inverse=True)
+        weight = self.nn(unique_attr).view(-1, self.in_channels_l, self.out_channels) # [U, in, out]
+        n_types = weight.size(0)
+
+        if n_types == 0:
+            # Edgeless batch (single atoms, salts): no messages, only the root term below
+            msgs = x.new_zeros(0, self.out_channels)
+        elif x.size(0) * n_types <= src.numel():
+            # Few edge types: transform every node once per type, then pick (source, type) rows
+            node_msgs = (x @ weight.permute(1, 0, 2).reshape(self.in_channels_l, -1)).view(x.size(0), n_types, -1)
+            msgs = node_msgs[src, edge_type]
+        else:
+            msgs = torch.bmm(x[src].unsqueeze(1), weight[edge_type]).squeeze(1)
+
+        out = x.new_zeros(x.size(0), self.out_channels, dtype=msgs.dtype).index_add(0, dst, msgs)
+        if self.root_weight:
+            out = out + self.lin(x)
+        if self.bias is not None:
+            out = out + self.bias
+        return out
+
+class LowRankNNConv(MessagePassing):
+    """Edge-conditioned convolution with a rank-r factorised edge network (see EDGE_MODES)."""
+    def __init__(self, in_channels, out_channels, edge_dim, rank=16):
+        super().__init__(aggr='add')
+        self.gate_nn = Sequential(Linear(edge_dim, rank), ReLU(), Linear(rank, rank))
+        self.down = Linear(in_channels, rank, bias=False)
+        self.up = Linear(rank, out_channels, bias=False)
+        self.lin = Linear(in_channels, out_channels, bias=False) # root weight, as in NNConv
+        self.bias = Parameter(torch.zeros(out_channels))
+
+    def forward(self, x, edge_index, edge_attr):
+        # up is linear, so it is applied once per node after aggregation instead of per edge
+        out = self.propagate(edge_index, x=self.down(x), gate=self.gate_nn(edge_attr))
+        return self.up(out) + self.lin(x) + self.bias
+
+    def message(self, x_j, gate):
+        return x_j * gate
+
+def make_edge_conv(in_channels, out_channels, edge_dim, edge_mode='dense', rank=16):
+    """One edge-conditioned message passing layer for the given edge_mode."""
+    if edge_mode not in EDGE_MODES:
+        raise ValueError(f"Unknown edge_mode: {edge_mode} (expected one of {', '.join(EDGE_MODES)})")
+    if edge_mode == 'lowrank':
+        return LowRankNNConv(in_channels, out_channels, edge_dim, rank)
+    # Edge network maps edge features to a weight matrix for message passing
+    edge_nn = Sequential(
+        Linear(edge_dim, out_channels * in_channels),
+        ReLU(),
+        Linear(out_channels * in_channels, out_channels * in_channels)
+    )
+    conv_cls = DedupNNConv if edge_mode == 'dedup' else NNConv
+    return conv_cls(in_channels, out_channels, nn=edge_nn, aggr='add')
 
 class MPNNModel(torch.nn.Module):
-    def __init__(self, in_channels, edge_dim, hidden_dim, out_dim=1, dropout_rate=0.2):
+    # Batch attributes passed to forward(), in order (used by models/engine.py)
+    input_keys = ('x', 'edge_index', 'edge_attr', 'batch')
+
+    def __init__(self, in_channels, edge_dim, hidden_dim, out_dim=1, dropout_rate=0.2,
+                 num_layers=1, edge_mode='dense', rank=16):
         super().__init__()
-        
-        # Edge network for the first layer
-        # Maps edge features to a weight matrix for message passing
-        self.edge_nn1 = Sequential(
-            Linear(edge_dim, hidden_dim * in_channels),
-            ReLU(),
-            Linear(hidden_dim * in_channels, hidden_dim * in_channels)
-        )
+        # Constructor arguments, stored with saved artifacts (models/artifacts.py)
+        self.hparams = dict(in_channels=in_channels, edge_dim=edge_dim, hidden_dim=hidden_dim,
+                            out_dim=out_dim, dropout_rate=dropout_rate,
+                            num_layers=num_layers, edge_mode=edge_mode, rank=rank)
 
         # GNN Encoder for the first layer
-        self.conv1 = NNConv(in_channels, hidden_dim, nn=self.edge_nn1, aggr='add')
-        
-        # Second edge network (can share or reuse logic, but typically kept separate)
-       #  self.edge_nn2 = Sequential(
-       #      Linear(edge_dim, hidden_dim * hidden_dim), 
-       #      ReLU(), 
-       #      Linear(hidden_dim * hidden_dim, hidden_dim * hidden_dim)
-       # )
-        
-       # GNN Encoder for the second layer
-        # self.conv2 = NNConv(hidden_dim, hidden_dim, nn=self.edge_nn2, aggr='add')
+        self.conv1 = make_edge_conv(in_channels, hidden_dim, edge_dim, edge_mode, rank)
+        if edge_mode != 'lowrank':
+            # Edge network for the first layer (kept under its original name)
+            self.edge_nn1 = self.conv1.nn
+
+        # Further message passing layers, each with its own edge network
+        # ('dedup' or 'lowrank' keep these affordable, 'dense' is very slow beyond one layer)
+        self.convs = ModuleList([make_edge_conv(hidden_dim, hidden_dim, edge_dim, edge_mode, rank)
+                                 for _ in range(num_layers - 1)])
 
         # Feedforward MLP for regression
         self.ffnn = Sequential(
@@ -50,17 +119,18 @@ class MPNNModel(torch.nn.Module):
         )
 
     def forward(self, x, edge_index, edge_attr, batch):
+        # Feedforward regression head on the pooled graph embedding
+        return self.ffnn(self.embed(x, edge_index, edge_attr, batch))
+
+    def embed(self, x, edge_index, edge_attr, batch):
+        """Graph embeddings [num_graphs, hidden_dim]: the pooled readout fed to the ffnn head."""
         # First message passing layer
         x = self.conv1(x, edge_index, edge_attr) # Message logic within PyG source code for NNConv
         x = torch.relu(x) # Non-linear update function
-        
-        # Second message passing layer
-        # x = self.conv2(x, edge_index, edge_attr)
-        # x = torch.relu(x) 
 
-        # Graph readout (pooling)
-        x = global_mean_pool(x, batch)
+        # Further message passing layers
+        for conv in self.convs:
+            x = torch.relu(conv(x, edge_index, edge_attr))
 
-        # Feedforward regression head
-        out = self.ffnn(x)
-        return out
+        # Graph readout (pooling)
+        return global_mean_pool(x, batch)
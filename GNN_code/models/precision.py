@@ -0,0 +1,95 @@
+# models/precision.py
+
+# Reduced-precision CPU execution for MPNNModel, GCNModel, GATModel and
+# AttentiveFPModel:
+#   - bfloat16 autocast: pass autocast=True to models.engine.fit / evaluate or
+#     models.predict.iter_predictions / predict_to_file
+#   - dynamic int8 quantisation (quantize_model): the Linear layers of the ffnn
+#     regression heads and of the MPNN edge networks are swapped for int8
+#     versions (weights quantised once, activations per batch). Message passing
+#     layers from PyG (GCNConv, GATConv, AttentiveFP) use their own Linear class
+#     and stay in float32.
+# compare_precision measures R²/RMSE drift against the float32 model on a
+# held-out loader, together with the throughput of every mode, so a reduced
+# precision model is only deployed if it passes the accuracy check.
+#
+# Quantised models are built from a float32 model at load time, e.g.
+#   model, scaler, info = load_artifact(path)
+#   model = quantize_model(model)
+
+import copy
+import time
+import pandas as pd
+import torch
+from torch.ao.quantization import quantize_dynamic
+from models.engine import evaluate, model_forward
+
+# int8 layers expect float32 inputs, so int8 is not combined with bf16 autocast
+PRECISION_MODES = ('float32', 'bf16', 'int8')
+
+def quantizable_modules(model) -> set:
+    """Names of the ffnn heads and edge networks of model (the modules quantize_model converts)."""
+    names = set()
+    for name, module in model.named_modules():
+        if name.split('.')[-1] in ('ffnn', 'edge_nn1'):
+            names.add(name)
+        # NNConv / DedupNNConv edge networks and LowRankNNConv gate networks
+        for child in ('nn', 'gate_nn'):
+            if isinstance(getattr(module, child, None), torch.nn.Module):
+                names.add(f"{name}.{child}" if name else child)
+    return names
+
+def quantize_model(model):
+    """
+    Returns an int8 copy of model (in eval mode) with dynamically quantised
+    ffnn heads and edge networks; the float32 model is left untouched.
+    """
+    float_model = copy.deepcopy(model).cpu().eval()
+    return quantize_dynamic(float_model, qconfig_spec=quantizable_modules(float_model), dtype=torch.qint8)
+
+def _throughput(model, loader, autocast, repeats):
+    """Graphs per second of inference over loader (best of repeats passes)."""
+    best = 0.0
+    with torch.inference_mode(), torch.autocast("cpu", dtype=torch.bfloat16, enabled=autocast):
+        for _ in range(repeats):
+            n_graphs = 0
+            start = time.perf_counter()
+            for batch in loader:
+                model_forward(model, batch)
+                n_graphs += batch.num_graphs
+            best = max(best, n_graphs / (time.perf_counter() - start))
+    return best
+
+def compare_precision(model, loader, modes=PRECISION_MODES, repeats=3, max_rmse_drift=0.05,
+                      max_r2_drop=0.01) -> pd.DataFrame:
+    """
+    Accuracy-regression check of reduced precision modes against float32 on a
+    held-out loader (CPU). Returns one row per mode with RMSE, R², their drift
+    from float32, throughput (graphs/s) and speedup; passed is False when RMSE
+    grows by more than max_rmse_drift (relative) or R² drops by more than
+    max_r2_drop (absolute).
+    """
+    model = model.cpu().eval()
+    int8_model = quantize_model(model) if 'int8' in modes else None
+    rows = []
+    for mode in ('float32',) + tuple(m for m in modes if m != 'float32'):
+        if mode not in PRECISION_MODES:
+            raise ValueError(f"Unknown precision mode: {mode} (expected one of {', '.join(PRECISION_MODES)})")
+        run_model = int8_model if mode == 'int8' else model
+        autocast = mode == 'bf16'
+        metrics = evaluate(run_model, loader, device="cpu", autocast=autocast)
+        rows.append(dict(mode=mode, rmse=metrics['rmse'], r2=metrics['r2'],
+                         samples_per_sec=_throughput(run_model, loader, autocast, repeats)))
+
+    results = pd.DataFrame(rows).set_index('mode')
+    base = results.loc['float32']
+    results['rmse_drift'] = (results['rmse'] - base['rmse']) / base['rmse']
+    results['r2_drift'] = results['r2'] - base['r2']
+    results['speedup'] = results['samples_per_sec'] / base['samples_per_sec']
+    results['passed'] = (results['rmse_drift'] <= max_rmse_drift) & (results['r2_drift'] >= -max_r2_drop)
+
+    for mode, row in results.iterrows():
+        status = "ok" if row['passed'] else "FAILED"
+        print(f"{mode:>7}: RMSE {row['rmse']:.4f} ({row['rmse_drift']:+.2%}), R² {row['r2']:.4f} "
+              f"({row['r2_drift']:+.4f}), {row['samples_per_sec']:.0f} graphs/s (x{row['speedup']:.2f}) {status}")
+    return results.reset_index()
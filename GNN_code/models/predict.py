@@ -0,0 +1,150 @@
+# models/predict.py
+
+# Batched inference for trained MPNN / GCN / GAT / AttentiveFP models.
+# SMILES are consumed lazily in chunks: each chunk is featurised (optionally in
+# a process pool), scored under torch.inference_mode in batches capped by graph
+# and edge count, mapped back through the target scaler and written out, so
+# memory use stays flat no matter how many candidates are screened.
+
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import torch
+from torch_geometric.data import Batch
+from torch_geometric.nn import NNConv
+from models.engine import model_forward
+from models.mpnn_model import DedupNNConv
+from preprocessing.smiles_to_graph import featurise_chunk
+
+# Default edges per forward pass for models with a dense edge network (stock
+# NNConv, e.g. MPNNModel edge_mode='dense'), which materialises an in x out
+# weight matrix for every edge: tens of kB per edge, so a whole chunk of a
+# thousand molecules would need gigabytes
+DENSE_EDGE_BUDGET = 4096
+
+def read_smiles(csv_path: str, smiles_col="SMILES", chunksize=100_000):
+    """Lazily yields the SMILES column of a (possibly huge) CSV."""
+    for df in pd.read_csv(csv_path, usecols=[smiles_col], chunksize=chunksize):
+        yield from df[smiles_col].tolist()
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+def _featurised_chunks(smiles, chunk_size, n_jobs, cache_dir):
+    """Yields (smiles chunk, [(graph or None, error)]) pairs, in input order."""
+    rows = ([(s, None) for s in chunk] for chunk in _chunks(smiles, chunk_size))
+    if n_jobs <= 1:
+        for chunk in rows:
+            yield [s for s, _ in chunk], featurise_chunk(chunk, cache_dir)[0]
+        return
+
+    # Keep only a bounded number of chunks in flight so huge inputs are never read ahead in full
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        pending = []
+        for chunk in rows:
+            pending.append(([s for s, _ in chunk], executor.submit(featurise_chunk, chunk, cache_dir)))
+            if len(pending) >= 2 * n_jobs:
+                chunk_smiles, future = pending.pop(0)
+                yield chunk_smiles, future.result()[0]
+        for chunk_smiles, future in pending:
+            yield chunk_smiles, future.result()[0]
+
+def default_max_edges(model):
+    """Edge budget per forward pass for model: DENSE_EDGE_BUDGET if it has a dense edge network, else None."""
+    dense = any(isinstance(m, NNConv) and not isinstance(m, DedupNNConv) for m in model.modules())
+    return DENSE_EDGE_BUDGET if dense else None
+
+def _batch_ranges(edge_counts, batch_size=None, max_edges=None):
+    """
+    (start, stop) ranges of consecutive graphs with at most batch_size graphs and
+    max_edges edges each (a graph over the edge budget on its own gets a batch to itself).
+    """
+    ranges, start, edges = [], 0, 0
+    for i, n_edges in enumerate(edge_counts):
+        full = batch_size is not None and i - start >= batch_size
+        over = max_edges is not None and edges + n_edges > max_edges
+        if i > start and (full or over):
+            ranges.append((start, i))
+            start, edges = i, 0
+        edges += n_edges
+    if start < len(edge_counts):
+        ranges.append((start, len(edge_counts)))
+    return ranges
+
+def iter_predictions(model, smiles, scaler=None, chunk_size=1024, n_jobs=1, cache_dir=None, device=None,
+                     autocast=False, batch_size=None, max_edges='auto'):
+    """
+    Scores an iterable of SMILES and yields one DataFrame (SMILES, Predicted) per
+    chunk of chunk_size molecules (the unit of featurisation and output). Within
+    a chunk, forward passes take at most batch_size graphs (default: the whole
+    chunk) and max_edges edges ('auto': default_max_edges(model), None: no
+    limit). Molecules that fail to parse get a NaN prediction so the output
+    lines up with the input.
+    scaler (e.g. the MinMaxScaler from train_normalised) maps predictions back
+    to the original target scale.
+    autocast=True scores in bfloat16 autocast; model may also be an int8 model
+    from models.precision.quantize_model.
+    """
+    if n_jobs == -1:
+        n_jobs = os.cpu_count() or 1
+    device = torch.device(device or next(model.parameters()).device)
+    if max_edges == 'auto':
+        max_edges = default_max_edges(model)
+    model.eval()
+
+    for chunk_smiles, results in _featurised_chunks(smiles, chunk_size, n_jobs, cache_dir):
+        graphs = [graph for graph, _ in results if graph is not None]
+        preds = np.full(len(chunk_smiles), np.nan, dtype=np.float32)
+        if graphs:
+            outs = []
+            for start, stop in _batch_ranges([g.edge_index.size(1) for g in graphs], batch_size, max_edges):
+                batch = Batch.from_data_list(graphs[start:stop]).to(device)
+                with torch.inference_mode(), torch.autocast(device.type, dtype=torch.bfloat16, enabled=autocast):
+                    outs.append(model_forward(model, batch).view(-1).float().cpu().numpy())
+            out = np.concatenate(outs)
+            if scaler is not None:
+                out = scaler.inverse_transform(out.reshape(-1, 1)).ravel()
+            valid = np.array([graph is not None for graph, _ in results])
+            preds[valid] = out
+        yield pd.DataFrame({'SMILES': chunk_smiles, 'Predicted': preds})
+
+def predict_to_file(model, smiles, output_path: str, scaler=None, chunk_size=1024, n_jobs=1,
+                    cache_dir=None, device=None, autocast=False, batch_size=None, max_edges='auto') -> int:
+    """
+    Scores an iterable of SMILES and streams the results to output_path, as CSV or,
+    if the path ends in .parquet, as Parquet (needs pyarrow). Returns the number
+    of molecules scored. Batching arguments as for iter_predictions.
+    """
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    parquet = output_path.endswith(".parquet")
+    if parquet:
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError("Writing Parquet output requires pyarrow (pip install pyarrow)") from e
+
+    writer = None
+    n_scored = n_failed = 0
+    try:
+        for i, df in enumerate(iter_predictions(model, smiles, scaler, chunk_size, n_jobs, cache_dir, device, autocast,
+                                                batch_size, max_edges)):
+            if parquet:
+                table = pa.Table.from_pandas(df, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(output_path, table.schema)
+                writer.write_table(table)
+            else:
+                df.to_csv(output_path, mode="w" if i == 0 else "a", header=(i == 0), index=False)
+            n_scored += len(df)
+            n_failed += int(df['Predicted'].isna().sum())
+    finally:
+        if writer is not None:
+            writer.close()
+
+    print(f" Scored {n_scored} molecules ({n_failed} could not be featurised) -> {output_path}")
+    return n_scored
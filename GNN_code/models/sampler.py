@@ -0,0 +1,93 @@
+# models/sampler.py
+
+# Size-aware batching for molecular graphs. A fixed number of graphs per batch
+# makes the per-step cost (and peak memory) swing with molecule size; this
+# sampler instead packs each batch up to a budget of total nodes and/or edges.
+# Use it through models.engine.make_loader(..., max_nodes=..., max_edges=...).
+
+import numpy as np
+from torch.utils.data import Sampler
+from preprocessing.packed_store import PackedGraphDataset
+
+def graph_sizes(graphs):
+    """(node counts, edge counts) for a graph list or PackedGraphDataset."""
+    if isinstance(graphs, PackedGraphDataset):
+        return np.diff(graphs.node_ptr), np.diff(graphs.edge_ptr)
+    node_counts = np.array([g.num_nodes for g in graphs], dtype=np.int64)
+    edge_counts = np.array([g.edge_index.size(1) for g in graphs], dtype=np.int64)
+    return node_counts, edge_counts
+
+class SizeBucketedBatchSampler(Sampler):
+    """
+    Yields lists of graph indices whose summed node (edge) counts stay within
+    max_nodes (max_edges). A graph larger than the budget on its own gets a
+    batch to itself.
+
+    With bucket_size set, the shuffled indices are cut into buckets of that many
+    graphs and each bucket is sorted by size before packing, so graphs of similar
+    size end up together (less padding in time, tighter batches). Batch order is
+    shuffled again afterwards, so the randomness of shuffle=True is kept.
+    """
+    def __init__(self, node_counts, edge_counts=None, max_nodes=None, max_edges=None,
+                 shuffle=True, bucket_size=None, seed=None):
+        if max_nodes is None and max_edges is None:
+            raise ValueError("Set max_nodes and/or max_edges")
+        if max_edges is not None and edge_counts is None:
+            raise ValueError("max_edges needs edge_counts")
+        self.node_counts = np.asarray(node_counts)
+        self.edge_counts = np.asarray(edge_counts) if edge_counts is not None else None
+        self.max_nodes = max_nodes
+        self.max_edges = max_edges
+        self.shuffle = shuffle
+        self.bucket_size = bucket_size
+        self.rng = np.random.default_rng(seed)
+        self._batches = self._make_batches()
+
+    @classmethod
+    def from_graphs(cls, graphs, **kwargs):
+        node_counts, edge_counts = graph_sizes(graphs)
+        return cls(node_counts, edge_counts, **kwargs)
+
+    def _make_batches(self):
+        n = len(self.node_counts)
+        order = self.rng.permutation(n) if self.shuffle else np.arange(n)
+        if self.bucket_size:
+            buckets = [order[i:i + self.bucket_size] for i in range(0, n, self.bucket_size)]
+            order = np.concatenate([b[np.argsort(self.node_counts[b], kind="stable")] for b in buckets])
+
+        batches, current = [], []
+        nodes = edges = 0
+        for idx in order.tolist():
+            n_nodes = self.node_counts[idx]
+            n_edges = self.edge_counts[idx] if self.edge_counts is not None else 0
+            over_nodes = self.max_nodes is not None and nodes + n_nodes > self.max_nodes
+            over_edges = self.max_edges is not None and edges + n_edges > self.max_edges
+            if current and (over_nodes or over_edges):
+                batches.append(current)
+                current, nodes, edges = [], 0, 0
+            current.append(idx)
+            nodes += n_nodes
+            edges += n_edges
+        if current:
+            batches.append(current)
+
+        if self.shuffle and self.bucket_size:
+            batches = [batches[i] for i in self.rng.permutation(len(batches))]
+        return batches
+
+    def state_dict(self) -> dict:
+        """Generator state and the batches drawn for the next epoch, for training checkpoints."""
+        return {'rng': self.rng.bit_generator.state, 'batches': [list(map(int, b)) for b in self._batches]}
+
+    def load_state_dict(self, state) -> None:
+        self.rng.bit_generator.state = state['rng']
+        self._batches = state['batches']
+
+    def __len__(self) -> int:
+        return len(self._batches)
+
+    def __iter__(self):
+        batches = self._batches
+        # Draw the next epoch's batches up front so __len__ always has a value
+        self._batches = self._make_batches() if self.shuffle else batches
+        return iter(batches)
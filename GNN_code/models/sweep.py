@@ -0,0 +1,169 @@
+# models/sweep.py
+
+# k-fold cross-validation and hyperparameter sweeps over a graph list.
+#
+# Every trial (one hyperparameter combination) is cross-validated on random or
+# Murcko-scaffold folds, with patience-based early stopping on the validation
+# fold. Trials run in parallel in a process pool; each worker is limited to a
+# few intra-op threads so the pool does not oversubscribe the CPU. The graphs
+# are written once to a packed store (preprocessing/packed_store.py) which every
+# worker memory-maps, so the OS shares one copy of the features between all
+# processes instead of pickling the graph list into each trial.
+#
+# Trials whose running mean validation RMSE falls too far behind the best
+# finished trial are pruned after each fold.
+
+import itertools
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import torch
+from models.artifacts import build_model
+from models.engine import evaluate, fit
+from preprocessing.packed_store import PackedGraphDataset, PackedGraphLoader, pack_graphs
+
+# Parameters consumed by the training loop; everything else goes to the model constructor
+TRAINING_PARAMS = ('lr', 'batch_size', 'epochs')
+
+def random_kfold(n: int, k=5, seed=0):
+    """k (train_idx, val_idx) pairs from a random partition of range(n) (only n if n < k)."""
+    order = np.random.default_rng(seed).permutation(n)
+    folds = np.array_split(order, k)
+    return [(np.concatenate(folds[:i] + folds[i + 1:]), folds[i]) for i in range(k) if len(folds[i])]
+
+def scaffold_kfold(smiles, k=5, seed=0):
+    """
+    k (train_idx, val_idx) pairs where molecules sharing a Bemis-Murcko scaffold
+    always land in the same fold. Scaffold groups are dealt largest-first to
+    the currently smallest fold (ties broken randomly by seed).
+    """
+    from rdkit.Chem.Scaffolds.MurckoScaffold import MurckoScaffoldSmiles
+
+    groups = {}
+    for i, smi in enumerate(smiles):
+        groups.setdefault(MurckoScaffoldSmiles(smiles=smi), []).append(i)
+    rng = np.random.default_rng(seed)
+    group_list = list(groups.values())
+    rng.shuffle(group_list)
+    group_list.sort(key=len, reverse=True)
+
+    folds = [[] for _ in range(k)]
+    for group in group_list:
+        min(folds, key=len).extend(group)
+    folds = [np.array(sorted(f), dtype=np.int64) for f in folds]
+    return [(np.concatenate(folds[:i] + folds[i + 1:]), folds[i]) for i in range(k) if len(folds[i])]
+
+def expand_grid(param_grid: dict) -> list:
+    """{'lr': [1e-3, 1e-4], 'hidden_dim': [64]} -> list of parameter dicts."""
+    keys = list(param_grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*(param_grid[k] for k in keys))]
+
+# Per-worker state, set up once by _init_worker
+_WORKER = {}
+
+def _init_worker(store_path, threads_per_worker, best_score):
+    torch.set_num_threads(threads_per_worker)
+    _WORKER['dataset'] = PackedGraphDataset(store_path)
+    _WORKER['best_score'] = best_score
+
+def _run_trial(trial_id, architecture, params, folds, patience, eval_every, prune_factor):
+    """Cross-validates one parameter set inside a worker; returns a results row."""
+    dataset = _WORKER['dataset']
+    best_score = _WORKER['best_score']
+    model_params = {k: v for k, v in params.items() if k not in TRAINING_PARAMS}
+    lr = params.get('lr', 1e-3)
+    batch_size = params.get('batch_size', 16)
+    epochs = params.get('epochs', 300)
+
+    start = time.perf_counter()
+    fold_rmse, fold_r2, fold_epochs = [], [], []
+    pruned = False
+    for train_idx, val_idx in folds:
+        model = build_model(architecture, dataset.num_node_features, dataset.num_edge_features, **model_params)
+        train_loader = PackedGraphLoader(dataset, batch_size=batch_size, shuffle=True, indices=train_idx)
+        val_loader = PackedGraphLoader(dataset, batch_size=256, indices=val_idx)
+        history = fit(model, train_loader, lr=lr, epochs=epochs, log_every=0, val_loader=val_loader,
+                      patience=patience, eval_every=eval_every)
+
+        # fit restored the best weights seen on the validation fold
+        metrics = evaluate(model, val_loader)
+        fold_rmse.append(metrics['rmse'])
+        fold_r2.append(metrics['r2'])
+        fold_epochs.append(len(history))
+
+        # Prune: clearly worse than the best finished trial so far
+        if np.mean(fold_rmse) > prune_factor * best_score.value and len(fold_rmse) < len(folds):
+            pruned = True
+            break
+
+    mean_rmse = float(np.mean(fold_rmse))
+    if not pruned:
+        with best_score.get_lock():
+            best_score.value = min(best_score.value, mean_rmse)
+
+    return dict(trial=trial_id, **params,
+                val_rmse=mean_rmse, val_rmse_std=float(np.std(fold_rmse)), val_r2=float(np.mean(fold_r2)),
+                folds_run=len(fold_rmse), mean_epochs=float(np.mean(fold_epochs)), pruned=pruned,
+                seconds=time.perf_counter() - start)
+
+def run_sweep(graphs, param_grid, architecture='MPNNModel', k=5, split='random', seed=0,
+              n_workers=None, threads_per_worker=1, patience=5, eval_every=5, prune_factor=1.5,
+              results_path="data/processed/sweep_results.csv") -> pd.DataFrame:
+    """
+    Cross-validates every combination in param_grid (dict of lists; lr, batch_size
+    and epochs go to training, the rest to the model constructor) and writes a
+    results table sorted by mean validation RMSE to results_path.
+
+    graphs: list of Data graphs (packed to a temporary store) or a PackedGraphDataset.
+    split: 'random' or 'scaffold' (needs graph SMILES, see molecule_to_graph).
+    """
+    tmp_dir = None
+    if isinstance(graphs, PackedGraphDataset):
+        store_path, smiles, n = graphs.path, graphs.smiles, len(graphs)
+    else:
+        tmp_dir = tempfile.TemporaryDirectory(prefix="sweep_store_")
+        store_path = tmp_dir.name
+        pack_graphs(graphs, store_path)
+        smiles, n = [getattr(g, 'smiles', None) for g in graphs], len(graphs)
+
+    if split == 'scaffold':
+        if smiles is None or any(s is None for s in smiles):
+            raise ValueError("Scaffold splits need SMILES on every graph")
+        folds = scaffold_kfold(smiles, k, seed)
+    elif split == 'random':
+        folds = random_kfold(n, k, seed)
+    else:
+        raise ValueError(f"Unknown split: {split}")
+
+    trials = expand_grid(param_grid)
+    n_workers = n_workers or max(1, (os.cpu_count() or 1) // threads_per_worker)
+    print(f"Sweep: {len(trials)} trials x {len(folds)} folds ({split} split) on {n_workers} workers")
+
+    # Spawned workers start clean (no inherited thread pools); they share the best score for pruning
+    ctx = multiprocessing.get_context("spawn")
+    best_score = ctx.Value('d', float('inf'))
+    rows = []
+    try:
+        with ProcessPoolExecutor(max_workers=n_workers, mp_context=ctx, initializer=_init_worker,
+                                 initargs=(store_path, threads_per_worker, best_score)) as executor:
+            futures = [executor.submit(_run_trial, i, architecture, params, folds, patience, eval_every, prune_factor)
+                       for i, params in enumerate(trials)]
+            for future in futures:
+                row = future.result()
+                rows.append(row)
+                status = "pruned" if row['pruned'] else f"R² {row['val_r2']:.3f}"
+                print(f"Trial {row['trial']}: val RMSE {row['val_rmse']:.3f} ({status})")
+    finally:
+        if tmp_dir is not None:
+            tmp_dir.cleanup()
+
+    results = pd.DataFrame(rows).sort_values(['pruned', 'val_rmse']).reset_index(drop=True)
+    if results_path:
+        os.makedirs(os.path.dirname(results_path) or ".", exist_ok=True)
+        results.to_csv(results_path, index=False)
+        print(f" Sweep results saved to: {results_path}")
+    return results
@@ -8,72 +8,52 @@ Created on Fri May 16 16:19:15 2025
 
 # models/train.py
 
-import torch
-import numpy as np
-import matplotlib.pyplot as plt
-from sklearn.metrics import r2_score, mean_squared_error
-from torch_geometric.loader import DataLoader
-from torch.nn import MSELoss
 from models.mpnn_model import MPNNModel
-
-def train_model(graphs, batch_size=16, lr=1e-3, epochs=300, hidden_dim=64):
+import telemetry
+from torch.utils.data import IterableDataset
+from models.engine import feature_dims, fit, make_loader, train_val_split
+from models.artifacts import save_artifact
+from models.evaluation import evaluate_predictions
+
+def train_model(graphs, batch_size=16, lr=1e-3, epochs=300, hidden_dim=64, num_workers=0,
+                max_nodes=None, max_edges=None, artifact_path=None, val_fraction=0.1, patience=30,
+                scheduler='plateau', seed=0, predictions_path=None, plot_path=None, **engine_kwargs):
     """
     Function to train the MPNN model without normalizing targets.
+    graphs can be a list of Data objects, a PackedGraphDataset, or an
+    IterableDataset that streams them. Extra keyword arguments (accumulation_steps,
+    compile, log_every, ...) are passed on to models.engine.fit. max_nodes /
+    max_edges switch to size-budgeted batches (see models/sampler.py).
+    artifact_path saves the trained model for later reuse (see models/artifacts.py).
+    val_fraction of the graphs is held out for early stopping (patience
+    validation checks without improvement) and the scheduler; the best weights
+    are kept. Streaming datasets, or val_fraction=0, train on everything.
+    predictions_path / plot_path save the held-out predictions ranked by
+    absolute error and their figure (see models/evaluation.py).
     """
-    in_channels = graphs[0].x.size(1)
-    edge_dim = graphs[0].edge_attr.size(1)
+    in_channels, edge_dim = feature_dims(graphs)
     model = MPNNModel(in_channels, edge_dim, hidden_dim)
-    optimizer = torch.optim.Adam(model.parameters(), lr=lr)
-    loss_fn = MSELoss()
-
-    loader = DataLoader(graphs, batch_size=batch_size, shuffle=True)
-    model.train()
-
-    for epoch in range(epochs):
-        total_loss = 0
-        for batch in loader:
-            optimizer.zero_grad()
-            out = model(batch.x, batch.edge_index, batch.edge_attr, batch.batch)
-            loss = loss_fn(out.squeeze(), batch.y.squeeze())
-            loss.backward()
-            optimizer.step()
-            total_loss += loss.item()
-
-        print(f"Epoch {epoch+1}, Loss: {total_loss:.4f}")
-
-    plot_predictions(model, loader)
+    train_idx = val_loader = None
+    if val_fraction and not isinstance(graphs, IterableDataset):
+        train_idx, val_idx = train_val_split(len(graphs), val_fraction, seed)
+        val_loader = make_loader(graphs, batch_size=256, shuffle=False, indices=val_idx)
+    loader = make_loader(graphs, batch_size=batch_size, shuffle=True, num_workers=num_workers,
+                         max_nodes=max_nodes, max_edges=max_edges, bucket_size=8 * batch_size, indices=train_idx)
+
+    history = fit(model, loader, lr=lr, epochs=epochs, val_loader=val_loader,
+                  patience=patience if val_loader is not None else None,
+                  scheduler=scheduler, **engine_kwargs)
+    if artifact_path:
+        save_artifact(artifact_path, model, metadata={'trainer': 'train', 'epochs': len(history)})
+
+    plot_predictions(model, val_loader if val_loader is not None else loader, predictions_path, plot_path)
     return model
 
-def plot_predictions(model, loader):
+@telemetry.timed('plot_predictions')
+def plot_predictions(model, loader, output_path=None, plot_path=None):
     """
-    Function to plot predictions vs actual values without scaling.
+    Reports R² / RMSE of predictions vs actual values without scaling. output_path
+    saves per-molecule predictions ranked by absolute error, plot_path the
+    predicted-vs-actual figure (see models/evaluation.py).
     """
-    all_preds, all_targets = [], []
-
-    model.eval()
-    with torch.no_grad():
-        for batch in loader:
-            preds = model(batch.x, batch.edge_index, batch.edge_attr, batch.batch)
-            all_preds.append(preds.squeeze())
-            all_targets.append(batch.y.squeeze())
-
-    all_preds = torch.cat(all_preds).cpu().numpy()
-    all_targets = torch.cat(all_targets).cpu().numpy()
-
-    r2 = r2_score(all_targets, all_preds)
-    rmse = np.sqrt(mean_squared_error(all_targets, all_preds))
-
-    print(f"R² score: {r2:.3f}")
-    print(f"RMSE: {rmse:.3f}")
-
-    plt.figure(figsize=(6, 6))
-    plt.scatter(all_targets, all_preds, alpha=0.7)
-    plt.plot([all_targets.min(), all_targets.max()], 
-             [all_targets.min(), all_targets.max()], 'r--')
-    plt.xlabel("Actual")
-    plt.ylabel("Predicted")
-    plt.title("Predicted vs. Actual")
-    plt.grid(True)
-    plt.tight_layout()
-    plt.show()
-    
\ No newline at end of file
+    return evaluate_predictions(model, loader, output_path=output_path, plot_path=plot_path)
\ No newline at end of file
@@ -11,26 +11,49 @@ Created on Wed May 14 13:00:19 2025
 # Contains training/validation loops, loss functions, and metrics
 
 import torch
-import numpy as np
-import matplotlib.pyplot as plt
-from sklearn.metrics import r2_score, mean_squared_error
-from sklearn.preprocessing import MinMaxScaler
-from torch_geometric.loader import DataLoader
-from torch.nn import MSELoss
 from models.mpnn_model import MPNNModel
-
-def train_model(graphs, batch_size=16, lr=1e-3, epochs=300, hidden_dim=64):
+import telemetry
+from torch.utils.data import IterableDataset
+from models.engine import feature_dims, fit, make_loader, train_val_split
+from models.artifacts import save_artifact
+from models.evaluation import evaluate_predictions
+from preprocessing.packed_store import PackedGraphDataset
+
+def train_model(graphs, batch_size=16, lr=1e-3, epochs=300, hidden_dim=64, num_workers=0,
+                max_nodes=None, max_edges=None, artifact_path=None, val_fraction=0.1, patience=30,
+                scheduler='plateau', seed=0, predictions_path=None, plot_path=None, **engine_kwargs):
     """
     Function to train the MPNN model with MinMax normalised targets.
+    Extra keyword arguments are passed on to models.engine.fit. max_nodes /
+    max_edges switch to size-budgeted batches (see models/sampler.py).
+    artifact_path saves the trained model for later reuse (see models/artifacts.py).
+    val_fraction of the graphs is held out for early stopping (patience
+    validation checks without improvement) and the scheduler; the best weights
+    are kept. The scaler is fitted on the training split only.
+    predictions_path / plot_path save the held-out predictions ranked by
+    absolute error and their figure (see models/evaluation.py).
     """
-    
-    all_targets = torch.cat([g.y for g in graphs]).view(-1,1).numpy()
+    train_idx = val_idx = None
+    if val_fraction and not isinstance(graphs, IterableDataset):
+        train_idx, val_idx = train_val_split(len(graphs), val_fraction, seed)
+
+    # Imported here so that importing the module does not pull in sklearn
+    from sklearn.preprocessing import MinMaxScaler
+
     scaler = MinMaxScaler()
-    scaler.fit(all_targets)
-    
-    # Scale the y-values in place
-    for g in graphs:
-        g.y = torch.tensor(scaler.transform(g.y.view(-1,1)), dtype=torch.float)
+    if isinstance(graphs, PackedGraphDataset):
+        # Packed store: targets live in one (copy-on-write) array, scale it in place
+        fit_targets = graphs.y if train_idx is None else graphs.y[train_idx]
+        scaler.fit(fit_targets.reshape(-1,1))
+        graphs.y[:] = scaler.transform(graphs.y.reshape(-1,1)).ravel()
+    else:
+        fit_graphs = graphs if train_idx is None else [graphs[int(i)] for i in train_idx]
+        all_targets = torch.cat([g.y for g in fit_graphs]).view(-1,1).numpy()
+        scaler.fit(all_targets)
+
+        # Scale the y-values in place
+        for g in graphs:
+            g.y = torch.tensor(scaler.transform(g.y.view(-1,1)), dtype=torch.float)
         
     # Auto-detect number of input features from the first graph 
 
@@ -38,152 +61,30 @@ def train_model(graphs, batch_size=16, lr=1e-3, epochs=300, hidden_dim=64):
     # learning. GNNs require fixed-size feature vectors per node (and edge) to 
     # ensure tensor consistency during message passing, batching, backprop, etc. 
   
-    in_channels = graphs[0].x.size(1); edge_dim = graphs[0].edge_attr.size(1)
+    in_channels, edge_dim = feature_dims(graphs)
     model = MPNNModel(in_channels, edge_dim, hidden_dim)
-    optimizer = torch.optim.Adam(model.parameters(), lr=lr)
-    loss_fn = MSELoss()
+    loader = make_loader(graphs, batch_size=batch_size, shuffle=True, num_workers=num_workers,
+                         max_nodes=max_nodes, max_edges=max_edges, bucket_size=8 * batch_size, indices=train_idx)
+    val_loader = make_loader(graphs, batch_size=256, shuffle=False, indices=val_idx) if val_idx is not None else None
 
-    loader = DataLoader(graphs, batch_size=batch_size, shuffle=True)
-    
-    model.train()
-    
     # Training loop
-    for epoch in range(epochs):
-        total_loss = 0
-        for batch in loader:
-            optimizer.zero_grad()
-            out = model(batch.x, batch.edge_index, batch.edge_attr, batch.batch)
-            loss = loss_fn(out.squeeze(), batch.y.view(-1))
-            loss.backward()
-            optimizer.step()
-            total_loss += loss.item()
-        
-        print(f"Epoch {epoch+1}, Loss: {total_loss:.4f}")
-
-    # After training, plot predictions
-    plot_predictions(model, loader, scaler)
+    history = fit(model, loader, lr=lr, epochs=epochs, val_loader=val_loader,
+                  patience=patience if val_loader is not None else None,
+                  scheduler=scheduler, **engine_kwargs)
+    if artifact_path:
+        save_artifact(artifact_path, model, scaler=scaler,
+                      metadata={'trainer': 'train_normalised', 'epochs': len(history)})
+
+    # After training, plot predictions on the held-out graphs
+    plot_predictions(model, val_loader if val_loader is not None else loader, scaler, predictions_path, plot_path)
     
     return model
 
-def plot_predictions(model, loader, scaler):
+@telemetry.timed('plot_predictions')
+def plot_predictions(model, loader, scaler, output_path=None, plot_path=None):
     """
-    Function to plot predictions vs actual values.
+    Reports R² / RMSE of predictions vs actual values, in the original target
+    scale. output_path saves per-molecule predictions ranked by absolute error,
+    plot_path the predicted-vs-actual figure (see models/evaluation.py).
     """
-    all_preds, all_targets = [], []
-    
-    model.eval()
-    with torch.no_grad():
-        for batch in loader:
-            preds = model(batch.x, batch.edge_index, batch.edge_attr, batch.batch)
-            all_preds.append(preds.squeeze())
-            all_targets.append(batch.y.view(-1))
-
-    # Concatenate all predictions and targets
-    all_preds = torch.cat(all_preds).cpu().numpy().reshape(-1,1)
-    all_targets = torch.cat(all_targets).cpu().numpy().reshape(-1,1)
-    
-    # Inverse transform back to original scale
-    all_preds_orig = scaler.inverse_transform(all_preds).flatten()
-    all_targets_orig = scaler.inverse_transform(all_targets).flatten()
-
-    # Calculate R² and RMSE
-    r2 = r2_score(all_targets_orig, all_preds_orig)
-    rmse = np.sqrt(mean_squared_error(all_targets_orig, all_preds_orig))
-
-    print(f"R² score: {r2:.3f}")
-    print(f"RMSE: {rmse:.3f}")
-
-    # Plot actual vs predicted values
-    plt.figure(figsize=(6, 6))
-    plt.scatter(all_targets_orig, all_preds_orig, alpha=0.7)
-    plt.plot([all_targets_orig.min(), all_targets_orig.max()], 
-             [all_targets_orig.min(), all_targets_orig.max()], 'r--')
-    plt.xlabel("Actual")
-    plt.ylabel("Predicted")
-    plt.title("Predicted vs. Actual")
-    plt.grid(True)
-    plt.tight_layout()
-    plt.show()
-
-# models/train.py
-
-# import os
-# import numpy as np
-# import pandas as pd
-# import torch
-# import matplotlib.pyplot as plt
-# from torch.nn import MSELoss
-# from torch_geometric.loader import DataLoader
-# from sklearn.metrics import r2_score
-# from models.mpnn_architecture import MPNNModel
-
-# def plot_and_save_predictions(preds, targets, smiles, output_path="data/processed/mpnn_predictions.csv", top_n=5):
-#     df = pd.DataFrame({
-#         'Inhibitor': smiles,
-#         'Actual': targets,
-#         'Predicted': preds,
-#         'Absolute Error': np.abs(targets - preds)
-#     })
-
-#     os.makedirs(os.path.dirname(output_path), exist_ok=True)
-#     df.to_csv(output_path, index=False)
-#     print(f"Saved predictions to {output_path}")
-
-#     # Print worst predictions
-#     worst_preds = df.sort_values(by="Absolute Error", ascending=False).head(top_n)
-#     print("\nWorst Predictions:\n", worst_preds)
-
-#     # Plot actual vs predicted
-#     plt.figure(figsize=(6, 6))
-#     plt.scatter(targets, preds, alpha=0.6)
-#     plt.plot([targets.min(), targets.max()], [targets.min(), targets.max()], 'r--')
-#     plt.xlabel("Actual Inhibition Efficiency")
-#     plt.ylabel("Predicted Inhibition Efficiency")
-#     plt.title("Actual vs Predicted Inhibition Efficiency")
-#     plt.grid(True)
-#     plt.tight_layout()
-#     plt.show()
-
-# def train_model(graphs, batch_size=16, lr=1e-3, epochs=500, hidden_dim=64):
-#     in_channels = graphs[0].x.shape[1]
-#     model = MPNNModel(in_channels=in_channels, hidden_dim=hidden_dim)
-#     optimizer = torch.optim.Adam(model.parameters(), lr=lr)
-#     loss_fn = MSELoss()
-
-#     loader = DataLoader(graphs, batch_size=batch_size, shuffle=True)
-
-#     model.train()
-#     for epoch in range(epochs):
-#         total_loss = 0
-#         for batch in loader:
-#             optimizer.zero_grad()
-#             out = model(batch.x, batch.edge_index, batch.batch)
-#             loss = loss_fn(out.squeeze(), batch.y)
-#             loss.backward()
-#             optimizer.step()
-#             total_loss += loss.item()
-#         print(f"Epoch {epoch+1}, Loss: {total_loss:.4f}")
-
-#     # Evaluation on full dataset
-#     model.eval()
-#     all_preds, all_targets = [], []
-#     for batch in loader:
-#         pred = model(batch.x, batch.edge_index, batch.batch)
-#         all_preds.extend(pred.squeeze().detach().cpu().numpy())
-#         all_targets.extend(batch.y.cpu().numpy())
-
-#     all_preds = np.array(all_preds)
-#     all_targets = np.array(all_targets)
-
-#     r2 = r2_score(all_targets, all_preds)
-#     print(f"\nR² Score on Full Dataset: {r2:.4f}")
-
-#     # Load SMILES for reporting
-#     smiles_path = "data/processed/input.csv"
-#     if os.path.exists(smiles_path):
-#         smiles_list = pd.read_csv(smiles_path)["Inhibitor Name"].tolist()
-#         plot_and_save_predictions(all_preds, all_targets, smiles_list[:len(all_preds)])
-#     else:
-#         print("SMILES file not found. Skipping prediction CSV and plotting.")
-
-#     return model
+    return evaluate_predictions(model, loader, scaler, output_path=output_path, plot_path=plot_path)
@@ -11,6 +11,23 @@ Created on Wed May 14 09:06:19 2025
 import numpy as np
 from rdkit import Chem
 
+PERMITTED_ATOMS = [
+    'C', 'N', 'O', 'S', 'F', 'Si', 'P', 'Cl', 'Br', 'Mg', 'Na', 'Ca', 'Fe',
+    'As', 'Al', 'I', 'B', 'V', 'K', 'Tl', 'Yb', 'Sb', 'Sn', 'Ag', 'Pd', 'Co',
+    'Se', 'Ti', 'Zn', 'Li', 'Ge', 'Cu', 'Au', 'Ni', 'Cd', 'In', 'Mn', 'Zr',
+    'Cr', 'Pt', 'Hg', 'Pb', 'Unknown'
+]
+PERMITTED_DEGREES = [0, 1, 2, 3, 4, "MoreThanFour"]
+PERMITTED_CHARGES = [-3, -2, -1, 0, 1, 2, 3, "Extreme"]
+PERMITTED_HYBRIDISATIONS = ["S", "SP", "SP2", "SP3", "SP3D", "SP3D2", "OTHER"]
+PERMITTED_CHIRALITIES = ["CHI_UNSPECIFIED", "CHI_TETRAHEDRAL_CW", "CHI_TETRAHEDRAL_CCW", "CHI_OTHER"]
+PERMITTED_NUM_HS = [0, 1, 2, 3, 4, "MoreThanFour"]
+PERMITTED_BOND_TYPES = [Chem.rdchem.BondType.SINGLE, Chem.rdchem.BondType.DOUBLE,
+                        Chem.rdchem.BondType.TRIPLE, Chem.rdchem.BondType.AROMATIC]
+PERMITTED_STEREO = ["STEREOZ", "STEREOE", "STEREOANY", "STEREONONE"]
+
+PERIODIC_TABLE = Chem.GetPeriodicTable()
+
 # Define an auxiliary function which transforms a value x into a one-hot encoding based on a list of permitted values for x:
 def one_hot_encoding(x, permitted_list):
     if x not in permitted_list:
@@ -23,26 +40,20 @@ def get_atom_features(atom, use_chirality=True, hydrogens_implicit=True):
     Takes an RDKit atom object as input and returns a numpy vector of 
     atom (nodes in molecular graph) features as output. 
     """
-    permitted_atoms = [
-        'C', 'N', 'O', 'S', 'F', 'Si', 'P', 'Cl', 'Br', 'Mg', 'Na', 'Ca', 'Fe',
-        'As', 'Al', 'I', 'B', 'V', 'K', 'Tl', 'Yb', 'Sb', 'Sn', 'Ag', 'Pd', 'Co',
-        'Se', 'Ti', 'Zn', 'Li', 'Ge', 'Cu', 'Au', 'Ni', 'Cd', 'In', 'Mn', 'Zr',
-        'Cr', 'Pt', 'Hg', 'Pb', 'Unknown'
-    ]
+    permitted_atoms = PERMITTED_ATOMS
     if hydrogens_implicit == False:
         permitted_atoms = ['H'] + permitted_atoms
 
     atom_type = one_hot_encoding(str(atom.GetSymbol()), permitted_atoms) 
     degree = atom.GetDegree() # Degree of an atom is the number of directly-bonded neighbours
-    degree_enc = one_hot_encoding(min(degree, 4) if degree <= 4 else "MoreThanFour", [0, 1, 2, 3, 4, "MoreThanFour"])
+    degree_enc = one_hot_encoding(min(degree, 4) if degree <= 4 else "MoreThanFour", PERMITTED_DEGREES)
     charge = atom.GetFormalCharge() # Formal charge
-    charge_enc = one_hot_encoding(charge if abs(charge) <= 3 else "Extreme", [-3, -2, -1, 0, 1, 2, 3, "Extreme"])
-    hybrid = one_hot_encoding(str(atom.GetHybridization()), ["S", "SP", "SP2",
-                                              "SP3", "SP3D", "SP3D2", "OTHER"]) #Hybridisation type
+    charge_enc = one_hot_encoding(charge if abs(charge) <= 3 else "Extreme", PERMITTED_CHARGES)
+    hybrid = one_hot_encoding(str(atom.GetHybridization()), PERMITTED_HYBRIDISATIONS) #Hybridisation type
     ring = [int(atom.IsInRing())] # Whether the atom is in a ring
     aromatic = [int(atom.GetIsAromatic())] # Whether the atom is in an aromatic ring
 
-    pt = Chem.GetPeriodicTable() 
+    pt = PERIODIC_TABLE
     mass = [(atom.GetMass() - 10.812) / 116.092] # Scaled atomic mass
     vdw = [(pt.GetRvdw(atom.GetAtomicNum()) - 1.5) / 0.6] # Scaled VdW radius
     covalent = [(pt.GetRcovalent(atom.GetAtomicNum()) - 0.64) / 0.76] # Scaled covalent radius
@@ -50,12 +61,11 @@ def get_atom_features(atom, use_chirality=True, hydrogens_implicit=True):
     node_features = atom_type + degree_enc + charge_enc + hybrid + ring + aromatic + mass + vdw + covalent
 
     if use_chirality:
-        node_features += one_hot_encoding(str(atom.GetChiralTag()), ["CHI_UNSPECIFIED", 
-        "CHI_TETRAHEDRAL_CW", "CHI_TETRAHEDRAL_CCW", "CHI_OTHER"])
+        node_features += one_hot_encoding(str(atom.GetChiralTag()), PERMITTED_CHIRALITIES)
 
     if hydrogens_implicit:
         n_h = atom.GetTotalNumHs()
-        node_features += one_hot_encoding(min(n_h, 4) if n_h <= 4 else "MoreThanFour", [0, 1, 2, 3, 4, "MoreThanFour"])
+        node_features += one_hot_encoding(min(n_h, 4) if n_h <= 4 else "MoreThanFour", PERMITTED_NUM_HS)
 
     return np.array(node_features)
 
@@ -64,17 +74,141 @@ def get_bond_features(bond, use_stereochemistry=True):
     Takes an RDKit atom object as input and returns a numpy vector of 
     bond (edges in molecular graph) features as output. 
     """
-    permitted_bond_types = [Chem.rdchem.BondType.SINGLE, Chem.rdchem.BondType.DOUBLE,
-                            Chem.rdchem.BondType.TRIPLE, Chem.rdchem.BondType.AROMATIC]
-    bond_type = one_hot_encoding(bond.GetBondType(), permitted_bond_types)
+    bond_type = one_hot_encoding(bond.GetBondType(), PERMITTED_BOND_TYPES)
     conjugated = [int(bond.GetIsConjugated())]
     in_ring = [int(bond.IsInRing())]
 
     edge_features = bond_type + conjugated + in_ring
 
     if use_stereochemistry:
-        stereo = one_hot_encoding(str(bond.GetStereo()), ["STEREOZ", "STEREOE", "STEREOANY", "STEREONONE"])
+        stereo = one_hot_encoding(str(bond.GetStereo()), PERMITTED_STEREO)
         edge_features += stereo
 
     return np.array(edge_features)
 
+# ---------------------------------------------------------------------------
+# Table-driven featuriser
+#
+# Produces exactly the same vectors as get_atom_features / get_bond_features,
+# but for a whole molecule at once: category -> column lookups are precomputed
+# dicts keyed on the RDKit enums, radii are tabulated per atomic number, and the
+# one-hot entries of every atom are scattered into one preallocated float32
+# matrix with a single fancy-indexed assignment.
+# ---------------------------------------------------------------------------
+
+def _enum_index(enum_type, permitted):
+    """Maps RDKit enum values to their position in a permitted list (unknowns -> last)."""
+    return {value: permitted.index(name) for name, value in enum_type.names.items() if name in permitted}
+
+_ATOM_INDEX = {symbol: i for i, symbol in enumerate(PERMITTED_ATOMS)}
+_ATOM_INDEX_WITH_H = {symbol: i for i, symbol in enumerate(['H'] + PERMITTED_ATOMS)}
+_HYBRID_INDEX = _enum_index(Chem.rdchem.HybridizationType, PERMITTED_HYBRIDISATIONS)
+_CHIRAL_INDEX = _enum_index(Chem.rdchem.ChiralType, PERMITTED_CHIRALITIES)
+_BOND_TYPE_INDEX = {bond_type: i for i, bond_type in enumerate(PERMITTED_BOND_TYPES)}
+_STEREO_INDEX = _enum_index(Chem.rdchem.BondStereo, PERMITTED_STEREO)
+
+# Scaled radii per atomic number, same expressions as in get_atom_features
+_VDW_SCALED = np.array([(PERIODIC_TABLE.GetRvdw(z) - 1.5) / 0.6 for z in range(119)])
+_COVALENT_SCALED = np.array([(PERIODIC_TABLE.GetRcovalent(z) - 0.64) / 0.76 for z in range(119)])
+
+def n_atom_features(use_chirality=True, hydrogens_implicit=True) -> int:
+    """Length of the atom feature vector for the given options."""
+    n = len(PERMITTED_ATOMS) + (0 if hydrogens_implicit else 1)
+    n += len(PERMITTED_DEGREES) + len(PERMITTED_CHARGES) + len(PERMITTED_HYBRIDISATIONS) + 5
+    if use_chirality:
+        n += len(PERMITTED_CHIRALITIES)
+    if hydrogens_implicit:
+        n += len(PERMITTED_NUM_HS)
+    return n
+
+def n_bond_features(use_stereochemistry=True) -> int:
+    """Length of the bond feature vector for the given options."""
+    return len(PERMITTED_BOND_TYPES) + 2 + (len(PERMITTED_STEREO) if use_stereochemistry else 0)
+
+def get_atom_feature_matrix(mol, use_chirality=True, hydrogens_implicit=True) -> np.ndarray:
+    """
+    Returns the [num_atoms, n_atom_features] float32 matrix whose rows equal
+    get_atom_features(atom) for every atom of an RDKit molecule.
+    """
+    atom_index = _ATOM_INDEX if hydrogens_implicit else _ATOM_INDEX_WITH_H
+    unknown_atom = len(atom_index) - 1
+
+    # Column offsets of each block within the feature vector
+    degree_col = len(atom_index)
+    charge_col = degree_col + len(PERMITTED_DEGREES)
+    hybrid_col = charge_col + len(PERMITTED_CHARGES)
+    ring_col = hybrid_col + len(PERMITTED_HYBRIDISATIONS)
+    aromatic_col = ring_col + 1
+    mass_col = aromatic_col + 1
+    vdw_col, covalent_col = mass_col + 1, mass_col + 2
+    next_col = mass_col + 3
+    chiral_col = next_col
+    if use_chirality:
+        next_col += len(PERMITTED_CHIRALITIES)
+    hs_col = next_col
+    unknown_hybrid = len(PERMITTED_HYBRIDISATIONS) - 1
+    unknown_chiral = len(PERMITTED_CHIRALITIES) - 1
+
+    num_atoms = mol.GetNumAtoms()
+    rows, cols = [], []
+    masses = np.empty(num_atoms)
+    atomic_nums = np.empty(num_atoms, dtype=np.int64)
+
+    for i, atom in enumerate(mol.GetAtoms()):
+        degree = atom.GetDegree()
+        charge = atom.GetFormalCharge()
+        hot = [
+            atom_index.get(atom.GetSymbol(), unknown_atom),
+            degree_col + (degree if degree <= 4 else 5),
+            charge_col + (charge + 3 if abs(charge) <= 3 else 7),
+            hybrid_col + _HYBRID_INDEX.get(atom.GetHybridization(), unknown_hybrid),
+        ]
+        if atom.IsInRing():
+            hot.append(ring_col)
+        if atom.GetIsAromatic():
+            hot.append(aromatic_col)
+        if use_chirality:
+            hot.append(chiral_col + _CHIRAL_INDEX.get(atom.GetChiralTag(), unknown_chiral))
+        if hydrogens_implicit:
+            n_h = atom.GetTotalNumHs()
+            hot.append(hs_col + (n_h if n_h <= 4 else 5))
+        rows.extend([i] * len(hot))
+        cols.extend(hot)
+        masses[i] = atom.GetMass()
+        atomic_nums[i] = atom.GetAtomicNum()
+
+    x = np.zeros((num_atoms, n_atom_features(use_chirality, hydrogens_implicit)), dtype=np.float32)
+    x[rows, cols] = 1.0
+    x[:, mass_col] = (masses - 10.812) / 116.092
+    x[:, vdw_col] = _VDW_SCALED[atomic_nums]
+    x[:, covalent_col] = _COVALENT_SCALED[atomic_nums]
+    return x
+
+def get_bond_feature_matrix(bonds, use_stereochemistry=True) -> np.ndarray:
+    """
+    Returns the [len(bonds), n_bond_features] float32 matrix whose rows equal
+    get_bond_features(bond) for every bond in the given sequence.
+    """
+    conjugated_col = len(PERMITTED_BOND_TYPES)
+    ring_col = conjugated_col + 1
+    stereo_col = ring_col + 1
+    unknown_type = len(PERMITTED_BOND_TYPES) - 1
+    unknown_stereo = len(PERMITTED_STEREO) - 1
+
+    rows, cols = [], []
+    num_bonds = 0
+    for i, bond in enumerate(bonds):
+        hot = [_BOND_TYPE_INDEX.get(bond.GetBondType(), unknown_type)]
+        if bond.GetIsConjugated():
+            hot.append(conjugated_col)
+        if bond.IsInRing():
+            hot.append(ring_col)
+        if use_stereochemistry:
+            hot.append(stereo_col + _STEREO_INDEX.get(bond.GetStereo(), unknown_stereo))
+        rows.extend([i] * len(hot))
+        cols.extend(hot)
+        num_bonds += 1
+
+    edge_attr = np.zeros((num_bonds, n_bond_features(use_stereochemistry)), dtype=np.float32)
+    edge_attr[rows, cols] = 1.0
+    return edge_attr
@@ -13,6 +13,10 @@ import pubchempy as pcp
 from rdkit import Chem
 from tqdm import tqdm
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import telemetry
 
 def is_valid_smiles(smiles: str) -> bool: 
     """Returns True if RDKit can parse the SMILES string."""
@@ -21,57 +25,184 @@ def is_valid_smiles(smiles: str) -> bool:
     except:
         return False
 
-def resolve_smiles_by_cas_interactive(input_path: str, output_path: str, log_path: str = "data/logs/manual_smiles_log.csv") -> pd.DataFrame:
+def pubchem_lookup(cas: str):
+    """Default lookup backend: isomeric SMILES of the first PubChem hit for a CAS number, or None."""
+    compounds = pcp.get_compounds(cas, 'name')
+    if compounds and compounds[0].isomeric_smiles:
+        return compounds[0].isomeric_smiles
+    return None
+
+class RateLimiter:
+    """Thread-safe limiter spacing calls at least 1/rate seconds apart."""
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def wait(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+def load_smiles_cache(cache_path: str) -> dict:
+    """Reads the persistent CAS -> SMILES cache (empty dict if missing)."""
+    if not cache_path or not os.path.exists(cache_path):
+        return {}
+    cache_df = pd.read_csv(cache_path, dtype=str)
+    return dict(zip(cache_df['CAS Number'], cache_df['SMILES']))
+
+def save_smiles_cache(cache: dict, cache_path: str) -> None:
+    """Writes the CAS -> SMILES cache, via a temporary file so it is never left half-written."""
+    os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+    tmp_path = f"{cache_path}.tmp"
+    pd.DataFrame({'CAS Number': list(cache.keys()), 'SMILES': list(cache.values())}).to_csv(tmp_path, index=False)
+    os.replace(tmp_path, cache_path)
+
+def _lookup_with_retry(cas, lookup, limiter, retries, backoff):
+    """Runs one lookup with rate limiting; retries errors with exponential backoff."""
+    for attempt in range(retries + 1):
+        limiter.wait()
+        try:
+            return lookup(cas)
+        except Exception as e:
+            if attempt == retries:
+                print(f"PubChem error for CAS {cas}: {e}")
+                return None
+            time.sleep(backoff * 2 ** attempt)
+
+def resolve_cas_batch(cas_numbers, lookup=pubchem_lookup, max_workers=8, rate_limit=5.0,
+                      retries=3, backoff=1.0) -> dict:
+    """
+    Resolves many CAS numbers concurrently. Returns {cas: smiles or None}.
+    rate_limit caps requests per second across all threads (PubChem allows 5/s).
+    """
+    limiter = RateLimiter(rate_limit)
+    results = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(_lookup_with_retry, cas, lookup, limiter, retries, backoff): cas
+                   for cas in cas_numbers}
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Resolving SMILES"):
+            results[futures[future]] = future.result()
+    return results
+
+def _prompt_for_smiles(display_name: str):
+    """Asks for a SMILES until a valid one (or an empty skip) is entered."""
+    while True:
+        manual = input(f" No SMILES found for {display_name}. Enter SMILES manually (or press Enter to skip): ")
+        if not manual.strip():
+            return None
+        elif is_valid_smiles(manual):
+            return manual.strip()
+        else:
+            print("Invalid SMILES. Please try again.")
+
+def _previous_run(output_path: str, df: pd.DataFrame, cas_col: str):
+    """
+    Diffs the input rows against the output of a previous run (None if there is
+    none). Returns a dict with:
+      unchanged   - boolean Series over df: the row is identical in every input
+                    column to a row of the previous output that has a SMILES
+      smiles      - CAS -> SMILES for those unchanged rows
+      append_from - index of the first new row if the previous output is an
+                    unchanged prefix of df (new rows can be appended), else None
+    """
+    if not os.path.exists(output_path):
+        return None
+    previous = pd.read_csv(output_path, dtype=str)
+    columns = list(df.columns)
+    if list(previous.columns) != columns + ['SMILES']:
+        return None # Different layout: treat as a fresh run
+
+    # Compare rows as text, the way they round-trip through the CSV
+    signature = lambda frame: frame[columns].astype(str).apply(lambda col: col.str.strip()).agg('\x1f'.join, axis=1)
+    current_rows = signature(df)
+    previous_rows = signature(previous)
+    resolved = previous['SMILES'].notna()
+    unchanged = current_rows.isin(set(previous_rows[resolved]))
+
+    known = previous[resolved & previous_rows.isin(set(current_rows))]
+    smiles = dict(zip(known[cas_col].str.strip(), known['SMILES']))
+
+    n_prev = len(previous)
+    prefix = n_prev <= len(df) and current_rows.iloc[:n_prev].tolist() == previous_rows.tolist() and resolved.all()
+    return {'unchanged': unchanged, 'smiles': smiles, 'append_from': n_prev if prefix else None}
+
+@telemetry.timed('resolve_smiles')
+def resolve_smiles_by_cas_interactive(input_path: str, output_path: str, log_path: str = "data/logs/manual_smiles_log.csv",
+                                      cache_path: str = "data/cache/cas_smiles.csv", lookup=pubchem_lookup,
+                                      max_workers=8, rate_limit=5.0, interactive=True, incremental=False) -> pd.DataFrame:
     """
     Resolves SMILES from CAS numbers using PubChem API.
-    If not found, prompts for manual input with validation and logs it.
+    Lookups run concurrently (rate limited, with retries) and resolved CAS numbers
+    are kept in a persistent cache at cache_path. Compounds that cannot be resolved
+    are collected and, if interactive, prompted for in one manual pass at the end,
+    with validation; manual entries are logged and cached too.
+    lookup(cas) -> smiles or None can be swapped for a local stand-in of PubChem.
+    With incremental=True and an existing output_path from a previous run, rows
+    that are unchanged since then keep their SMILES, only new or edited rows are
+    resolved, and new rows are appended to output_path when the earlier rows are
+    untouched (otherwise it is rewritten).
     """
     df = pd.read_excel(input_path)
     df.columns = df.columns.str.strip()
     cas_col = 'CAS Number'
     name_col = 'Inhibitor Name' if 'Inhibitor Name' in df.columns else None
 
-    smiles_list = []
-    manual_entries = []
+    cas_keys = df[cas_col].astype(str).str.strip()
+    cache = load_smiles_cache(cache_path)
 
-    tqdm.pandas(desc="Resolving SMILES")
+    previous = _previous_run(output_path, df, cas_col) if incremental else None
+    if previous is not None:
+        cache.update(previous['smiles'])
+        unchanged = previous['unchanged']
+        print(f" {int(unchanged.sum())} of {len(df)} rows unchanged since the previous run")
+        telemetry.count('rows.unchanged', int(unchanged.sum()))
+    pending = [cas for cas in dict.fromkeys(cas_keys) if cas not in cache]
+    print(f" {len(cas_keys) - cas_keys.isin(pending).sum()} of {len(df)} compounds found in SMILES cache")
+    telemetry.count('cas.cache_hits', len(cas_keys) - int(cas_keys.isin(pending).sum()))
 
-    for _, row in tqdm(df.iterrows(), total=len(df), desc="Processing compounds"):
-        cas = row[cas_col]
-        name = row[name_col] if name_col else None
+    with telemetry.stage('resolve_smiles.lookup'):
+        resolved = resolve_cas_batch(pending, lookup=lookup, max_workers=max_workers, rate_limit=rate_limit)
+    cache.update({cas: smiles for cas, smiles in resolved.items() if smiles})
 
-        # Try PubChem first
-        try:
-            compounds = pcp.get_compounds(str(cas), 'name')
-            if compounds and compounds[0].isomeric_smiles:
-                smiles_list.append(compounds[0].isomeric_smiles)
-                continue
-        except Exception as e:
-            print(f"PubChem error for CAS {cas}: {e}")
-
-        # Manual fallback
-        display_name = f"{name} (CAS:{cas})" if name else f"CAS: {cas}"
-        while True:
-            manual = input(f" No SMILES found for {display_name}. Enter SMILES manually (or press Enter to skip): ")
-            if not manual.strip():
-                smiles_list.append(None)
-                break
-            elif is_valid_smiles(manual):
-                smiles_list.append(manual.strip())
-                manual_entries.append({
-                    'Inhibitor Name': name,
-                    'CAS Number': cas,
-                    'SMILES': manual.strip()
-                })
-                break
-            else:
-                print("Invalid SMILES. Please try again.")
-
-    df['SMILES'] = smiles_list
+    # Manual fallback, deferred until every automatic lookup has finished
+    manual_entries = []
+    unresolved = [cas for cas in pending if not resolved.get(cas)]
+    telemetry.count('cas.looked_up', len(pending))
+    telemetry.count('cas.unresolved', len(unresolved))
+    if unresolved:
+        print(f" {len(unresolved)} compounds could not be resolved automatically")
+    if unresolved and interactive:
+        names = dict(zip(cas_keys, df[name_col])) if name_col else {}
+        with telemetry.stage('resolve_smiles.manual'):
+            for cas in unresolved:
+                name = names.get(cas)
+                display_name = f"{name} (CAS:{cas})" if name else f"CAS: {cas}"
+                manual = _prompt_for_smiles(display_name)
+                if manual:
+                    cache[cas] = manual
+                    manual_entries.append({
+                        'Inhibitor Name': name,
+                        'CAS Number': cas,
+                        'SMILES': manual
+                    })
+
+    if cache_path:
+        save_smiles_cache(cache, cache_path)
+
+    df['SMILES'] = [cache.get(cas) for cas in cas_keys]
 
     # Save results
-    df.to_csv(output_path, index=False)
-    print(f" Full dataset with SMILES saved to: {output_path}")
+    if previous is not None and previous['append_from'] is not None:
+        new_rows = df.iloc[previous['append_from']:]
+        new_rows.to_csv(output_path, mode="a", header=False, index=False)
+        print(f" {len(new_rows)} new rows appended to: {output_path}")
+    else:
+        df.to_csv(output_path, index=False)
+        print(f" Full dataset with SMILES saved to: {output_path}")
 
     if manual_entries:
         os.makedirs(os.path.dirname(log_path), exist_ok=True)
@@ -0,0 +1,74 @@
+# preprocessing/graph_cache.py
+
+# Persistent on-disk cache for featurised molecular graphs. Entries are keyed by
+# canonical SMILES and stored under a directory named after a hash of the
+# featurisation source and of molecule_to_graph, so any edit to
+# get_atom_features / get_bond_features or to how the graph tensors are
+# assembled (edge order, dtypes) starts a fresh cache automatically instead of
+# serving stale features.
+
+import hashlib
+import inspect
+import os
+import torch
+from rdkit import Chem
+from . import featurisation
+
+# Bump when the graph layout changes in a way the hashed source does not show
+# (e.g. a different torch_geometric Data convention)
+GRAPH_FORMAT = 1
+
+def featuriser_version() -> str:
+    """Short fingerprint of the featurisation and graph-building code (changes whenever either is edited)."""
+    # Imported here: smiles_to_graph imports this module
+    from .smiles_to_graph import molecule_to_graph
+    source = f"{GRAPH_FORMAT}\n{inspect.getsource(featurisation)}\n{inspect.getsource(molecule_to_graph)}"
+    return hashlib.sha1(source.encode("utf-8")).hexdigest()[:12]
+
+def canonical_smiles(smiles: str) -> str:
+    """Returns the RDKit canonical form of a SMILES string."""
+    mol = Chem.MolFromSmiles(smiles)
+    if mol is None:
+        raise ValueError(f"Invalid SMILES string: {smiles}")
+    return Chem.MolToSmiles(mol)
+
+class GraphCache:
+    """
+    Content-addressed store of graph tensors (x, edge_index, edge_attr).
+    Labels are not cached; they are re-attached from the CSV on every run.
+    """
+    def __init__(self, cache_dir="data/cache/graphs", version=None):
+        self.version = version or featuriser_version()
+        self.root = os.path.join(cache_dir, self.version)
+        os.makedirs(self.root, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key: str) -> str:
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.root, digest[:2], digest + ".pt")
+
+    def get(self, key: str):
+        """Returns the cached tensors for a canonical SMILES, or None."""
+        path = self._path(key)
+        if not os.path.exists(path):
+            self.misses += 1
+            return None
+        try:
+            entry = torch.load(path)
+        except Exception:
+            # Truncated or corrupt entry (e.g. interrupted run): treat as a miss
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def put(self, key: str, graph) -> None:
+        """Stores the feature tensors of a graph under its canonical SMILES."""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        entry = {'x': graph.x, 'edge_index': graph.edge_index, 'edge_attr': graph.edge_attr}
+        # Write to a temporary file first so concurrent runs never read half a file
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        torch.save(entry, tmp_path)
+        os.replace(tmp_path, path)
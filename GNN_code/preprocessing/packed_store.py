@@ -0,0 +1,282 @@
+# preprocessing/packed_store.py
+
+# Packed on-disk format for a list of molecular graphs. Instead of one small
+# Data object (and three tensors) per molecule, all graphs are concatenated into
+# a handful of contiguous arrays plus per-graph offsets:
+#
+#   x.npy           [total_nodes, node_dim]   float32
+#   edge_index.npy  [2, total_edges]          int64, node indices local to each graph
+#   edge_attr.npy   [total_edges, edge_dim]   float32
+#   node_ptr.npy    [num_graphs + 1]          int64, graph i owns x[node_ptr[i]:node_ptr[i+1]]
+#   edge_ptr.npy    [num_graphs + 1]          int64, same for edges
+#   y.npy           [num_graphs]              float32 (only if every graph has a label)
+#   smiles.txt      one SMILES per line       (only if every graph carries .smiles)
+#   keys.txt        one row key per line      (optional, e.g. CAS numbers for incremental updates)
+#
+# The arrays are opened memory-mapped, so single graphs are zero-copy slices and
+# whole batches are gathered straight from the arrays without per-graph collation.
+# append_graphs extends an existing store, streaming the old arrays into the new
+# ones instead of loading them into memory. meta.json records the featuriser
+# version (preprocessing/graph_cache.py) the graphs were built with, so stores
+# featurised by older code can be detected and rebuilt.
+
+import json
+import os
+import shutil
+import numpy as np
+import torch
+from torch_geometric.data import Batch, Data, Dataset
+
+def pack_graphs(graphs, path: str, keys=None) -> None:
+    """
+    Writes a list of Data graphs (e.g. from batch_from_csv) to a packed store directory.
+    keys (one string per graph) are stored alongside, e.g. to diff later runs against.
+    """
+    if len(graphs) == 0:
+        raise ValueError("Cannot pack an empty graph list")
+    os.makedirs(path, exist_ok=True)
+
+    node_counts = np.array([g.num_nodes for g in graphs], dtype=np.int64)
+    edge_counts = np.array([g.edge_index.size(1) for g in graphs], dtype=np.int64)
+    edge_dim = graphs[0].edge_attr.size(-1)
+
+    np.save(os.path.join(path, "node_ptr.npy"), np.concatenate([[0], np.cumsum(node_counts)]))
+    np.save(os.path.join(path, "edge_ptr.npy"), np.concatenate([[0], np.cumsum(edge_counts)]))
+    np.save(os.path.join(path, "x.npy"), torch.cat([g.x for g in graphs]).numpy().astype(np.float32))
+    np.save(os.path.join(path, "edge_index.npy"), torch.cat([g.edge_index for g in graphs], dim=1).numpy().astype(np.int64))
+    np.save(os.path.join(path, "edge_attr.npy"),
+            torch.cat([g.edge_attr.view(-1, edge_dim) for g in graphs]).numpy().astype(np.float32))
+
+    has_y = all(g.y is not None for g in graphs)
+    if has_y:
+        np.save(os.path.join(path, "y.npy"), torch.cat([g.y.view(-1) for g in graphs]).numpy().astype(np.float32))
+
+    has_smiles = all(getattr(g, 'smiles', None) is not None for g in graphs)
+    if has_smiles:
+        with open(os.path.join(path, "smiles.txt"), "w") as f:
+            f.writelines(f"{g.smiles}\n" for g in graphs)
+
+    if keys is not None:
+        _check_keys(keys, len(graphs))
+        with open(os.path.join(path, "keys.txt"), "w") as f:
+            f.writelines(f"{key}\n" for key in keys)
+
+    # Imported here: graph_cache needs RDKit, reading a store does not
+    from .graph_cache import featuriser_version
+    meta = {
+        'num_graphs': len(graphs),
+        'num_node_features': graphs[0].x.size(1),
+        'num_edge_features': edge_dim,
+        'has_y': has_y,
+        'has_smiles': has_smiles,
+        'has_keys': keys is not None,
+        'featuriser_version': featuriser_version(),
+    }
+    _write_meta(meta, path)
+
+def _check_keys(keys, n_graphs):
+    if len(keys) != n_graphs:
+        raise ValueError(f"Got {len(keys)} keys for {n_graphs} graphs")
+    if any('\n' in str(key) for key in keys):
+        raise ValueError("Store keys cannot contain newlines")
+
+def _write_meta(meta, path):
+    with open(os.path.join(path, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+
+def _concat_to(out_path: str, old: np.ndarray, new: np.ndarray, axis=0) -> None:
+    """Writes the concatenation of old (memory-mapped) and new to out_path without loading old."""
+    shape = list(old.shape)
+    shape[axis] += new.shape[axis]
+    out = np.lib.format.open_memmap(out_path, mode="w+", dtype=old.dtype, shape=tuple(shape))
+    split = old.shape[axis]
+    if axis == 0:
+        out[:split], out[split:] = old, new
+    else:
+        out[:, :split], out[:, split:] = old, new
+    out.flush()
+
+def append_graphs(graphs, path: str, keys=None) -> None:
+    """
+    Appends graphs to the store at path (creating it if needed). Existing graphs
+    keep their indices; the new graphs must have the same feature sizes and
+    featuriser version, and keys are required if the store has them. The extended store is written next to the
+    old one and swapped in at the end, so an interrupted append leaves the old
+    store intact (open PackedGraphDatasets keep reading the old files).
+    """
+    if not os.path.exists(os.path.join(path, "meta.json")):
+        pack_graphs(graphs, path, keys)
+        return
+    if len(graphs) == 0:
+        return
+    from .graph_cache import featuriser_version
+    old = PackedGraphDataset(path)
+    meta = dict(old.meta)
+    if meta.get('featuriser_version') != featuriser_version():
+        raise ValueError(f"The store at {path} was featurised with {meta.get('featuriser_version')}, not the current "
+                         f"featuriser {featuriser_version()}; rebuild it with rewrite_graphs")
+
+    edge_dim = meta['num_edge_features']
+    if graphs[0].x.size(1) != meta['num_node_features'] or graphs[0].edge_attr.view(-1, edge_dim).size(1) != edge_dim:
+        raise ValueError(f"Graphs do not match the feature sizes of the store at {path}")
+    if meta['has_y'] and not all(g.y is not None for g in graphs):
+        raise ValueError(f"The store at {path} has labels, but some of the new graphs do not")
+    if meta.get('has_keys'):
+        if keys is None:
+            raise ValueError(f"The store at {path} is keyed; pass keys for the new graphs")
+        _check_keys(keys, len(graphs))
+
+    tmp_path = f"{path.rstrip(os.sep)}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    node_counts = np.array([g.num_nodes for g in graphs], dtype=np.int64)
+    edge_counts = np.array([g.edge_index.size(1) for g in graphs], dtype=np.int64)
+    join = lambda name: os.path.join(tmp_path, name)
+    _concat_to(join("node_ptr.npy"), old.node_ptr, old.node_ptr[-1] + np.cumsum(node_counts))
+    _concat_to(join("edge_ptr.npy"), old.edge_ptr, old.edge_ptr[-1] + np.cumsum(edge_counts))
+    _concat_to(join("x.npy"), old.x, torch.cat([g.x for g in graphs]).numpy().astype(np.float32))
+    _concat_to(join("edge_index.npy"), old.edge_index,
+               torch.cat([g.edge_index for g in graphs], dim=1).numpy().astype(np.int64), axis=1)
+    _concat_to(join("edge_attr.npy"), old.edge_attr,
+               torch.cat([g.edge_attr.view(-1, edge_dim) for g in graphs]).numpy().astype(np.float32))
+    if meta['has_y']:
+        _concat_to(join("y.npy"), old.y, torch.cat([g.y.view(-1) for g in graphs]).numpy().astype(np.float32))
+
+    # SMILES are dropped if any new graph lacks them
+    meta['has_smiles'] = meta['has_smiles'] and all(getattr(g, 'smiles', None) is not None for g in graphs)
+    if meta['has_smiles']:
+        with open(join("smiles.txt"), "w") as f:
+            f.writelines(f"{smiles}\n" for smiles in old.smiles + [g.smiles for g in graphs])
+    if meta.get('has_keys'):
+        with open(join("keys.txt"), "w") as f:
+            f.writelines(f"{key}\n" for key in old.keys + list(keys))
+    meta['num_graphs'] += len(graphs)
+    _write_meta(meta, tmp_path)
+    del old
+
+    _replace_store(tmp_path, path)
+
+def rewrite_graphs(graphs, path: str, keys=None) -> None:
+    """pack_graphs into a fresh directory that replaces the store at path (if any) once complete."""
+    if not os.path.exists(path):
+        pack_graphs(graphs, path, keys)
+        return
+    tmp_path = f"{path.rstrip(os.sep)}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    pack_graphs(graphs, tmp_path, keys)
+    _replace_store(tmp_path, path)
+
+def _replace_store(new_path: str, path: str) -> None:
+    """Swaps the store directory at new_path in for the one at path."""
+    old_path = f"{path.rstrip(os.sep)}.old"
+    shutil.rmtree(old_path, ignore_errors=True)
+    os.rename(path, old_path)
+    os.rename(new_path, path)
+    shutil.rmtree(old_path)
+
+def _ranges(starts, counts):
+    """Concatenation of arange(s, s + c) for every (s, c) pair, without a Python loop."""
+    total = int(counts.sum())
+    offsets = np.repeat(starts - np.concatenate([[0], np.cumsum(counts)[:-1]]), counts)
+    return offsets + np.arange(total)
+
+class PackedGraphDataset(Dataset):
+    """
+    Memory-mapped view of a store written by pack_graphs. Indexing returns Data
+    objects whose tensors share memory with the mapped arrays. The arrays are
+    mapped copy-on-write, so in-place edits (e.g. target scaling) stay in memory
+    and never touch the files.
+    """
+    def __init__(self, path: str, transform=None):
+        super().__init__(None, transform)
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        load = lambda name: np.load(os.path.join(path, name), mmap_mode="c")
+        self.node_ptr = load("node_ptr.npy")
+        self.edge_ptr = load("edge_ptr.npy")
+        self.x = load("x.npy")
+        self.edge_index = load("edge_index.npy")
+        self.edge_attr = load("edge_attr.npy")
+        self.y = load("y.npy") if self.meta['has_y'] else None
+        self.smiles = None
+        if self.meta.get('has_smiles'):
+            with open(os.path.join(path, "smiles.txt")) as f:
+                self.smiles = f.read().splitlines()
+        self.keys = None
+        if self.meta.get('has_keys'):
+            with open(os.path.join(path, "keys.txt")) as f:
+                self.keys = f.read().splitlines()
+
+    @property
+    def num_node_features(self) -> int:
+        return self.meta['num_node_features']
+
+    @property
+    def num_edge_features(self) -> int:
+        return self.meta['num_edge_features']
+
+    def len(self) -> int:
+        return self.meta['num_graphs']
+
+    def get(self, idx: int) -> Data:
+        n0, n1 = self.node_ptr[idx], self.node_ptr[idx + 1]
+        e0, e1 = self.edge_ptr[idx], self.edge_ptr[idx + 1]
+        return Data(
+            x=torch.from_numpy(self.x[n0:n1]),
+            edge_index=torch.from_numpy(self.edge_index[:, e0:e1]),
+            edge_attr=torch.from_numpy(self.edge_attr[e0:e1]),
+            y=torch.from_numpy(self.y[idx:idx + 1]) if self.y is not None else None,
+            smiles=self.smiles[idx] if self.smiles is not None else None,
+        )
+
+    def collate(self, indices) -> Batch:
+        """Builds a Batch for the given graph indices directly from the packed arrays."""
+        idx = np.asarray(indices, dtype=np.int64)
+        node_counts = self.node_ptr[idx + 1] - self.node_ptr[idx]
+        edge_counts = self.edge_ptr[idx + 1] - self.edge_ptr[idx]
+        node_sel = _ranges(self.node_ptr[idx], node_counts)
+        edge_sel = _ranges(self.edge_ptr[idx], edge_counts)
+
+        # Shift each graph's local edge indices by where its nodes start in the batch
+        ptr = np.concatenate([[0], np.cumsum(node_counts)])
+        edge_index = self.edge_index[:, edge_sel] + np.repeat(ptr[:-1], edge_counts)
+
+        batch = Batch(
+            x=torch.from_numpy(self.x[node_sel]),
+            edge_index=torch.from_numpy(edge_index),
+            edge_attr=torch.from_numpy(self.edge_attr[edge_sel]),
+            y=torch.from_numpy(self.y[idx]) if self.y is not None else None,
+            batch=torch.from_numpy(np.repeat(np.arange(len(idx)), node_counts)),
+            ptr=torch.from_numpy(ptr),
+        )
+        if self.smiles is not None:
+            batch.smiles = [self.smiles[i] for i in idx]
+        batch._num_graphs = len(idx)
+        return batch
+
+class PackedGraphLoader:
+    """
+    Drop-in replacement for torch_geometric's DataLoader over a PackedGraphDataset:
+    yields Batch objects built with PackedGraphDataset.collate. indices restricts
+    it to a subset of the graphs (e.g. one cross-validation fold).
+    """
+    def __init__(self, dataset: PackedGraphDataset, batch_size=16, shuffle=False, drop_last=False, indices=None):
+        self.dataset = dataset
+        self.indices = np.arange(len(dataset)) if indices is None else np.asarray(indices, dtype=np.int64)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+
+    def __len__(self) -> int:
+        n = len(self.indices)
+        return n // self.batch_size if self.drop_last else -(-n // self.batch_size)
+
+    def __iter__(self):
+        n = len(self.indices)
+        order = self.indices[torch.randperm(n).numpy()] if self.shuffle else self.indices
+        for start in range(0, n, self.batch_size):
+            indices = order[start:start + self.batch_size]
+            if self.drop_last and len(indices) < self.batch_size:
+                break
+            yield self.dataset.collate(indices)
@@ -0,0 +1,267 @@
+# preprocessing/similarity.py
+
+# Nearest-neighbour search over the inhibitor library by Tanimoto similarity of
+# Morgan fingerprints. The index is a directory built from the canonical SMILES
+# of data/processed/input.csv:
+#
+#   fps.npy        [num_molecules, n_bits / 64]  uint64, packed fingerprints sorted by popcount
+#   popcounts.npy  [num_molecules]               int32, bits set in each row of fps.npy
+#   order.npy      [num_molecules]               int64, library row of each row of fps.npy
+#   smiles.txt     canonical SMILES per library row
+#   keys.txt       CAS number (or other key column) per library row
+#   labels.npy     [num_molecules] float32       Inh Power per library row (if the CSV has it)
+#   meta.json      fingerprint parameters and sizes
+#
+# The arrays are memory-mapped. Queries are answered in groups of similar
+# popcount: fingerprints are AND-ed and popcounted in vectorised blocks, and the
+# scan moves outwards from the group's popcount until the bound
+# Tanimoto(a, b) <= min(|a|, |b|) / max(|a|, |b|) shows that no remaining row can
+# enter any query's top k. Query groups are searched on a thread pool (numpy
+# releases the GIL in the bitwise kernels), and query SMILES are fingerprinted
+# in a process pool.
+#
+#   build_similarity_index("data/processed/input.csv", "data/processed/similarity_index")
+#   index = SimilarityIndex("data/processed/similarity_index")
+#   hits = index.search_smiles(candidate_smiles, k=5, n_jobs=-1)
+
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from rdkit import Chem, RDLogger, rdBase
+from rdkit.Chem import rdFingerprintGenerator
+import telemetry
+from .graph_cache import canonical_smiles
+
+def _n_jobs(n_jobs):
+    return (os.cpu_count() or 1) if n_jobs == -1 else max(1, n_jobs)
+
+def _fingerprint_chunk(smiles, radius, n_bits):
+    """Packed fingerprints [len(smiles), n_bits / 64] and a validity mask for one chunk."""
+    RDLogger.DisableLog('rdApp.*')
+    generator = rdFingerprintGenerator.GetMorganGenerator(radius=radius, fpSize=n_bits)
+    bits = np.zeros((len(smiles), n_bits), dtype=np.uint8)
+    valid = np.zeros(len(smiles), dtype=bool)
+    for i, s in enumerate(smiles):
+        mol = Chem.MolFromSmiles(s) if isinstance(s, str) else None
+        if mol is not None:
+            bits[i] = generator.GetFingerprintAsNumPy(mol)
+            valid[i] = True
+    packed = np.packbits(bits, axis=1, bitorder='little').view('<u8')
+    return packed, valid
+
+def fingerprint_smiles(smiles, radius=2, n_bits=2048, n_jobs=1, chunksize=4096):
+    """
+    Morgan fingerprints of a list of SMILES as packed uint64 rows [n, n_bits / 64],
+    plus a boolean mask of the SMILES that parsed (invalid ones get all-zero rows).
+    With n_jobs > 1 (-1 for all cores) chunks are fingerprinted in a process pool.
+    """
+    if n_bits % 64:
+        raise ValueError(f"n_bits must be a multiple of 64, got {n_bits}")
+    smiles = list(smiles)
+    if not smiles:
+        return np.zeros((0, n_bits // 64), dtype=np.uint64), np.zeros(0, dtype=bool)
+    n_jobs = _n_jobs(n_jobs)
+    chunks = [smiles[i:i + chunksize] for i in range(0, len(smiles), chunksize)]
+    with telemetry.stage('fingerprint_smiles'):
+        if n_jobs > 1 and len(chunks) > 1:
+            with ProcessPoolExecutor(max_workers=min(n_jobs, len(chunks))) as executor:
+                results = list(executor.map(_fingerprint_chunk, chunks, [radius] * len(chunks),
+                                            [n_bits] * len(chunks)))
+        else:
+            results = [_fingerprint_chunk(chunk, radius, n_bits) for chunk in chunks]
+    return np.concatenate([fps for fps, _ in results]), np.concatenate([valid for _, valid in results])
+
+def popcount(fps: np.ndarray) -> np.ndarray:
+    """Number of set bits in each packed fingerprint row."""
+    return np.bitwise_count(fps).sum(axis=-1, dtype=np.int32)
+
+def tanimoto(query_fps: np.ndarray, fps: np.ndarray, query_counts=None, counts=None) -> np.ndarray:
+    """Tanimoto similarity matrix [len(query_fps), len(fps)] of packed fingerprints (0 where both are empty)."""
+    query_counts = popcount(query_fps) if query_counts is None else query_counts
+    counts = popcount(fps) if counts is None else counts
+    # One word at a time keeps the [queries, rows] temporaries in cache
+    words = np.ascontiguousarray(np.asarray(fps).T)
+    common = np.zeros((len(query_fps), words.shape[1]), dtype=np.int32)
+    both = np.empty(common.shape, dtype=np.uint64)
+    bits = np.empty(common.shape, dtype=np.uint8)
+    for w in range(words.shape[0]):
+        np.bitwise_and(query_fps[:, w, None], words[w], out=both)
+        common += np.bitwise_count(both, out=bits)
+    union = query_counts[:, None] + counts[None, :] - common
+    return np.divide(common, union, out=np.zeros(common.shape, dtype=np.float32), where=union > 0)
+
+def build_similarity_index(csv_path="data/processed/input.csv", path="data/processed/similarity_index",
+                           smiles_col="SMILES", label_col="Inh Power", key_col="CAS Number", radius=2,
+                           n_bits=2048, n_jobs=1) -> None:
+    """
+    Fingerprints the canonical SMILES of every row in csv_path and writes the
+    index directory at path. Rows without a valid SMILES are skipped.
+    """
+    df = pd.read_csv(csv_path)
+    smiles, keys, labels = [], [], []
+    for i, row in df.iterrows():
+        try:
+            smiles.append(canonical_smiles(row[smiles_col]))
+        except (TypeError, ValueError) as e:
+            print(f"Skipping row {i}: {e}")
+            continue
+        keys.append(str(row[key_col]) if key_col in df.columns else smiles[-1])
+        labels.append(row[label_col] if label_col in df.columns else np.nan)
+    if not smiles:
+        raise ValueError(f"No valid SMILES in {csv_path}")
+
+    fps, _ = fingerprint_smiles(smiles, radius, n_bits, n_jobs)
+    counts = popcount(fps)
+    order = np.argsort(counts, kind='stable')
+
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, "fps.npy"), np.ascontiguousarray(fps[order]))
+    np.save(os.path.join(path, "popcounts.npy"), counts[order])
+    np.save(os.path.join(path, "order.npy"), order.astype(np.int64))
+    has_labels = label_col in df.columns
+    if has_labels:
+        np.save(os.path.join(path, "labels.npy"), np.asarray(labels, dtype=np.float32))
+    with open(os.path.join(path, "smiles.txt"), "w") as f:
+        f.writelines(f"{s}\n" for s in smiles)
+    with open(os.path.join(path, "keys.txt"), "w") as f:
+        f.writelines(f"{key}\n" for key in keys)
+
+    meta = {
+        'num_molecules': len(smiles),
+        'radius': radius,
+        'n_bits': n_bits,
+        'has_labels': has_labels,
+        'source': csv_path,
+        'rdkit': rdBase.rdkitVersion,
+    }
+    with open(os.path.join(path, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+    print(f"Similarity index of {len(smiles)} molecules saved to: {path}")
+
+class SimilarityIndex:
+    """Memory-mapped similarity index written by build_similarity_index."""
+    def __init__(self, path="data/processed/similarity_index"):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.radius = self.meta['radius']
+        self.n_bits = self.meta['n_bits']
+        self.fps = np.load(os.path.join(path, "fps.npy"), mmap_mode="r")
+        self.popcounts = np.load(os.path.join(path, "popcounts.npy"))
+        self.order = np.load(os.path.join(path, "order.npy"))
+        self.labels = np.load(os.path.join(path, "labels.npy")) if self.meta['has_labels'] else None
+        with open(os.path.join(path, "smiles.txt")) as f:
+            self.smiles = f.read().splitlines()
+        with open(os.path.join(path, "keys.txt")) as f:
+            self.keys = f.read().splitlines()
+
+    def __len__(self) -> int:
+        return self.meta['num_molecules']
+
+    def _search_group(self, query_fps, query_counts, k, min_similarity, block_size):
+        """Top-k (sorted positions, scores) for a group of queries with similar popcounts."""
+        n_queries = len(query_fps)
+        best_scores = np.full((n_queries, k), -1.0, dtype=np.float32)
+        best_pos = np.full((n_queries, k), -1, dtype=np.int64)
+        counts = self.popcounts
+        q = query_counts.astype(np.float64)
+
+        # Scan outwards from the group's median popcount: [left, right) is done
+        left = right = int(np.searchsorted(counts, np.median(query_counts)))
+        scored = 0
+        while left > 0 or right < len(counts):
+            threshold = np.maximum(best_scores[:, -1], min_similarity)
+            # Best possible similarity of any row still to scan on either side, per query.
+            # Rows left of the cursor have popcount <= counts[left - 1], right of it >= counts[right].
+            left_bound = (np.where(counts[left - 1] <= q, counts[left - 1] / np.maximum(q, 1), 1.0)
+                          if left > 0 else np.full(n_queries, -np.inf))
+            right_bound = (np.where(counts[right] >= q, q / max(counts[right], 1), 1.0)
+                           if right < len(counts) else np.full(n_queries, -np.inf))
+            left_open, right_open = left_bound >= threshold, right_bound >= threshold
+            if not (left_open.any() or right_open.any()):
+                break
+            if right_open.any() and (not left_open.any() or right_bound.max() >= left_bound.max()):
+                start, stop = right, min(right + block_size, len(counts))
+                right = stop
+            else:
+                start, stop = max(left - block_size, 0), left
+                left = start
+
+            scores = tanimoto(query_fps, self.fps[start:stop], query_counts, counts[start:stop])
+            scored += stop - start
+            scores[scores < min_similarity] = -1.0
+            merged_scores = np.concatenate([best_scores, scores], axis=1)
+            merged_pos = np.concatenate([best_pos, np.broadcast_to(np.arange(start, stop), scores.shape)], axis=1)
+            top = np.argpartition(-merged_scores, k - 1, axis=1)[:, :k]
+            best_scores = np.take_along_axis(merged_scores, top, axis=1)
+            best_pos = np.take_along_axis(merged_pos, top, axis=1)
+            # Keep each row sorted so best_scores[:, -1] is the k-th best
+            ranked = np.argsort(-best_scores, axis=1, kind='stable')
+            best_scores = np.take_along_axis(best_scores, ranked, axis=1)
+            best_pos = np.take_along_axis(best_pos, ranked, axis=1)
+        return best_pos, best_scores, scored
+
+    def search(self, query_fps: np.ndarray, k=5, min_similarity=0.0, n_jobs=1, group_size=32, block_size=1024):
+        """
+        Top-k library neighbours of packed query fingerprints (from fingerprint_smiles
+        with this index's radius and n_bits). Returns (indices, scores), both
+        [num_queries, k] and sorted by decreasing Tanimoto similarity; indices are
+        library rows (see smiles / keys / labels) and -1 where fewer than k rows
+        reach min_similarity. Query groups are searched on n_jobs threads.
+        """
+        if query_fps.ndim != 2 or query_fps.shape[1] != self.fps.shape[1]:
+            raise ValueError(f"Query fingerprints must have shape [n, {self.fps.shape[1]}] "
+                             f"(n_bits={self.n_bits}, radius={self.radius})")
+        if k < 1:
+            raise ValueError(f"k must be at least 1, got {k}")
+        k = min(k, len(self))
+        query_counts = popcount(query_fps)
+        # Group queries of similar popcount so they share one scan window
+        query_order = np.argsort(query_counts, kind='stable')
+        groups = [query_order[i:i + group_size] for i in range(0, len(query_order), group_size)]
+        run = lambda group: self._search_group(query_fps[group], query_counts[group], k, min_similarity, block_size)
+
+        n_jobs = _n_jobs(n_jobs)
+        with telemetry.stage('similarity_search'):
+            if n_jobs > 1 and len(groups) > 1:
+                with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+                    results = list(executor.map(run, groups))
+            else:
+                results = [run(group) for group in groups]
+
+        indices = np.full((len(query_fps), k), -1, dtype=np.int64)
+        scores = np.full((len(query_fps), k), np.nan, dtype=np.float32)
+        for group, (pos, group_scores, scored) in zip(groups, results):
+            found = pos >= 0
+            indices[group] = np.where(found, self.order[np.maximum(pos, 0)], -1)
+            scores[group] = np.where(found, group_scores, np.nan)
+            telemetry.count('similarity.rows_scored', scored * len(group))
+        telemetry.count('similarity.rows_total', len(self) * len(query_fps))
+        return indices, scores
+
+    def search_smiles(self, smiles, k=5, min_similarity=0.0, n_jobs=1, **search_kwargs) -> pd.DataFrame:
+        """
+        Top-k neighbours of each query SMILES as a long DataFrame (query, rank,
+        similarity, library row, SMILES, key and label of the neighbour). Queries
+        that fail to parse are reported and left out.
+        """
+        smiles = list(smiles)
+        query_fps, valid = fingerprint_smiles(smiles, self.radius, self.n_bits, n_jobs)
+        for s in np.asarray(smiles, dtype=object)[~valid]:
+            print(f"Skipping query: {s} (invalid SMILES)")
+        query_rows = np.flatnonzero(valid)
+        indices, scores = self.search(query_fps[query_rows], k, min_similarity, n_jobs, **search_kwargs)
+
+        query_idx, rank = np.nonzero(indices >= 0)
+        rows = indices[query_idx, rank]
+        return pd.DataFrame({
+            'query': np.asarray(smiles, dtype=object)[query_rows[query_idx]],
+            'rank': rank + 1,
+            'similarity': scores[query_idx, rank],
+            'index': rows,
+            'SMILES': np.asarray(self.smiles, dtype=object)[rows],
+            'key': np.asarray(self.keys, dtype=object)[rows],
+            'label': self.labels[rows] if self.labels is not None else np.nan,
+        })
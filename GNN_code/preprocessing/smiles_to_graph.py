@@ -7,52 +7,254 @@ Created on Wed May 14 10:16:57 2025
 """
 # preprocessing/smiles_to_graph.py
 
+import os
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
 import torch
 from torch_geometric.data import Data
 from rdkit import Chem
-from rdkit.Chem.rdmolops import GetAdjacencyMatrix
-from .featurisation import get_atom_features, get_bond_features
+import telemetry
+from .featurisation import get_atom_feature_matrix, get_bond_feature_matrix
+from .graph_cache import GraphCache, canonical_smiles, featuriser_version
 
+@telemetry.timed('molecule_to_graph')
 def molecule_to_graph(smiles: str, label=None) -> Data:
     """Convert a single SMILES to a PyTorch Geometric graph."""
-    mol = Chem.MolFromSmiles(smiles)
+    with telemetry.stage('molecule_to_graph.parse'):
+        mol = Chem.MolFromSmiles(smiles)
     if mol is None:
         raise ValueError(f"Invalid SMILES string: {smiles}")
-    
-    # Efficient atom feature tensor construction
-    atom_features = np.array([get_atom_features(atom) for atom in mol.GetAtoms()], dtype=np.float32)
-    x = torch.tensor(atom_features)
-
-    # Adjacency and edges
-    adj = GetAdjacencyMatrix(mol)
-    rows, cols = np.nonzero(adj)
-    edge_index = np.array([rows,cols], dtype=np.int64) 
-    edge_index = torch.tensor(edge_index) # edge_index refers to connectivity
-
-    # Edge features
-    edge_attr_list = []
-    for i, j in zip(rows, cols):
-        bond = mol.GetBondBetweenAtoms(int(i), int(j))
-        edge_attr_list.append(get_bond_features(bond))
-    edge_attr_array = np.array(edge_attr_list, dtype=np.float32)
-    edge_attr = torch.tensor(edge_attr_array) # edge_attr refer to bond characterisation 
+
+    with telemetry.stage('molecule_to_graph.featurise'):
+        # Atom features for the whole molecule in one preallocated float32 matrix
+        x = torch.from_numpy(get_atom_feature_matrix(mol))
+
+        # Edges from a single pass over the bonds: each bond is featurised once and
+        # its row shared by both directions. Sorting by (source, target) keeps the
+        # row-major order the dense adjacency matrix used to give.
+        bonds = list(mol.GetBonds())
+        begin = np.fromiter((bond.GetBeginAtomIdx() for bond in bonds), dtype=np.int64, count=len(bonds))
+        end = np.fromiter((bond.GetEndAtomIdx() for bond in bonds), dtype=np.int64, count=len(bonds))
+        rows = np.concatenate([begin, end])
+        cols = np.concatenate([end, begin])
+        bond_ids = np.tile(np.arange(len(bonds)), 2)
+        order = np.lexsort((cols, rows))
+        edge_index = torch.from_numpy(np.stack([rows[order], cols[order]])) # edge_index refers to connectivity
+
+        # Edge features
+        bond_features = get_bond_feature_matrix(bonds)
+        edge_attr = torch.from_numpy(bond_features[bond_ids[order]]) # edge_attr refer to bond characterisation 
 
     y_tensor = torch.tensor([label], dtype=torch.float) if label is not None else None
 
-    return Data(x=x, edge_index=edge_index, edge_attr=edge_attr, y=y_tensor)
+    return Data(x=x, edge_index=edge_index, edge_attr=edge_attr, y=y_tensor, smiles=smiles)
 
-def batch_from_csv(csv_path: str, smiles_col="SMILES", label_col="Inh Power") -> list:
-    """Convert a CSV with SMILES (and optional labels) into a list of Data graphs."""
-    df = pd.read_csv(csv_path)
-    data_list = []
-    for _, row in df.iterrows():
-        smiles = row[smiles_col]
-        label = row[label_col] if label_col else None
+def cached_molecule_to_graph(smiles: str, label, cache: GraphCache) -> Data:
+    """molecule_to_graph backed by a GraphCache keyed on canonical SMILES."""
+    key = canonical_smiles(smiles)
+    entry = cache.get(key)
+    if entry is None:
+        # Featurise the canonical form so cached and fresh graphs share one atom order
+        graph = molecule_to_graph(key)
+        cache.put(key, graph)
+        entry = {'x': graph.x, 'edge_index': graph.edge_index, 'edge_attr': graph.edge_attr}
+    y_tensor = torch.tensor([label], dtype=torch.float) if label is not None else None
+    return Data(x=entry['x'], edge_index=entry['edge_index'], edge_attr=entry['edge_attr'], y=y_tensor,
+                smiles=smiles)
+
+def _rows_from_frame(df, smiles_col, label_col) -> list:
+    """(smiles, label) pairs for every row of a DataFrame."""
+    labels = df[label_col].tolist() if label_col else [None] * len(df)
+    return list(zip(df[smiles_col].tolist(), labels))
+
+def featurise_chunk(rows, cache_dir=None):
+    """
+    Featurises a list of (smiles, label) pairs (the work unit of batch_from_csv
+    and models.predict, picklable for process pools). Returns one (graph, error)
+    pair per row, with graph None if the row failed, plus the cache hit/miss counts.
+    """
+    cache = GraphCache(cache_dir) if cache_dir else None
+    results = []
+    for smiles, label in rows:
         try:
-            graph = molecule_to_graph(smiles, label)
-            data_list.append(graph)
+            if cache is not None:
+                graph = cached_molecule_to_graph(smiles, label, cache)
+            else:
+                graph = molecule_to_graph(smiles, label)
+            results.append((graph, None))
         except Exception as e:
-            print(f"Skipping molecule: {smiles} due to error: {e}")
-    return data_list
+            results.append((None, str(e)))
+    hits, misses = (cache.hits, cache.misses) if cache is not None else (0, 0)
+    return results, hits, misses
+
+def _featurise_rows(rows, cache_dir=None, n_jobs=1, chunksize=256) -> list:
+    """
+    Featurises (smiles, label) rows, in a process pool if n_jobs > 1 (-1 for all
+    cores). Returns one graph (or None, after printing the error) per row, in order.
+    """
+    if n_jobs == -1:
+        n_jobs = os.cpu_count() or 1
+    chunks = [rows[i:i + chunksize] for i in range(0, len(rows), chunksize)]
+
+    if n_jobs > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=min(n_jobs, len(chunks))) as executor:
+            # executor.map yields chunk results in submission order
+            chunk_results = list(executor.map(featurise_chunk, chunks, [cache_dir] * len(chunks)))
+    else:
+        chunk_results = [featurise_chunk(chunk, cache_dir) for chunk in chunks]
+
+    graphs = []
+    hits = misses = 0
+    for chunk, (results, chunk_hits, chunk_misses) in zip(chunks, chunk_results):
+        hits += chunk_hits
+        misses += chunk_misses
+        for (smiles, _), (graph, error) in zip(chunk, results):
+            if graph is None:
+                print(f"Skipping molecule: {smiles} due to error: {error}")
+            graphs.append(graph)
+    if cache_dir:
+        print(f"Graph cache ({featuriser_version()}): {hits} hits, {misses} misses")
+    n_failed = sum(graph is None for graph in graphs)
+    telemetry.count('graphs.featurised', len(graphs) - n_failed)
+    telemetry.count('graphs.failed', n_failed)
+    telemetry.count('graph_cache.hits', hits)
+    telemetry.count('graph_cache.misses', misses)
+    return graphs
+
+@telemetry.timed('batch_from_csv')
+def batch_from_csv(csv_path: str, smiles_col="SMILES", label_col="Inh Power", cache_dir=None,
+                   n_jobs=1, chunksize=256, store_path=None, key_col="CAS Number"):
+    """
+    Convert a CSV with SMILES (and optional labels) into a list of Data graphs.
+    If cache_dir is given, featurised graphs are reused across runs (see graph_cache.py).
+    With n_jobs > 1 (or n_jobs=-1 for all cores) molecules are featurised in a process
+    pool, chunksize rows per work unit; the output order matches the CSV either way.
+    With store_path, runs incrementally against a packed store instead (see
+    update_graph_store) and returns it as a PackedGraphDataset.
+    """
+    if store_path is not None:
+        return update_graph_store(csv_path, store_path, smiles_col, label_col, key_col, cache_dir, n_jobs, chunksize)
+    df = pd.read_csv(csv_path)
+    rows = _rows_from_frame(df, smiles_col, label_col)
+    return [graph for graph in _featurise_rows(rows, cache_dir, n_jobs, chunksize) if graph is not None]
+
+def _row_keys(df, smiles_col, key_col) -> list:
+    """
+    Identity of every CSV row: its key_col value (e.g. CAS Number) if the column
+    exists, else its canonical SMILES. Repeated keys get a #n suffix so every row
+    has its own key.
+    """
+    if key_col and key_col in df.columns:
+        keys = df[key_col].astype(str).str.strip().tolist()
+    else:
+        keys = []
+        for smiles in df[smiles_col].tolist():
+            try:
+                keys.append(canonical_smiles(smiles))
+            except Exception:
+                keys.append(str(smiles))
+    seen = {}
+    unique_keys = []
+    for key in keys:
+        seen[key] = seen.get(key, 0) + 1
+        unique_keys.append(key if seen[key] == 1 else f"{key}#{seen[key]}")
+    return unique_keys
+
+def _same_molecule(a, b) -> bool:
+    if a == b:
+        return True
+    try:
+        return canonical_smiles(a) == canonical_smiles(b)
+    except Exception:
+        return False
+
+def update_graph_store(csv_path: str, store_path: str, smiles_col="SMILES", label_col="Inh Power",
+                       key_col="CAS Number", cache_dir=None, n_jobs=1, chunksize=256):
+    """
+    Brings the packed graph store at store_path (preprocessing/packed_store.py) up
+    to date with a CSV, featurising only the rows that are new or changed since the
+    previous run. Rows are matched by key_col (CAS Number; canonical SMILES if the
+    column is missing) and count as changed if their canonical SMILES differs.
+      - only new rows: they are appended to the store
+      - changed, relabelled or removed rows: the store is rewritten from the
+        unchanged graphs already in it plus the newly featurised ones
+    A store built with a different featuriser version is rebuilt from scratch.
+    Rows without a SMILES are ignored; rows that fail to featurise are skipped
+    (and retried on the next run). Returns the up-to-date PackedGraphDataset.
+    """
+    from .packed_store import PackedGraphDataset, append_graphs, rewrite_graphs
+
+    df = pd.read_csv(csv_path)
+    df = df[df[smiles_col].notna()].reset_index(drop=True)
+    rows = _rows_from_frame(df, smiles_col, label_col)
+    keys = _row_keys(df, smiles_col, key_col)
+
+    store = None
+    if os.path.exists(os.path.join(store_path, "meta.json")):
+        store = PackedGraphDataset(store_path)
+        if store.keys is None or store.smiles is None:
+            raise ValueError(f"{store_path} was not written by update_graph_store (it has no row keys)")
+    # Graphs from another featuriser version cannot be reused: re-featurise every row
+    stale = store is not None and store.meta.get('featuriser_version') != featuriser_version()
+    if stale:
+        print(f" {store_path} was featurised with {store.meta.get('featuriser_version')}, current featuriser is "
+              f"{featuriser_version()}: rebuilding it")
+    previous = {key: i for i, key in enumerate(store.keys)} if store is not None and not stale else {}
+
+    todo, kept, relabelled = [], {}, 0
+    for i, (key, (smiles, label)) in enumerate(zip(keys, rows)):
+        j = previous.get(key)
+        if j is None or not _same_molecule(smiles, store.smiles[j]):
+            todo.append(i)
+            continue
+        kept[i] = j
+        if store.y is not None and label is not None and not np.isclose(store.y[j], label, equal_nan=True):
+            relabelled += 1
+    changed = sum(keys[i] in previous for i in todo)
+    removed = len(set(previous) - set(keys))
+    print(f" {len(kept)} rows unchanged, {len(todo) - changed} new, {changed} changed, {relabelled} relabelled, "
+          f"{removed} removed")
+
+    new_graphs = dict(zip(todo, _featurise_rows([rows[i] for i in todo], cache_dir, n_jobs, chunksize)))
+    new_graphs = {i: graph for i, graph in new_graphs.items() if graph is not None}
+
+    if store is not None and not (stale or changed or relabelled or removed):
+        order = sorted(new_graphs)
+        append_graphs([new_graphs[i] for i in order], store_path, keys=[keys[i] for i in order])
+    else:
+        # Rewrite in CSV order; unchanged graphs are copied out of the old store, not re-featurised
+        graphs, graph_keys = [], []
+        for i, (smiles, label) in enumerate(rows):
+            if i in kept:
+                graph = store.get(kept[i])
+                graph.smiles = smiles
+                graph.y = torch.tensor([label], dtype=torch.float) if label is not None else None
+            elif i in new_graphs:
+                graph = new_graphs[i]
+            else:
+                continue
+            graphs.append(graph)
+            graph_keys.append(keys[i])
+        del store
+        rewrite_graphs(graphs, store_path, keys=graph_keys)
+    return PackedGraphDataset(store_path)
+
+def iter_graphs_from_csv(csv_path: str, smiles_col="SMILES", label_col="Inh Power", cache_dir=None,
+                         chunksize=10_000, chunk_filter=None):
+    """
+    Lazily yields Data graphs from a CSV, reading and featurising chunksize rows at a
+    time, so memory use is bounded by one chunk rather than the whole file.
+    chunk_filter(chunk_idx) -> bool can be used to skip chunks (e.g. worker sharding).
+    """
+    reader = pd.read_csv(csv_path, chunksize=chunksize)
+    for chunk_idx, df in enumerate(reader):
+        if chunk_filter is not None and not chunk_filter(chunk_idx):
+            continue
+        rows = _rows_from_frame(df, smiles_col, label_col)
+        results, _, _ = featurise_chunk(rows, cache_dir)
+        for (smiles, _), (graph, error) in zip(rows, results):
+            if graph is None:
+                print(f"Skipping molecule: {smiles} due to error: {error}")
+            else:
+                yield graph
@@ -0,0 +1,73 @@
+# preprocessing/streaming.py
+
+# Iterable dataset over a SMILES CSV for datasets that do not fit in memory.
+# Graphs are featurised chunk by chunk as the DataLoader asks for them, so the
+# full graph list is never materialised.
+
+import random
+from torch.utils.data import IterableDataset, get_worker_info
+from .featurisation import n_atom_features, n_bond_features
+from .smiles_to_graph import iter_graphs_from_csv
+
+class GraphStreamDataset(IterableDataset):
+    """
+    Streams Data graphs from csv_path. Works with torch_geometric.loader.DataLoader
+    (leave shuffle=False there; use shuffle_buffer instead). With num_workers > 0
+    each worker featurises a disjoint subset of the CSV chunks.
+    """
+    def __init__(self, csv_path, smiles_col="SMILES", label_col="Inh Power", cache_dir=None,
+                 chunksize=10_000, shuffle_buffer=0, seed=None):
+        super().__init__()
+        self.csv_path = csv_path
+        self.smiles_col = smiles_col
+        self.label_col = label_col
+        self.cache_dir = cache_dir
+        self.chunksize = chunksize
+        self.shuffle_buffer = shuffle_buffer
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch: int) -> None:
+        """Sets the shuffle epoch explicitly (needed with num_workers > 0, where
+        the per-pass counter lives in short-lived worker copies)."""
+        self.epoch = epoch
+
+    # Feature sizes are fixed by the featuriser, so they are known without reading the CSV
+    @property
+    def num_node_features(self) -> int:
+        return n_atom_features()
+
+    @property
+    def num_edge_features(self) -> int:
+        return n_bond_features()
+
+    def _graphs(self):
+        worker = get_worker_info()
+        chunk_filter = None
+        if worker is not None and worker.num_workers > 1:
+            chunk_filter = lambda idx: idx % worker.num_workers == worker.id
+        return iter_graphs_from_csv(self.csv_path, self.smiles_col, self.label_col,
+                                    self.cache_dir, self.chunksize, chunk_filter)
+
+    def __iter__(self):
+        graphs = self._graphs()
+        if not self.shuffle_buffer:
+            yield from graphs
+            return
+
+        # Approximate shuffling: keep a buffer of graphs and emit a random one each step.
+        # A new seed per pass gives a different order every epoch.
+        worker = get_worker_info()
+        worker_id = worker.id if worker is not None else 0
+        rng = random.Random(None if self.seed is None else hash((self.seed, self.epoch, worker_id)))
+        self.epoch += 1
+        buffer = []
+        for graph in graphs:
+            if len(buffer) < self.shuffle_buffer:
+                buffer.append(graph)
+                continue
+            idx = rng.randrange(len(buffer))
+            yield buffer[idx]
+            buffer[idx] = graph
+        rng.shuffle(buffer)
+        yield from buffer
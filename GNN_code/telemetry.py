@@ -0,0 +1,218 @@
+# telemetry.py
+
+# Opt-in instrumentation for the pipeline: per-stage wall-clock timers, counters,
+# peak memory and optional torch.profiler traces, written to a structured JSON
+# lines log. Instrumented stages:
+#   resolve_smiles (.lookup, .manual)    preprocessing/fetch_smiles.py
+#   molecule_to_graph (.parse, .featurise), batch_from_csv
+#                                        preprocessing/smiles_to_graph.py
+#   dataloader, forward, backward, optimizer_step, epoch records
+#                                        models/engine.py (fit)
+#   plot_predictions                     models/*.py
+#
+# Telemetry is off by default. Turn it on with enable(...) or by setting the
+# GNN_TELEMETRY environment variable (to 1 or to a log path). While disabled,
+# stage() returns a shared no-op context manager and timed functions are called
+# directly, so the instrumentation costs one flag check per call.
+#
+# Stats are collected per process: with n_jobs > 1, batch_from_csv is timed as a
+# whole but the molecule_to_graph calls inside pool workers are not.
+#
+#   import telemetry
+#   telemetry.enable("data/logs/telemetry.jsonl", trace_dir="data/logs/traces")
+#   ... run ...
+#   telemetry.report()   # prints the table and appends the summary to the log
+
+import contextlib
+import functools
+import json
+import os
+import sys
+import time
+
+_NULL_CONTEXT = contextlib.nullcontext()
+
+class _State:
+    def __init__(self):
+        self.enabled = False
+        self.log_path = None
+        self.trace_dir = None
+        self.sync_cuda = False
+        # name -> [calls, total seconds, max seconds, peak RSS in MB at exit (None if unavailable)]
+        self.stages = {}
+        self.counters = {}
+
+_state = _State()
+
+def _torch():
+    """torch if something has already imported it, else None (stage timers never import it themselves)."""
+    return sys.modules.get("torch")
+
+def _cuda_available() -> bool:
+    torch = _torch()
+    return torch is not None and torch.cuda.is_available()
+
+def is_enabled() -> bool:
+    return _state.enabled
+
+def enable(log_path="data/logs/telemetry.jsonl", trace_dir=None, sync_cuda=True) -> None:
+    """
+    Starts collecting telemetry (clearing earlier stats). Events and summaries are
+    appended to log_path as JSON lines; with trace_dir, profile() blocks export
+    Chrome traces there. sync_cuda synchronises the GPU at stage boundaries so
+    timings cover the kernels rather than their launch.
+    """
+    _state.enabled = True
+    _state.log_path = log_path
+    _state.trace_dir = trace_dir
+    _state.sync_cuda = sync_cuda and _cuda_available()
+    reset()
+
+def disable() -> None:
+    _state.enabled = False
+
+def reset() -> None:
+    _state.stages = {}
+    _state.counters = {}
+    if _cuda_available():
+        _torch().cuda.reset_peak_memory_stats()
+
+def _peak_rss_mb():
+    """Peak resident set size of the process in MB, or None where there is no resource module (Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 ** 2 if sys.platform == "darwin" else 1024)
+
+def _record(name, seconds):
+    entry = _state.stages.get(name)
+    if entry is None:
+        entry = _state.stages[name] = [0, 0.0, 0.0, None]
+    entry[0] += 1
+    entry[1] += seconds
+    entry[2] = max(entry[2], seconds)
+    rss = _peak_rss_mb()
+    if rss is not None:
+        entry[3] = max(entry[3] or 0.0, rss)
+
+@contextlib.contextmanager
+def _timed_stage(name):
+    torch = _torch()
+    sync = _state.sync_cuda
+    if sync:
+        torch.cuda.synchronize()
+    # Label the stage in profiler traces while a profiler is running
+    profiling = torch is not None and torch.autograd._profiler_enabled()
+    with torch.profiler.record_function(name) if profiling else _NULL_CONTEXT:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if sync:
+                torch.cuda.synchronize()
+            _record(name, time.perf_counter() - start)
+
+def stage(name: str):
+    """Context manager timing one occurrence of a stage (a no-op while disabled)."""
+    return _timed_stage(name) if _state.enabled else _NULL_CONTEXT
+
+def timed(name: str):
+    """Decorator: times every call of the function as stage name."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _state.enabled:
+                return fn(*args, **kwargs)
+            with _timed_stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def count(name: str, n=1) -> None:
+    """Adds n to counter name."""
+    if _state.enabled:
+        _state.counters[name] = _state.counters.get(name, 0) + n
+
+def iter_stage(name: str, iterable):
+    """Iterates over iterable, timing every next() call (e.g. DataLoader batches) as stage name."""
+    if not _state.enabled:
+        return iterable
+    return _timed_iter(name, iterable)
+
+def _timed_iter(name, iterable):
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        _record(name, time.perf_counter() - start)
+        yield item
+
+def log_event(event: str, **fields) -> None:
+    """Appends one structured record to the telemetry log."""
+    if not (_state.enabled and _state.log_path):
+        return
+    os.makedirs(os.path.dirname(_state.log_path) or ".", exist_ok=True)
+    record = {'time': time.strftime("%Y-%m-%dT%H:%M:%S"), 'event': event, 'pid': os.getpid(), **fields}
+    with open(_state.log_path, "a") as f:
+        f.write(json.dumps(record, default=float) + "\n")
+
+@contextlib.contextmanager
+def profile(name: str, when=True):
+    """
+    Runs the block under torch.profiler (CPU, and CUDA if available) and exports a
+    Chrome trace to trace_dir/<name>.json. A no-op unless telemetry is enabled
+    with a trace_dir (and when is true).
+    """
+    if not (when and _state.enabled and _state.trace_dir):
+        yield
+        return
+    import torch
+    activities = [torch.profiler.ProfilerActivity.CPU]
+    if torch.cuda.is_available():
+        activities.append(torch.profiler.ProfilerActivity.CUDA)
+    with torch.profiler.profile(activities=activities, record_shapes=True, profile_memory=True) as prof:
+        yield
+    os.makedirs(_state.trace_dir, exist_ok=True)
+    trace_path = os.path.join(_state.trace_dir, f"{name}.json")
+    prof.export_chrome_trace(trace_path)
+    log_event('trace', name=name, path=trace_path)
+    print(f" Profiler trace saved to: {trace_path}")
+
+def summary() -> dict:
+    """Stage timings, counters and peak memory collected so far."""
+    stages = {name: {'calls': calls, 'total_s': total, 'mean_s': total / calls, 'max_s': longest,
+                     'peak_rss_mb': rss}
+              for name, (calls, total, longest, rss) in _state.stages.items()}
+    rss = _peak_rss_mb()
+    memory = {'peak_rss_mb': rss} if rss is not None else {}
+    if _cuda_available():
+        memory['peak_cuda_mb'] = _torch().cuda.max_memory_allocated() / 1024 ** 2
+    return {'stages': stages, 'counters': dict(_state.counters), 'memory': memory}
+
+def report() -> dict:
+    """Prints the stage table (slowest first), logs the summary and returns it."""
+    result = summary()
+    if not result['stages'] and not result['counters']:
+        return result
+    print(f"{'stage':>28} {'calls':>9} {'total s':>10} {'mean ms':>10} {'max ms':>10}")
+    for name, s in sorted(result['stages'].items(), key=lambda item: -item[1]['total_s']):
+        print(f"{name:>28} {s['calls']:>9} {s['total_s']:>10.3f} {1e3 * s['mean_s']:>10.3f} {1e3 * s['max_s']:>10.3f}")
+    for name, value in result['counters'].items():
+        print(f"{name:>28} {value:>9}")
+    if result['memory']:
+        print(f"{'peak memory':>28} " + ", ".join(f"{k} {v:.0f}" for k, v in result['memory'].items()))
+    log_event('summary', **result)
+    return result
+
+# Opt in from the environment: GNN_TELEMETRY=1 (default log path) or GNN_TELEMETRY=<log path>
+if os.environ.get("GNN_TELEMETRY"):
+    if os.environ["GNN_TELEMETRY"] in ("1", "true", "yes"):
+        enable()
+    else:
+        enable(os.environ["GNN_TELEMETRY"])
@@ -0,0 +1,39 @@
+# tests/test_engine.py
+
+import pytest
+import torch
+from models.engine import fit, make_loader
+from models.gcn_model import GCNModel
+from preprocessing.smiles_to_graph import molecule_to_graph
+
+SMILES = ["CCO", "CCN", "CCC", "c1ccccc1", "c1ccccc1O", "CC(=O)O", "CC(=O)Nc1ccc(O)cc1", "OCCO", "CCCCCC", "C#N",
+          "CN(C)C", "c1ccncc1"]
+
+@pytest.fixture(scope="module")
+def graphs():
+    return [molecule_to_graph(s, label=float(i % 4)) for i, s in enumerate(SMILES * 3)]
+
+def _train(graphs, tmp_path, name, loader_kwargs, interrupt_after=None, resume=False):
+    torch.manual_seed(0)
+    model = GCNModel(graphs[0].x.size(1), 16)
+    loader = make_loader(graphs[:30], batch_size=4, seed=0, **loader_kwargs)
+    val_loader = make_loader(graphs[30:], shuffle=False)
+    if resume:
+        torch.manual_seed(123) # the RNG state must come from the checkpoint, not from here
+    history = fit(model, loader, lr=1e-2, epochs=16, log_every=0, val_loader=val_loader, patience=4,
+                  checkpoint_path=str(tmp_path / f"{name}.pt"), checkpoint_every=1, resume=resume,
+                  on_epoch_end=(lambda epoch, record: epoch == interrupt_after) if interrupt_after else None)
+    return model, history
+
+@pytest.mark.parametrize("loader_kwargs", [{}, {'max_nodes': 40}])
+def test_resumed_fit_matches_uninterrupted_fit(graphs, tmp_path, loader_kwargs):
+    straight, straight_history = _train(graphs, tmp_path, "straight", loader_kwargs)
+    _train(graphs, tmp_path, "resumed", loader_kwargs, interrupt_after=5)
+    resumed, resumed_history = _train(graphs, tmp_path, "resumed", loader_kwargs, resume=True)
+
+    best_epoch = lambda history: min((r for r in history if 'val_rmse' in r), key=lambda r: r['val_rmse'])['epoch']
+    assert len(resumed_history) == len(straight_history)
+    assert best_epoch(resumed_history) == best_epoch(straight_history)
+    assert [r['loss'] for r in resumed_history] == pytest.approx([r['loss'] for r in straight_history])
+    for key, value in straight.state_dict().items():
+        torch.testing.assert_close(resumed.state_dict()[key], value)
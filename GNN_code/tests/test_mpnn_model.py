@@ -0,0 +1,40 @@
+# tests/test_mpnn_model.py
+
+import pytest
+import torch
+from torch_geometric.data import Batch
+from models.mpnn_model import MPNNModel
+from preprocessing.smiles_to_graph import molecule_to_graph
+
+SMILES = ["CCO", "c1ccccc1O", "CC(=O)Nc1ccc(O)cc1", "C#N"]
+
+def _models(graphs, num_layers=2):
+    in_channels, edge_dim = graphs[0].x.size(1), graphs[0].edge_attr.size(1)
+    torch.manual_seed(0)
+    dense = MPNNModel(in_channels, edge_dim, hidden_dim=16, num_layers=num_layers, edge_mode='dense').eval()
+    dedup = MPNNModel(in_channels, edge_dim, hidden_dim=16, num_layers=num_layers, edge_mode='dedup').eval()
+    dedup.load_state_dict(dense.state_dict())
+    return dense, dedup
+
+def _forward(model, batch):
+    with torch.no_grad():
+        return model(batch.x, batch.edge_index, batch.edge_attr, batch.batch)
+
+@pytest.mark.parametrize("smiles", [
+    SMILES,
+    ["C"],                        # single atom, no bonds
+    ["[Na+].[Cl-]", "C"],         # edgeless batch of several graphs
+    ["[Na+].[Cl-]"] + SMILES,     # edgeless graph mixed with bonded ones
+])
+def test_dedup_matches_dense(smiles):
+    graphs = [molecule_to_graph(s, label=0.0) for s in smiles]
+    batch = Batch.from_data_list(graphs)
+    dense, dedup = _models(graphs)
+    torch.testing.assert_close(_forward(dedup, batch), _forward(dense, batch), rtol=1e-5, atol=1e-5)
+
+def test_dedup_bmm_branch_matches_dense():
+    # A single molecule has more nodes * edge types than edges, so the bmm path is taken
+    graphs = [molecule_to_graph("CC(=O)Nc1ccc(O)cc1", label=0.0)]
+    batch = Batch.from_data_list(graphs)
+    dense, dedup = _models(graphs, num_layers=1)
+    torch.testing.assert_close(_forward(dedup, batch), _forward(dense, batch), rtol=1e-5, atol=1e-5)
@@ -1,15 +1,22 @@
     
 # train_mpnn.py
+
+# Runs the whole chain in one go; `python cli.py resolve`, `featurise` and `train mpnn`
+# run the same stages one at a time.
 from preprocessing.fetch_smiles import resolve_smiles_by_cas_interactive
 from preprocessing.smiles_to_graph import batch_from_csv
 from models.train import train_model
 
 if __name__ == "__main__":
     # Produce SMILES strings from CAS numbers
-    df = resolve_smiles_by_cas_interactive("data/raw/Ozkan_data_2024.xlsx", "data/processed/input.csv")
+    # (incremental: only compounds added or edited since the last run are resolved)
+    df = resolve_smiles_by_cas_interactive("data/raw/Ozkan_data_2024.xlsx", "data/processed/input.csv",
+                                           incremental=True)
     
-    # Convert smiles strings in the CSV file to a list of PyTorch graphs
-    graph_list = batch_from_csv("data/processed/input.csv")
+    # Convert smiles strings in the CSV file to PyTorch graphs, kept in a packed store
+    # that only new or changed molecules are featurised into
+    graph_list = batch_from_csv("data/processed/input.csv", cache_dir="data/cache/graphs",
+                                store_path="data/processed/graph_store")
     
     # Train the model on the graph list
     train_model(graph_list)